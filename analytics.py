@@ -0,0 +1,245 @@
+"""The whole universe's sentiment history as days x symbols matrices, and the days that stand out in it.
+
+load() reads every symbol's daily sentiment in one query. For each day and
+symbol, against the symbol's own last `window` days with results:
+
+- zscore: how far the day's average sentiment is from the trailing mean, in
+  trailing standard deviations
+- shock: the z-score weighted by sqrt(count / usual count), as an average
+  over more chunks than usual is that much less likely to be noise
+- rank: where the shock falls among every symbol's that day, from 0 to 1
+
+The trailing sums come from cumulative sums over the whole history at once.
+append() adds a day from running sums over the window, so a daily update
+only computes the new row. anomalies() lists the biggest shocks with the
+day's price move from the cached info.
+"""
+import bisect
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import storage
+from storage import DEFAULT_DB_URL
+
+# Below this a symbol's sentiment hasn't varied enough for a z-score to mean anything
+_MIN_STD = 1e-6
+# Matrices kept per day and symbol, with what a day without results holds
+_MATRICES = {'_average': np.nan, '_count': 0.0, '_zscore': np.nan, '_shock': np.nan, '_rank': np.nan,
+             '_price': np.nan}
+
+
+def _rank(shock: np.ndarray) -> np.ndarray:
+    return pd.DataFrame(shock).rank(axis=1, pct=True).to_numpy()
+
+
+class SentimentAnalytics:
+    """Daily sentiment, z-scores, shocks, ranks and price moves for every symbol, one row per day"""
+
+    def __init__(self, symbols: Iterable[str] = (), window: int = 20, min_periods: int = 5, capacity: int = 256):
+        if not 2 <= min_periods <= window:
+            raise ValueError(f"min_periods {min_periods} must be between 2 and the window, {window}")
+        self.window = window
+        self.min_periods = min_periods
+        self.symbols: List[str] = []
+        self._columns: Dict[str, int] = {}
+        self.days: List[date] = []
+        for name, fill in _MATRICES.items():
+            setattr(self, name, np.full((capacity, 0), fill))
+        # Sums over the last window days, what append() scores the next one against
+        self._sum = np.zeros(0)
+        self._sumsq = np.zeros(0)
+        self._observed = np.zeros(0)
+        self._volume = np.zeros(0)
+        self._add_symbols(symbols)
+
+    @classmethod
+    def from_rows(cls, rows: List[Tuple[str, date, int, Optional[float]]],
+                  prices: Iterable[Tuple[str, date, float]] = (), window: int = 20,
+                  min_periods: int = 5) -> 'SentimentAnalytics':
+        """Analytics over (symbol, date, count, average) rows, as storage.load_daily_sentiment gives them."""
+        symbols, days, counts, averages = zip(*rows) if rows else ((), (), (), ())
+        # Every row's place in the matrices, from one pass over each column
+        day_rows, days = pd.factorize(np.array(days, dtype=object), sort=True)
+        symbol_columns, symbols = pd.factorize(np.array(symbols, dtype=object), sort=True)
+        analytics = cls(symbols, window, min_periods, capacity=max(len(days), 1) * 2)
+        analytics.days = list(days)
+        counts = np.array(counts, dtype=float)
+        analytics._count[day_rows, symbol_columns] = counts
+        with np.errstate(invalid='ignore'):
+            analytics._average[day_rows, symbol_columns] = np.where(counts > 0, np.array(averages, dtype=float),
+                                                                     np.nan)
+        analytics.set_prices(prices)
+        analytics._compute()
+        return analytics
+
+    def _add_symbols(self, symbols: Iterable[str]):
+        new = [symbol for symbol in dict.fromkeys(symbols) if symbol not in self._columns]
+        if not new:
+            return
+        for symbol in new:
+            self._columns[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        for name, fill in _MATRICES.items():
+            matrix = getattr(self, name)
+            setattr(self, name, np.hstack([matrix, np.full((matrix.shape[0], len(new)), fill)]))
+        for name in ('_sum', '_sumsq', '_observed', '_volume'):
+            setattr(self, name, np.concatenate([getattr(self, name), np.zeros(len(new))]))
+
+    def _reserve(self, rows: int):
+        capacity = self._average.shape[0]
+        if rows <= capacity:
+            return
+        extra = max(rows, capacity * 2) - capacity
+        for name, fill in _MATRICES.items():
+            matrix = getattr(self, name)
+            setattr(self, name, np.vstack([matrix, np.full((extra, matrix.shape[1]), fill)]))
+
+    def _scores(self, average, count, total, squares, observed, volume, days):
+        """z-scores and shocks of average and count against trailing sums over days days."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / observed
+            std = np.sqrt(np.maximum((squares - total * mean) / (observed - 1), 0))
+            zscore = (average - mean) / std
+            zscore[(observed < self.min_periods) | ~(std > _MIN_STD)] = np.nan
+            usual = np.maximum(volume / np.maximum(days, 1), 1.0)
+            shock = zscore * np.sqrt(count / usual)
+        return zscore, shock
+
+    def _compute(self):
+        """Score every day at once from cumulative sums."""
+        rows = len(self.days)
+        average, count = self._average[:rows], self._count[:rows]
+        observed = ~np.isnan(average)
+        values = np.where(observed, average, 0.0)
+        first = np.maximum(np.arange(rows + 1) - self.window, 0)
+
+        def trailing(matrix):
+            # Row i is the sum of rows i - window to i - 1, row rows the window after the last day
+            sums = np.vstack([np.zeros((1, matrix.shape[1])), np.cumsum(matrix, axis=0)])
+            return sums - sums[first]
+
+        total, squares, seen, volume = (trailing(matrix) for matrix in (values, values ** 2, observed, count))
+        days = np.minimum(np.arange(rows), self.window)[:, None]
+        self._zscore[:rows], self._shock[:rows] = self._scores(average, count, total[:rows], squares[:rows],
+                                                               seen[:rows], volume[:rows], days)
+        self._rank[:rows] = _rank(self._shock[:rows])
+        self._sum, self._sumsq, self._observed, self._volume = total[rows], squares[rows], seen[rows], volume[rows]
+
+    def append(self, day: date, results: Dict[str, Dict], price_changes: Optional[Dict[str, float]] = None):
+        """Add a day's {'count', 'average'} per symbol, as saved by storage.save_sentiment, scoring only it."""
+        if self.days and day <= self.days[-1]:
+            raise ValueError(f"{day} is not after the last day, {self.days[-1]}")
+        self._add_symbols(list(results) + list(price_changes or {}))
+        row = len(self.days)
+        self._reserve(row + 1)
+        for symbol, result in results.items():
+            column = self._columns[symbol]
+            self._count[row, column] = result.get('count') or 0
+            if result.get('count'):
+                self._average[row, column] = result['average']
+        for symbol, change in (price_changes or {}).items():
+            self._price[row, self._columns[symbol]] = change
+
+        average, count = self._average[row], self._count[row]
+        self._zscore[row], self._shock[row] = self._scores(average, count, self._sum, self._sumsq, self._observed,
+                                                           self._volume, min(row, self.window))
+        self._rank[row] = _rank(self._shock[row][None, :])[0]
+
+        # Slide the window on to end at this day
+        observed = ~np.isnan(average)
+        values = np.where(observed, average, 0.0)
+        self._sum = self._sum + values
+        self._sumsq = self._sumsq + values ** 2
+        self._observed = self._observed + observed
+        self._volume = self._volume + count
+        if row >= self.window:
+            dropped = self._average[row - self.window]
+            seen = ~np.isnan(dropped)
+            dropped = np.where(seen, dropped, 0.0)
+            self._sum -= dropped
+            self._sumsq -= dropped ** 2
+            self._observed -= seen
+            self._volume -= self._count[row - self.window]
+        self.days.append(day)
+
+    def update(self, day: Optional[date] = None, db_url: str = DEFAULT_DB_URL):
+        """append() the day's results and price moves from the database."""
+        day = day or date.today()
+        results = {symbol: {'count': count, 'average': average}
+                   for symbol, _, count, average in storage.load_daily_sentiment(day, day, db_url)}
+        prices = {symbol: change for symbol, _, change in storage.load_price_moves(day, day, db_url)}
+        self.append(day, results, prices)
+
+    def set_prices(self, prices: Iterable[Tuple[str, date, float]]):
+        """Fill in (symbol, date, change) price moves for the days and symbols already loaded."""
+        prices = list(prices)
+        if not prices:
+            return
+        symbols, days, changes = zip(*prices)
+        rows = pd.Index(self.days).get_indexer(np.array(days, dtype=object))
+        columns = pd.Index(self.symbols).get_indexer(np.array(symbols, dtype=object))
+        known = (rows >= 0) & (columns >= 0)
+        self._price[rows[known], columns[known]] = np.array(changes, dtype=float)[known]
+
+    def _frame(self, matrix: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(matrix[:len(self.days)], index=pd.Index(self.days, name='date'),
+                            columns=pd.Index(self.symbols, name='symbol'))
+
+    @property
+    def average(self) -> pd.DataFrame:
+        return self._frame(self._average)
+
+    @property
+    def count(self) -> pd.DataFrame:
+        return self._frame(self._count)
+
+    @property
+    def zscore(self) -> pd.DataFrame:
+        return self._frame(self._zscore)
+
+    @property
+    def shock(self) -> pd.DataFrame:
+        return self._frame(self._shock)
+
+    @property
+    def rank(self) -> pd.DataFrame:
+        return self._frame(self._rank)
+
+    @property
+    def price_change(self) -> pd.DataFrame:
+        return self._frame(self._price)
+
+    def anomalies(self, threshold: float = 3.0, min_count: int = 3, since: Optional[date] = None) -> pd.DataFrame:
+        """Symbol-days with a shock of at least threshold either way, biggest first, with the day's price move.
+
+        divergent marks sentiment moving against the price, which is where an
+        opportunity might be if the price follows.
+        """
+        first, rows = bisect.bisect_left(self.days, since) if since else 0, len(self.days)
+        with np.errstate(invalid='ignore'):
+            flagged = (np.abs(self._shock[first:rows]) >= threshold) & (self._count[first:rows] >= min_count)
+        at = np.nonzero(flagged)
+        at = (at[0] + first, at[1])
+        frame = pd.DataFrame({
+            'date': np.array(self.days, dtype=object)[at[0]],
+            'symbol': np.array(self.symbols, dtype=object)[at[1]],
+            'count': self._count[at].astype(int),
+            'average': self._average[at],
+            'zscore': self._zscore[at],
+            'shock': self._shock[at],
+            'rank': self._rank[at],
+            'price_change': self._price[at],
+        })
+        frame['divergent'] = frame['shock'] * frame['price_change'] < 0
+        return frame.sort_values('shock', key=np.abs, ascending=False, ignore_index=True)
+
+
+def load(start: Optional[date] = None, end: Optional[date] = None, db_url: str = DEFAULT_DB_URL,
+         window: int = 20, min_periods: int = 5) -> SentimentAnalytics:
+    """Analytics over the stored history between start and end, by default the last year."""
+    start = start or (end or date.today()) - timedelta(days=365)
+    return SentimentAnalytics.from_rows(storage.load_daily_sentiment(start, end, db_url),
+                                        storage.load_price_moves(start, end, db_url), window, min_periods)
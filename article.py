@@ -1,56 +1,150 @@
 from dataclasses import dataclass, field
-from transformers import pipeline
+import logging
+from typing import Iterable, List
 import re
-import torch
+
+import metrics
+import models
+
+logger = logging.getLogger(__name__)
+
+
+# Sentiment labels and the score each one contributes
+LABEL_TO_SCORE = {
+    "very negative": -1.0,
+    "negative": -0.5,
+    "neutral": 0.0,
+    "positive": 0.5,
+    "very positive": 1.0
+}
+
+# Number of chunks sent through the pipeline together when scoring in bulk
+SENTIMENT_BATCH_SIZE = 16
+
+
+def clean_text(text: str) -> str:
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def weighted_score(result) -> float:
+    """Collapse a zero-shot result into a single score between -1 and 1."""
+    total_score = 0.0
+    total_weight = 0.0
+
+    for label, score in zip(result['labels'], result['scores']):
+        total_score += LABEL_TO_SCORE[label] * score
+        total_weight += score
+
+    return total_score / total_weight if total_weight != 0 else 0
+
+
+def analyze_chunk(text: str) -> float:
+    """Analyze the sentiment of a single text chunk."""
+    if not text:
+        return 0
+        
+    try:
+        # Clean the text
+        text = clean_text(text)
+
+        # Run the pipeline
+        result, = models.classify([text], list(LABEL_TO_SCORE.keys()))
+
+        return weighted_score(result)
+        
+    except Exception as e:
+        logger.warning("Error analyzing text: %s", e)
+        metrics.inc('errors_total', stage='sentiment')
+        return 0
+
+
+# Replaces zero-shot scoring in score_texts when set, see set_scorer
+_scorer = None
+
+
+def set_scorer(scorer):
+    """Score chunks with scorer.score_texts(texts, batch_size) instead, None for plain zero-shot."""
+    global _scorer
+    _scorer = scorer
+
+
+def get_scorer():
+    return _scorer
+
+
+def score_texts(texts: List[str], batch_size: int = SENTIMENT_BATCH_SIZE) -> List[float]:
+    """Score many chunks, with the configured scorer if there is one."""
+    metrics.inc('chunks_scored_total', len(texts))
+    with metrics.timer('sentiment_seconds'):
+        if _scorer is not None:
+            return _scorer.score_texts(texts, batch_size)
+        return zero_shot_scores(texts, batch_size)
+
+
+def zero_shot_scores(texts: List[str], batch_size: int = SENTIMENT_BATCH_SIZE) -> List[float]:
+    """Score many chunks with batched pipeline calls.
+
+    Chunks are sorted by length before batching so each batch pads to a similar
+    length, then the scores are put back in the original order. Chunks already
+    in the inference cache skip the model.
+    """
+    scores = [0.0] * len(texts)
+    cleaned = sorted(
+        ((i, clean_text(text)) for i, text in enumerate(texts) if text),
+        key=lambda item: len(item[1])
+    )
+    labels = list(LABEL_TO_SCORE.keys())
+
+    for start in range(0, len(cleaned), batch_size):
+        batch = cleaned[start:start + batch_size]
+        try:
+            with metrics.timer('sentiment_batch_seconds'):
+                results = models.classify([text for _, text in batch], labels, batch_size=batch_size)
+            for (i, _), result in zip(batch, results):
+                scores[i] = weighted_score(result)
+        except Exception as e:
+            logger.warning("Error analyzing batch, falling back to single chunks: %s", e)
+            for i, text in batch:
+                scores[i] = analyze_chunk(text)
+
+    return scores
+
+
+def score_articles(articles: Iterable['Article'], batch_size: int = SENTIMENT_BATCH_SIZE):
+    """Score the chunks of every unscored article in one batched pass."""
+    pending = [article for article in articles if article.chunk_scores is None]
+    texts = [chunk for article in pending for chunk in article.chunks]
+    scores = score_texts(texts, batch_size)
+
+    offset = 0
+    for article in pending:
+        article.chunk_scores = scores[offset:offset + len(article.chunks)]
+        offset += len(article.chunks)
 
 
 class Article:
     """Represents an article with its relevant chunks of text"""
-    def __init__(self, title, link, chunks, requests_per_second=10):
+    def __init__(self, title, link, chunks, requests_per_second=10, chunk_scores=None, duplicates=None):
         self.title = title
         self.link = link
         self.chunks = chunks
-        self.sentiment_pipeline = pipeline("zero-shot-classification", model="facebook/bart-large-mnli", device=0 if torch.cuda.is_available() else -1)
+        # Set when the scores are already known, e.g. from an earlier run today
+        self.chunk_scores = chunk_scores
+        # Links to copies of the same story, which aren't scored or counted again, see dedup
+        self.duplicates = list(duplicates or [])
+
+    @property
+    def sentiment_pipeline(self):
+        return models.get_pipeline()
 
     def analyze_text(self, text: str) -> int:
         """Analyze the sentiment of a text chunk using LLM."""
-        if not text:
-            return 0
-            
-        try:
-            # Clean the text
-            text = re.sub(r'\s+', ' ', text).strip()
-            
-            # Get sentiment - ensure text is a list for batch processing
-            label_to_score = {
-                "very negative": -1.0,
-                "negative": -0.5,
-                "neutral": 0.0,
-                "positive": 0.5,
-                "very positive": 1.0
-            }
-
-            # Run the pipeline
-            result = self.sentiment_pipeline(text, candidate_labels=list(label_to_score.keys()))
-
-            # Calculate the weighted average score
-            total_score = 0.0
-            total_weight = 0.0
-
-            for label, score in zip(result['labels'], result['scores']):  # type: ignore
-                total_score += label_to_score[label] * score  # type: ignore
-                total_weight += score
-
-            # Final sentiment score if total_weight != 0: final_score = total_score / total_weight else: final_score = 0.0
-            return total_score / total_weight if total_weight != 0 else 0  # type: ignore
-            
-        except Exception as e:
-            print(f"Error analyzing text: {str(e)}")
-            return 0
+        return analyze_chunk(text)
 
     @property
     def sentiment_score(self):
         if not self.chunks:
             return 0
-        chunk_sentiments = [self.analyze_text(chunk) for chunk in self.chunks]
-        return sum(chunk_sentiments) / len(chunk_sentiments)
+        if self.chunk_scores is None:
+            score_articles([self])
+        return sum(self.chunk_scores) / len(self.chunk_scores)
@@ -0,0 +1,133 @@
+import os
+from typing import Dict, Type
+
+# Every backend builds a transformers zero-shot pipeline, so the hypothesis
+# handling and entailment scoring are the same whichever one runs the model.
+# Only the model underneath changes. torch, transformers and optimum are
+# imported when a backend loads.
+
+
+ONNX_DIR = 'onnx_models'
+
+
+class Backend:
+    """Builds the pipeline models.classify runs, from a model name and device"""
+    name = None
+
+    def load(self, task: str, model: str, device: int):
+        raise NotImplementedError
+
+    def tokenizer(self, model: str):
+        """The fast tokenizer the loaded pipeline will use, for chunking without the model."""
+        from transformers import AutoTokenizer
+
+        return AutoTokenizer.from_pretrained(model, use_fast=True)
+
+
+class TorchBackend(Backend):
+    """The float32 PyTorch model, as transformers loads it"""
+    name = 'torch'
+
+    def load(self, task, model, device):
+        from transformers import pipeline
+
+        return pipeline(task, model=model, device=device)
+
+
+class TorchInt8Backend(TorchBackend):
+    """PyTorch with the Linear layers dynamically quantized to int8. CPU only."""
+    name = 'torch-int8'
+
+    def load(self, task, model, device):
+        import torch
+
+        loaded = super().load(task, model, -1)
+        loaded.model = torch.quantization.quantize_dynamic(loaded.model, {torch.nn.Linear}, dtype=torch.qint8)
+        return loaded
+
+
+class OnnxBackend(Backend):
+    """The model exported to ONNX and run by ONNX Runtime on the CPU.
+
+    The export is saved under export_dir and reused by later runs.
+    """
+    name = 'onnx'
+
+    def __init__(self, export_dir: str = ONNX_DIR):
+        self.export_dir = export_dir
+
+    def model_dir(self, model: str) -> str:
+        return os.path.join(self.export_dir, model.replace('/', '--'))
+
+    def export(self, model: str) -> str:
+        """Export model unless it already has been, returning where it is."""
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from transformers import AutoTokenizer
+
+        path = self.model_dir(model)
+        if not os.path.exists(os.path.join(path, 'model.onnx')):
+            ORTModelForSequenceClassification.from_pretrained(model, export=True).save_pretrained(path)
+            AutoTokenizer.from_pretrained(model).save_pretrained(path)
+        return path
+
+    def _pipeline(self, task, path, file_name='model.onnx'):
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from transformers import AutoTokenizer, pipeline
+
+        return pipeline(
+            task,
+            model=ORTModelForSequenceClassification.from_pretrained(path, file_name=file_name),
+            tokenizer=AutoTokenizer.from_pretrained(path)
+        )
+
+    def load(self, task, model, device):
+        return self._pipeline(task, self.export(model))
+
+
+class OnnxInt8Backend(OnnxBackend):
+    """The ONNX export with dynamic int8 quantization of its weights"""
+    name = 'onnx-int8'
+    quantized_file = 'model_quantized.onnx'
+
+    def quantize(self, model: str) -> str:
+        from optimum.onnxruntime import ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+        path = self.export(model)
+        if not os.path.exists(os.path.join(path, self.quantized_file)):
+            # avx2 runs on every x86 box we have, avx512_vnni is faster where available
+            config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+            ORTQuantizer.from_pretrained(path, file_name='model.onnx').quantize(save_dir=path, quantization_config=config)
+        return path
+
+    def load(self, task, model, device):
+        return self._pipeline(task, self.quantize(model), self.quantized_file)
+
+
+class StubBackend(Backend):
+    """No model at all, see stub_nli. For benchmarks and tests that have to run offline."""
+    name = 'stub'
+
+    def load(self, task, model, device):
+        from stub_nli import StubPipeline
+
+        if task != 'zero-shot-classification':
+            raise ValueError(f"The stub backend only does zero-shot classification, not {task}")
+        return StubPipeline()
+
+    def tokenizer(self, model):
+        from stub_nli import StubTokenizer
+
+        return StubTokenizer()
+
+
+BACKENDS: Dict[str, Type[Backend]] = {
+    backend.name: backend for backend in (TorchBackend, TorchInt8Backend, OnnxBackend, OnnxInt8Backend, StubBackend)
+}
+
+
+def get_backend(name: str) -> Backend:
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown backend {name!r}, choose from {', '.join(BACKENDS)}") from None
@@ -0,0 +1,77 @@
+"""Time the sentiment analytics on a synthetic history, loaded from a throwaway database.
+
+    python -m benchmarks.analytics [--symbols 500] [--days 252] [--window 20]
+
+Writes days of random sentiment and price moves for every symbol, then
+reports milliseconds for the one-query load, the vectorized scoring of the
+whole history, appending a day and listing anomalies.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+import analytics
+import storage
+
+
+def populate(db_url, symbols=500, days=252, seed=0):
+    rng = np.random.default_rng(seed)
+    names = [f"S{i:03d}" for i in range(symbols)]
+    first = date.today() - timedelta(days=days)
+    for offset in range(days):
+        day = first + timedelta(days=offset)
+        counts = rng.poisson(3, symbols)
+        averages = rng.uniform(-1, 1, symbols)
+        storage.save_sentiment({name: {'count': int(count), 'average': float(average), 'articles': []}
+                                for name, count, average in zip(names, counts, averages) if count}, day,
+                               db_url=db_url)
+        storage.upsert_ticker_data({name: {'info': {'currentPrice': 100 * (1 + change), 'previousClose': 100.0},
+                                           'news': []}
+                                    for name, change in zip(names, rng.normal(0, 0.02, symbols))}, day, db_url)
+    return names
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--symbols', type=int, default=500)
+    parser.add_argument('--days', type=int, default=252)
+    parser.add_argument('--window', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = f"sqlite:///{os.path.join(tmp, 'analytics.db')}"
+        names = populate(db_url, args.symbols, args.days)
+        end = date.today() - timedelta(days=1)
+        start = end - timedelta(days=args.days)
+
+        rows, load_ms = timed(storage.load_daily_sentiment, start, end, db_url)
+        prices, prices_ms = timed(storage.load_price_moves, start, end, db_url)
+        scores, build_ms = timed(analytics.SentimentAnalytics.from_rows, rows, prices, args.window)
+        _, compute_ms = timed(scores._compute)
+        rng = np.random.default_rng(1)
+        day = {name: {'count': 3, 'average': float(average)} for name, average in zip(names, rng.uniform(-1, 1, len(names)))}
+        _, append_ms = timed(scores.append, date.today(), day)
+        flagged, anomalies_ms = timed(scores.anomalies)
+        storage.get_engine(db_url).dispose()
+
+    print(json.dumps({
+        'symbols': args.symbols, 'days': args.days, 'rows': len(rows),
+        'load_sentiment_ms': load_ms, 'load_prices_ms': prices_ms, 'build_ms': build_ms,
+        'compute_ms': compute_ms, 'append_ms': append_ms, 'anomalies_ms': anomalies_ms,
+        'anomalies': len(flagged),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Sentiment accuracy against latency for each inference backend on the TEST_ARTICLES fixtures.
+
+    python -m benchmarks.backends [--backends torch onnx onnx-int8] [--models MODEL ...]
+                                  [--tolerance 0.1] [--batch-size 16]
+
+Every fixture article is scored with each model/backend combination and
+compared with the float32 PyTorch run of the default model. The report gives
+load time, memory, seconds per chunk and the largest sentiment difference,
+and names the fastest combination within tolerance.
+"""
+import argparse
+import json
+import time
+
+import article
+import backends
+import inference_cache
+import models
+from retrieval.article_retrieval import ArticleRetrieval
+from test_articles_data import TEST_ARTICLES
+
+
+def fixture_chunks():
+    """(symbol, title, chunks) for every fixture article, chunked the way retrieval does it."""
+    retrieval = ArticleRetrieval()
+    return [
+        (symbol, title, retrieval.prepare_chunks(content))
+        for symbol, articles in TEST_ARTICLES.items()
+        for title, _, content in articles
+    ]
+
+
+def run(model, backend, fixtures, batch_size):
+    """Load model on backend, then time scoring every fixture article."""
+    rss_before = models.current_rss()
+    start = time.perf_counter()
+    models.registry.get(models.ZERO_SHOT, model, backend=backend)
+    load_seconds = time.perf_counter() - start
+    rss_delta = models.current_rss() - rss_before
+
+    labels = list(article.LABEL_TO_SCORE)
+    # One untimed call so lazy initialisation doesn't count against the first article
+    models.classify([fixtures[0][2][0]], labels, model=model, backend=backend)
+
+    sentiments = []
+    chunks = 0
+    start = time.perf_counter()
+    for _, _, texts in fixtures:
+        results = models.classify(texts, labels, batch_size=batch_size, model=model, backend=backend)
+        scores = [article.weighted_score(result) for result in results]
+        sentiments.append(sum(scores) / len(scores) if scores else 0.0)
+        chunks += len(texts)
+    seconds = time.perf_counter() - start
+
+    models.registry.unload(model=model, backend=backend)
+    return {
+        'model': model,
+        'backend': backend,
+        'load_seconds': load_seconds,
+        'rss_mb': rss_delta / 2**20,
+        'seconds_per_chunk': seconds / chunks if chunks else 0.0,
+        'sentiments': sentiments,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', nargs='+', default=list(backends.BACKENDS), choices=list(backends.BACKENDS))
+    parser.add_argument('--models', nargs='+', default=[models.DEFAULT_MODEL, models.DISTILLED_MODEL])
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='largest acceptable difference in article sentiment')
+    parser.add_argument('--batch-size', type=int, default=article.SENTIMENT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    # Every run has to reach the model
+    inference_cache.configure(enabled=False)
+    fixtures = fixture_chunks()
+
+    reference = run(models.DEFAULT_MODEL, models.DEFAULT_BACKEND, fixtures, args.batch_size)
+    results = [reference]
+    for model in args.models:
+        for backend in args.backends:
+            if (model, backend) != (models.DEFAULT_MODEL, models.DEFAULT_BACKEND):
+                results.append(run(model, backend, fixtures, args.batch_size))
+
+    for result in results:
+        differences = [abs(a - b) for a, b in zip(result['sentiments'], reference['sentiments'])]
+        result['max_difference'] = max(differences)
+        result['mean_difference'] = sum(differences) / len(differences)
+        result['same_sign'] = sum((a > 0) == (b > 0) for a, b in zip(result['sentiments'], reference['sentiments']))
+        result['speedup'] = reference['seconds_per_chunk'] / result['seconds_per_chunk'] \
+            if result['seconds_per_chunk'] else 0.0
+
+    within = [result for result in results if result['max_difference'] <= args.tolerance]
+    best = min(within, key=lambda result: result['seconds_per_chunk'])
+    print(json.dumps({
+        'articles': [f"{symbol}: {title}" for symbol, title, _ in fixtures],
+        'tolerance': args.tolerance,
+        'results': results,
+        'recommended': {'model': best['model'], 'backend': best['backend']},
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""Synthetic news corpus for offline benchmarks, and a local HTTP server for it.
+
+Articles are assembled from the paragraphs of the TEST_ARTICLES fixtures with
+the company swapped for a generated ticker. A share of each ticker's links are
+syndicated copies of a story already published on another outlet, and a share
+are links to another ticker's story, as when a feed mentions several companies.
+"""
+import random
+import re
+import threading
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from html import escape
+from typing import Dict, List, Tuple
+
+from test_articles_data import TEST_ARTICLES
+
+
+OUTLETS = ['wire', 'markets', 'finance', 'street', 'daily', 'tech', 'money', 'ledger']
+NAME_WORDS = ['Apex', 'Harbor', 'Summit', 'Meridian', 'Pioneer', 'Granite', 'Beacon', 'Cobalt', 'Sterling',
+              'Northern', 'Atlas', 'Vertex', 'Crescent', 'Liberty', 'Orion', 'Falcon', 'Evergreen', 'Keystone',
+              'Redwood', 'Titan', 'Quantum', 'Silver', 'Cascade', 'Horizon', 'Union', 'Frontier']
+NAME_SUFFIXES = ['Corporation', 'Inc.', 'Holdings', 'Group', 'Systems', 'Industries']
+FILLER = [
+    "Markets were mixed in afternoon trading as investors weighed the latest economic data.",
+    "Treasury yields edged lower while the dollar held steady against major currencies.",
+    "Oil prices rose for a third session on supply concerns in the Middle East.",
+    "Analysts said the broader index remains range-bound ahead of the central bank meeting.",
+]
+
+# The fixture companies, and their executives, become the generated ticker
+_COMPANY = re.compile(r"NVIDIA Corporation|NVIDIA|Nvidia|Apple Inc\.|Apple")
+_EXECUTIVE = re.compile(r"Jensen Huang|Tim Cook")
+
+
+@dataclass
+class Ticker:
+    symbol: str
+    name: str
+
+    @property
+    def info(self) -> Dict:
+        return {'symbol': self.symbol, 'shortName': self.name, 'longName': self.name}
+
+
+@dataclass
+class Corpus:
+    tickers: List[Ticker]
+    # path -> (title, paragraphs)
+    stories: Dict[str, Tuple[str, List[str]]] = field(default_factory=dict)
+    # symbol -> [(title, path)], in feed order
+    links: Dict[str, List[Tuple[str, str]]] = field(default_factory=dict)
+    syndicated: int = 0
+    shared: int = 0
+
+    def html(self, path: str) -> str:
+        title, paragraphs = self.stories[path]
+        body = ''.join(f"<p>{escape(paragraph)}</p>" for paragraph in paragraphs)
+        return (f"<html><head><title>{escape(title)}</title></head><body>"
+                f"<nav><a href='/'>Home</a> <a href='/markets'>Markets</a></nav>"
+                f"<article><h1>{escape(title)}</h1>{body}</article>"
+                f"<footer><p>Copyright {path.split('/')[1]} News. All rights reserved. "
+                f"Quotes delayed at least 15 minutes.</p></footer></body></html>")
+
+
+def _symbol(index: int) -> str:
+    letters = ''
+    index += 26 * 26
+    while index:
+        index, remainder = divmod(index, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def _templates() -> List[Tuple[str, List[str]]]:
+    """(title, paragraphs) of each fixture with the company as placeholders."""
+    templates = []
+    for articles in TEST_ARTICLES.values():
+        for title, _, content in articles:
+            paragraphs = [' '.join(paragraph.split()) for paragraph in re.split(r'\n\s*\n', content)]
+            templates.append((
+                _COMPANY.sub('{name}', title),
+                [_EXECUTIVE.sub('{ceo}', _COMPANY.sub('{name}', paragraph)) for paragraph in paragraphs if paragraph]
+            ))
+    return templates
+
+
+def generate(tickers: int = 500, articles: int = 10, overlap: float = 0.2, shared: float = 0.1,
+             seed: int = 0) -> Corpus:
+    """A corpus of tickers with articles links each.
+
+    overlap is the share of links that are syndicated copies of one of the
+    ticker's earlier stories under another outlet, shared the share that point
+    at a story about another ticker.
+    """
+    rng = random.Random(seed)
+    templates = _templates()
+    corpus = Corpus(tickers=[
+        Ticker(_symbol(i), f"{rng.choice(NAME_WORDS)} {rng.choice(NAME_WORDS)} {rng.choice(NAME_SUFFIXES)}")
+        for i in range(tickers)
+    ])
+
+    for ticker in corpus.tickers:
+        own: List[Tuple[str, str]] = []
+        links = []
+        short = ticker.name.split()[0]
+        for n in range(articles):
+            outlet = rng.choice(OUTLETS)
+            roll = rng.random()
+            if own and roll < overlap:
+                # The same story picked up by another outlet
+                title, source = rng.choice(own)
+                path = f"/{outlet}/{ticker.symbol.lower()}-{n}-syndicated"
+                corpus.stories[path] = (title, list(corpus.stories[source][1]))
+                corpus.syndicated += 1
+                links.append((title, path))
+                continue
+            if corpus.links and roll < overlap + shared:
+                links.append(rng.choice(rng.choice(list(corpus.links.values()))))
+                corpus.shared += 1
+                continue
+
+            title_template, paragraphs = rng.choice(templates)
+            chosen = rng.sample(paragraphs, k=rng.randint(max(1, len(paragraphs) - 2), len(paragraphs)))
+            values = {'name': short, 'ceo': f"CEO {rng.choice(NAME_WORDS)} Smith"}
+            body = [paragraph.format(**values) for paragraph in chosen]
+            body[0] = f"{ticker.name} ({ticker.symbol}) {body[0][0].lower()}{body[0][1:]}"
+            body.insert(rng.randint(1, len(body)), rng.choice(FILLER))
+            title = title_template.format(**values)
+            path = f"/{outlet}/{ticker.symbol.lower()}-{n}"
+            corpus.stories[path] = (title, body)
+            own.append((title, path))
+            links.append((title, path))
+        corpus.links[ticker.symbol] = links
+    return corpus
+
+
+class CorpusServer:
+    """Serves a corpus over HTTP on localhost from a background thread, optionally with a delay per page"""
+
+    def __init__(self, corpus: Corpus, delay: float = 0.0):
+        self.corpus = corpus
+        self.delay = delay
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> 'CorpusServer':
+        corpus, delay = self.corpus, self.delay
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in corpus.stories:
+                    self.send_error(404)
+                    return
+                if delay:
+                    threading.Event().wait(delay)
+                body = corpus.html(self.path).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # The default backlog of 5 drops connections under a concurrent fetch
+            request_queue_size = 256
+
+        self._server = Server(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='corpus-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
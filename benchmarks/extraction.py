@@ -0,0 +1,86 @@
+"""Time extraction.extract against the BeautifulSoup paragraph join it replaced, on saved pages.
+
+    python -m benchmarks.extraction [--pages DIR] [--limit 500] [--repeat 3]
+
+Pages are the *.html files under DIR, or with no DIR the synthetic corpus
+benchmarks.pipeline serves. Each page is put through every extractor repeat
+times; the report gives pages per second, p50/p95 milliseconds per page and
+how many words each extractor kept, as nav, cookie and footer paragraphs are
+what extract drops and the paragraph join doesn't.
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import time
+
+from bs4 import BeautifulSoup
+
+from benchmarks.corpus import generate
+from benchmarks.pipeline import percentile
+from retrieval.extraction import extract
+
+
+def bs4_paragraphs(html, parser='html.parser'):
+    """The old path: every <p> on the page, joined."""
+    soup = BeautifulSoup(html, parser)
+    return ' '.join(p.get_text() for p in soup.find_all('p'))
+
+
+EXTRACTORS = {
+    'bs4-html.parser': bs4_paragraphs,
+    'bs4-lxml': lambda html: bs4_paragraphs(html, 'lxml'),
+    'extract': lambda html: extract(html).text,
+}
+
+
+def saved_pages(directory=None, limit=500):
+    if directory:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(directory, '**', '*.htm*'), recursive=True))[:limit]:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                pages.append(f.read())
+        return pages
+    corpus = generate(tickers=max(1, limit // 10), articles=10)
+    return [corpus.html(path) for path in list(corpus.stories)[:limit]]
+
+
+def run(pages, repeat=3):
+    report = {}
+    for name, extractor in EXTRACTORS.items():
+        latencies, words = [], 0
+        for _ in range(repeat):
+            for html in pages:
+                start = time.perf_counter()
+                text = extractor(html)
+                latencies.append(time.perf_counter() - start)
+                words += len(text.split())
+        seconds = sum(latencies)
+        report[name] = {
+            'pages_per_second': len(latencies) / seconds if seconds else 0.0,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0.0,
+            'words_per_page': words / len(latencies) if latencies else 0.0,
+        }
+    baseline = report['bs4-html.parser']['mean_ms']
+    for entry in report.values():
+        entry['speedup'] = baseline / entry['mean_ms'] if entry['mean_ms'] else 0.0
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', help='directory of saved .html pages, the synthetic corpus if not given')
+    parser.add_argument('--limit', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    pages = saved_pages(args.pages, args.limit)
+    report = {'pages': len(pages), 'repeat': args.repeat, 'extractors': run(pages, args.repeat)}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
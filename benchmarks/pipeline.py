@@ -0,0 +1,244 @@
+"""Time every stage of the daily update offline, against a synthetic corpus served from localhost.
+
+    python -m benchmarks.pipeline [--tickers 500] [--articles 10] [--overlap 0.2] [--shared 0.1]
+                                  [--backend stub] [--model MODEL] [--fused MODE] [--dedup] [--tag]
+                                  [--output FILE]
+
+Pages are fetched over HTTP from a local server, then extracted, chunked,
+checked for relevance, scored and written to a throwaway database. Each stage
+reports its items, throughput, p50/p95 latency per item and the process's
+peak RSS once it is done. The default stub backend needs no model or network;
+--backend torch --model typeform/distilbert-base-uncased-mnli runs a real
+(tiny) model instead. The JSON report carries the commit and parameters so
+runs can be compared over time.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import article
+import dedup
+import inference_cache
+import models
+import stocks
+from benchmarks.corpus import CorpusServer, generate
+from retrieval.article_retrieval import ArticleRetrieval
+from retrieval.article_store import ArticleStore
+from retrieval.fetcher import AsyncFetcher
+from retrieval.page_cache import PageCache
+from retrieval import tagger
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class CorpusRetrieval(ArticleRetrieval):
+    """Candidates straight from the corpus, fetched from the local server"""
+
+    def __init__(self, corpus, base_url, fetcher, store):
+        super().__init__()
+        self.corpus = corpus
+        self.base_url = base_url
+        self.fetcher = fetcher
+        self.article_store = store
+
+    def candidates(self, data):
+        return [(title, self.base_url + path) for title, path in self.corpus.links[data['info']['symbol']]]
+
+    def describe(self, data):
+        return f"synthetic articles for {data['info']['symbol']}"
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+
+class Stages:
+    """Per-stage timings for the report"""
+
+    def __init__(self):
+        self.report = {}
+
+    def record(self, name, unit, seconds, latencies):
+        self.report[name] = {
+            'unit': unit,
+            'items': len(latencies),
+            'seconds': seconds,
+            'throughput': len(latencies) / seconds if seconds else 0.0,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0.0,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        print(f"{name}: {len(latencies)} x {unit} in {seconds:.2f}s "
+              f"(p50 {self.report[name]['p50_ms']:.1f} ms, p95 {self.report[name]['p95_ms']:.1f} ms)",
+              file=sys.stderr)
+
+    def timed(self, name, unit, fn, items):
+        """Call fn on each item, recording how long each call takes."""
+        latencies, results = [], []
+        start = time.perf_counter()
+        for item in items:
+            began = time.perf_counter()
+            results.append(fn(item))
+            latencies.append(time.perf_counter() - began)
+        self.record(name, unit, time.perf_counter() - start, latencies)
+        return results
+
+
+def run(corpus, base_url, db_url, batch_size=article.SENTIMENT_BATCH_SIZE, concurrency=32, near_duplicates=None,
+        tag=False):
+    stages = Stages()
+    tagger.configure([ticker.info for ticker in corpus.tickers] if tag else None)
+    store = ArticleStore(PageCache(path=None))
+    store.near_duplicates = near_duplicates
+    fetcher = AsyncFetcher(requests_per_second=0, per_host_concurrency=concurrency, max_connections=concurrency)
+    retrieval = CorpusRetrieval(corpus, base_url, fetcher, store)
+    stocks.configure_retrievers([retrieval])
+    try:
+        links = list(dict.fromkeys(base_url + path for entries in corpus.links.values() for _, path in entries))
+
+        # fetch: concurrent, so each page's latency is its own request
+        start = time.perf_counter()
+        results = fetcher.fetch_many(links)
+        for result in results:
+            if result.ok:
+                store.put_html(result.url, result.text)
+        stages.record('fetch', 'page', time.perf_counter() - start, [result.elapsed for result in results])
+
+        extractions = stages.timed('extract', 'page', lambda link: retrieval._extract(store.html(link) or ''), links)
+        chunks = stages.timed('chunk', 'page', lambda extraction: retrieval.prepare_chunks(extraction.text),
+                              extractions)
+        for link, extraction, page_chunks in zip(links, extractions, chunks):
+            store.put_page(link, extraction, page_chunks)
+
+        # relevance, per ticker and link in feed order, keeping the first copy of each link
+        work = []
+        for ticker in corpus.tickers:
+            seen = set()
+            for title, path in corpus.links[ticker.symbol]:
+                if path not in seen:
+                    seen.add(path)
+                    work.append((ticker, title, base_url + path))
+        def relevance(item):
+            page = retrieval.stored_page(item[2])
+            if page.duplicate_of is not None:
+                page = retrieval._original(page, item[0].info)
+            return retrieval.relevant_page_chunks(page, item[0].info) if page and page.chunks else []
+
+        relevant = stages.timed('relevance', 'ticker-page', relevance, work)
+
+        by_symbol = {ticker.symbol: [] for ticker in corpus.tickers}
+        clusters = {ticker.symbol: dedup.ArticleClusters(near_duplicates) for ticker in corpus.tickers}
+        for (ticker, title, link), relevant_chunks in zip(work, relevant):
+            if relevant_chunks:
+                item = article.Article(title=title, link=link, chunks=relevant_chunks,
+                                       chunk_scores=retrieval.chunk_scores(relevant_chunks))
+                if clusters[ticker.symbol].add(item):
+                    by_symbol[ticker.symbol].append(item)
+
+        # sentiment, in the shared length-sorted batches score_articles uses
+        unscored = sorted({chunk for articles in by_symbol.values() for a in articles if a.chunk_scores is None
+                           for chunk in a.chunks}, key=len)
+        batches = [unscored[start:start + batch_size] for start in range(0, len(unscored), batch_size)]
+        scores = {}
+        for batch, batch_scores in zip(batches, stages.timed('sentiment', 'batch', article.score_texts, batches)):
+            scores.update(zip(batch, batch_scores))
+        for articles in by_symbol.values():
+            for a in articles:
+                if a.chunk_scores is None:
+                    a.chunk_scores = [scores[chunk] for chunk in a.chunks]
+
+        portfolio = [
+            stocks.Stock(symbol=ticker.symbol, _ticker_data={'info': ticker.info, 'news': []},
+                         _articles=by_symbol[ticker.symbol], db_url=db_url)
+            for ticker in corpus.tickers
+        ]
+        stages.timed('write', 'transaction', lambda _: stocks.write_sentiment(portfolio, db_url), [None])
+
+        stages.report['totals'] = {
+            'pages': len(links),
+            'fetch_errors': sum(1 for result in results if not result.ok),
+            'chunks': sum(len(page_chunks) for page_chunks in chunks),
+            'relevant_articles': sum(len(articles) for articles in by_symbol.values()),
+            'scored_chunks': sum(len(a.chunks) for articles in by_symbol.values() for a in articles),
+            'relevance': str(retrieval.relevance_stats),
+        }
+        if near_duplicates is not None:
+            stages.report['totals']['dedup'] = str(near_duplicates.stats)
+        return stages.report
+    finally:
+        fetcher.close()
+        stocks.configure_retrievers(stocks.DEFAULT_RETRIEVERS)
+        tagger.configure(None)
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tickers', type=int, default=500)
+    parser.add_argument('--articles', type=int, default=10, help='links per ticker')
+    parser.add_argument('--overlap', type=float, default=0.2, help='share of links that are syndicated copies')
+    parser.add_argument('--shared', type=float, default=0.1, help="share of links to another ticker's story")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds the server waits before each page')
+    parser.add_argument('--backend', default='stub')
+    parser.add_argument('--model', help='checkpoint for a real backend')
+    parser.add_argument('--fused', choices=['fused', 'short-circuit'], help='score sentiment in the relevance pass')
+    parser.add_argument('--dedup', action='store_true', help='check and score one copy of each syndicated story')
+    parser.add_argument('--tag', action='store_true', help='settle relevance by looking up tagged mentions')
+    parser.add_argument('--batch-size', type=int, default=article.SENTIMENT_BATCH_SIZE)
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    args = parser.parse_args()
+
+    models.configure(args.model, args.backend)
+    ArticleRetrieval.fused_mode = args.fused
+    # Every run has to reach the model
+    inference_cache.configure(enabled=False)
+
+    start = time.perf_counter()
+    corpus = generate(args.tickers, args.articles, args.overlap, args.shared, args.seed)
+    generate_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp, CorpusServer(corpus, args.delay) as server:
+        stages = run(corpus, server.base_url, f"sqlite:///{os.path.join(tmp, 'benchmark.db')}", args.batch_size,
+                     near_duplicates=dedup.NearDuplicateIndex() if args.dedup else None, tag=args.tag)
+
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit(),
+        'parameters': dict(vars(args), model=models.current_model()),
+        'corpus': {'tickers': len(corpus.tickers), 'stories': len(corpus.stories),
+                   'syndicated': corpus.syndicated, 'shared': corpus.shared, 'seconds': generate_seconds},
+        'stages': stages,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
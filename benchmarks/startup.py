@@ -0,0 +1,68 @@
+"""Measure how long `import stocks` takes in a fresh interpreter and what it costs in memory.
+
+    python -m benchmarks.startup [--runs 5] [--module stocks] [--budget 1.0]
+
+Exits non-zero if the median import time is over budget or a heavy module
+(torch, transformers, selenium, ...) gets imported as a side effect.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should only ever be imported when they are used
+HEAVY_MODULES = ['torch', 'transformers', 'tensorflow', 'selenium', 'webdriver_manager',
+                 'nltk', 'yfinance', 'pandas', 'smolagents', 'PIL']
+
+PROBE = """
+import json, os, resource, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+with open('/proc/self/statm') as statm:
+    rss = int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+print(json.dumps({{
+    'seconds': seconds,
+    'rss': rss,
+    'heavy': [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def measure(module='stocks'):
+    """Import module once in a new interpreter, returning time, RSS and heavy imports."""
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='stocks')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.0, help='seconds')
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    report = {
+        'module': args.module,
+        'median_seconds': statistics.median(run['seconds'] for run in runs),
+        'max_seconds': max(run['seconds'] for run in runs),
+        'median_rss_mb': statistics.median(run['rss'] for run in runs) / 2**20,
+        'heavy_imports': sorted({name for run in runs for name in run['heavy']}),
+    }
+    print(json.dumps(report, indent=2))
+
+    if report['median_seconds'] > args.budget or report['heavy_imports']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+import json
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import article
+
+
+# Words that lean clearly one way in financial news, in the spirit of the
+# Loughran-McDonald lists but short enough to maintain by hand
+POSITIVE_WORDS = {
+    'beat', 'beats', 'beating', 'exceed', 'exceeded', 'exceeds', 'surge', 'surged', 'surges', 'soar',
+    'soared', 'soars', 'jump', 'jumped', 'jumps', 'rally', 'rallied', 'rallies', 'gain', 'gained', 'gains',
+    'rise', 'rises', 'rose', 'climb', 'climbed', 'record', 'upgrade', 'upgraded', 'upgrades', 'outperform',
+    'outperformed', 'outperforms', 'bullish', 'strong', 'stronger', 'strongest', 'robust', 'growth',
+    'grew', 'profit', 'profitable', 'profits', 'boost', 'boosted', 'boosts', 'raise', 'raised', 'raises',
+    'expand', 'expanded', 'expansion', 'momentum', 'optimism', 'optimistic', 'win', 'wins', 'won',
+    'breakthrough', 'dividend', 'buyback', 'accelerate', 'accelerated', 'accelerating', 'leader',
+    'leadership', 'dominant', 'dominance', 'innovative', 'success', 'successful', 'improve', 'improved',
+    'improvement', 'upside', 'positive', 'tailwind', 'tailwinds', 'unprecedented', 'impressive',
+}
+NEGATIVE_WORDS = {
+    'miss', 'missed', 'misses', 'plunge', 'plunged', 'plunges', 'slump', 'slumped', 'tumble', 'tumbled',
+    'drop', 'dropped', 'drops', 'fall', 'fell', 'falls', 'decline', 'declined', 'declines', 'declining',
+    'slide', 'slid', 'sink', 'sank', 'downgrade', 'downgraded', 'downgrades', 'underperform',
+    'underperformed', 'bearish', 'weak', 'weaker', 'weakness', 'loss', 'losses', 'lose', 'lost', 'cut',
+    'cuts', 'layoff', 'layoffs', 'lawsuit', 'lawsuits', 'probe', 'investigation', 'fraud', 'recall',
+    'recalls', 'bankruptcy', 'default', 'warning', 'warns', 'warned', 'concern', 'concerns', 'risk',
+    'risks', 'headwind', 'headwinds', 'slowdown', 'slowing', 'disappoint', 'disappointed',
+    'disappointing', 'volatile', 'volatility', 'uncertainty', 'pressure', 'pressures', 'challenge',
+    'challenges', 'challenging', 'fine', 'fined', 'penalty', 'negative', 'downside', 'struggle',
+    'struggled', 'struggles', 'shortage', 'delay', 'delayed', 'delays', 'scrutiny', 'antitrust',
+}
+NEGATIONS = {'not', 'no', 'never', 'without', "n't", 'neither', 'nor', 'hardly'}
+
+_WORD = re.compile(r"[a-z]+(?:'[a-z]+)?|n't")
+
+
+class LexiconScorer:
+    """Scores text by counting finance sentiment words, flipping any within a few words of a negation.
+
+    score = (positive - negative) / (positive + negative + smoothing), so a
+    chunk with a handful of one-sided words scores far from 0 and one with
+    few or mixed words stays near it.
+    """
+
+    def __init__(self, positive=POSITIVE_WORDS, negative=NEGATIVE_WORDS, smoothing=2.0, negation_window=3):
+        self.positive = positive
+        self.negative = negative
+        self.smoothing = smoothing
+        self.negation_window = negation_window
+
+    def score(self, text: str) -> float:
+        positive = negative = 0
+        since_negation = None
+        for word in _WORD.findall(text.lower().replace("n't", " n't")):
+            if word in NEGATIONS:
+                since_negation = 0
+                continue
+            negated = since_negation is not None and since_negation < self.negation_window
+            if word in self.positive:
+                if negated:
+                    negative += 1
+                else:
+                    positive += 1
+            elif word in self.negative:
+                if negated:
+                    positive += 1
+                else:
+                    negative += 1
+            if since_negation is not None:
+                since_negation += 1
+        return (positive - negative) / (positive + negative + self.smoothing)
+
+    def score_many(self, texts: List[str]) -> List[float]:
+        return [self.score(text) for text in texts]
+
+
+class ModelScorer:
+    """Scores text with a small sentence classifier such as ProsusAI/finbert: P(positive) - P(negative)"""
+
+    def __init__(self, model: str = 'ProsusAI/finbert', batch_size: int = 32):
+        self.model = model
+        self.batch_size = batch_size
+
+    def score_many(self, texts: List[str]) -> List[float]:
+        import models
+
+        if not texts:
+            return []
+        classifier = models.get_pipeline('text-classification', self.model)
+        outputs = classifier(texts, top_k=None, truncation=True, batch_size=self.batch_size)
+        scores = []
+        for output in outputs:
+            probabilities = {result['label'].lower(): result['score'] for result in output}
+            scores.append(probabilities.get('positive', 0.0) - probabilities.get('negative', 0.0))
+        return scores
+
+
+@dataclass
+class CascadeStats:
+    chunks: int = 0
+    escalated: int = 0
+    first_stage_seconds: float = 0.0
+    zero_shot_seconds: float = 0.0
+
+    @property
+    def escalation_rate(self) -> float:
+        return self.escalated / self.chunks if self.chunks else 0.0
+
+    @property
+    def seconds_saved(self) -> float:
+        """Zero-shot time the chunks settled by the first stage would have taken, less the first stage's own."""
+        if not self.escalated:
+            return 0.0
+        per_chunk = self.zero_shot_seconds / self.escalated
+        return (self.chunks - self.escalated) * per_chunk - self.first_stage_seconds
+
+    def add(self, other: 'CascadeStats'):
+        self.chunks += other.chunks
+        self.escalated += other.escalated
+        self.first_stage_seconds += other.first_stage_seconds
+        self.zero_shot_seconds += other.zero_shot_seconds
+
+    def __str__(self):
+        return (f"{self.chunks} chunks, {self.escalated} escalated to zero-shot ({self.escalation_rate:.0%}), "
+                f"~{self.seconds_saved:.0f}s saved")
+
+
+class CascadeScorer:
+    """Cheap first-stage scores for every chunk, zero-shot only where they are unsure.
+
+    The first stage is the mean of the given scorers. Chunks it scores inside
+    band, i.e. neither clearly positive nor clearly negative, are scored again
+    by article.zero_shot_scores and take that score. Both are on the same
+    -1..1 scale.
+    """
+
+    def __init__(self, stages: Optional[Sequence] = None, band: Tuple[float, float] = (-0.35, 0.35)):
+        self.stages = list(stages) if stages else [LexiconScorer()]
+        self.band = band
+        self.stats = CascadeStats()
+
+    def first_stage(self, texts: List[str]) -> List[float]:
+        per_stage = [stage.score_many(texts) for stage in self.stages]
+        return [sum(scores) / len(scores) for scores in zip(*per_stage)]
+
+    def score_texts(self, texts: List[str], batch_size: int = article.SENTIMENT_BATCH_SIZE) -> List[float]:
+        start = time.perf_counter()
+        scores = self.first_stage([article.clean_text(text) if text else '' for text in texts])
+        first_stage_seconds = time.perf_counter() - start
+
+        low, high = self.band
+        uncertain = [i for i, score in enumerate(scores) if texts[i] and low < score < high]
+        start = time.perf_counter()
+        for i, score in zip(uncertain, article.zero_shot_scores([texts[i] for i in uncertain], batch_size)):
+            scores[i] = score
+
+        self.stats.add(CascadeStats(
+            chunks=sum(1 for text in texts if text),
+            escalated=len(uncertain),
+            first_stage_seconds=first_stage_seconds,
+            zero_shot_seconds=time.perf_counter() - start,
+        ))
+        return [score if text else 0.0 for text, score in zip(texts, scores)]
+
+
+def configure(enabled: bool = True, band: Tuple[float, float] = (-0.35, 0.35), model: Optional[str] = None,
+              lexicon: bool = True) -> Optional[CascadeScorer]:
+    """Route article scoring through a cascade, for this process and any it spawns.
+
+    model adds a small classifier to the first stage, lexicon=False leaves
+    the model on its own.
+    """
+    if not enabled:
+        os.environ.pop('SENTIMENT_CASCADE', None)
+        article.set_scorer(None)
+        return None
+
+    stages = ([LexiconScorer()] if lexicon or not model else []) + ([ModelScorer(model)] if model else [])
+    scorer = CascadeScorer(stages, band)
+    os.environ['SENTIMENT_CASCADE'] = json.dumps({'band': list(band), 'model': model, 'lexicon': lexicon})
+    article.set_scorer(scorer)
+    return scorer
+
+
+def configure_from_env() -> Optional[CascadeScorer]:
+    """Set up the cascade a parent process configured, if any."""
+    settings = os.environ.get('SENTIMENT_CASCADE')
+    if not settings:
+        return None
+    settings = json.loads(settings)
+    return configure(True, tuple(settings['band']), settings['model'], settings['lexicon'])
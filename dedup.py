@@ -0,0 +1,232 @@
+"""Near-duplicate articles: one wire story syndicated under several URLs.
+
+Each page's extracted text is cut into overlapping word shingles and reduced
+to a MinHash signature. LSH bands of the signature find candidate copies,
+which count as the same story when the share of matching MinHash values,
+an estimate of the shingles' Jaccard similarity, reaches the threshold. The
+first page of a story seen is its representative. Copies are checked for
+relevance and scored through it, and end up attached to its Article as
+duplicates rather than counted again.
+
+Representatives' signatures are kept in the database for `days` days, so a
+story picked up again on a later day is recognised and not counted twice.
+Off until configure() is called.
+"""
+import re
+import threading
+import zlib
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+import metrics
+import storage
+from storage import DEFAULT_DB_URL
+
+# Mersenne prime for the MinHash permutations, small enough that a * x + b fits in 64 bits
+_PRIME = (1 << 31) - 1
+_WORD = re.compile(r'\w+')
+
+
+@dataclass
+class DedupStats:
+    pages: int = 0
+    # Stories seen more than once, and the copies beyond the first
+    clusters: int = 0
+    copies: int = 0
+    # Copies of a story first seen on an earlier day
+    earlier: int = 0
+    # Chunks of copies that never went to the model
+    chunks_skipped: int = 0
+
+    def __str__(self):
+        return (f"{self.copies} of {self.pages} pages were copies of {self.clusters} stories "
+                f"({self.earlier} from earlier days), {self.chunks_skipped} chunks kept from the model")
+
+
+class NearDuplicateIndex:
+    """MinHash signatures of page texts, banded for LSH lookup.
+
+    With the defaults, 16 bands of 4 rows, pages at 0.5 estimated
+    similarity are found as candidates half the time and at 0.8 almost
+    always. A candidate is only a copy at threshold or above.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, bands: int = 16, shingle: int = 5,
+                 seed: int = 1):
+        import numpy as np
+
+        if num_perm % bands:
+            raise ValueError(f"{num_perm} permutations don't split into {bands} bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle = shingle
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+
+        self._lock = threading.Lock()
+        # (band, band values) -> representative links
+        self._buckets: Dict[tuple, List[str]] = {}
+        self._signatures: Dict[str, 'np.ndarray'] = {}
+        # link -> its story's representative, without the query string
+        self._representatives: Dict[str, str] = {}
+        # Representatives' links as first given
+        self._links: Dict[str, str] = {}
+        self._clustered = set()
+        # Representatives first seen on each day
+        self._days: Dict[str, date] = {}
+        self._unsaved: List[str] = []
+        self.stats = DedupStats()
+
+    @staticmethod
+    def _key(link: str) -> str:
+        return link.split('?')[0]
+
+    def signature(self, text: str):
+        """MinHash signature of text's word shingles, None when it is shorter than one shingle."""
+        import numpy as np
+
+        words = _WORD.findall(text.lower())
+        if len(words) < self.shingle:
+            return None
+        shingles = {zlib.crc32(' '.join(words[i:i + self.shingle]).encode('utf-8')) & _PRIME
+                    for i in range(len(words) - self.shingle + 1)}
+        values = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+        return ((np.outer(values, self._a) + self._b) % _PRIME).min(axis=0).astype(np.uint32)
+
+    def _bands(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def _match(self, signature) -> Optional[str]:
+        best, best_similarity = None, self.threshold
+        candidates = {link for band in self._bands(signature) for link in self._buckets.get(band, ())}
+        for link in candidates:
+            similarity = float((self._signatures[link] == signature).mean())
+            if similarity >= best_similarity:
+                best, best_similarity = link, similarity
+        return best
+
+    def _insert(self, link: str, signature, day: date):
+        self._signatures[link] = signature
+        self._representatives[link] = link
+        self._days[link] = day
+        for band in self._bands(signature):
+            self._buckets.setdefault(band, []).append(link)
+
+    def add(self, link: str, text: str, day: Optional[date] = None) -> Optional[str]:
+        """Fingerprint a page, returning its story's representative if it is a copy, else None."""
+        day = day or date.today()
+        key = self._key(link)
+        signature = self.signature(text)
+        with self._lock:
+            if key in self._representatives:
+                representative = self._representatives[key]
+                return self._links.get(representative, representative) if representative != key else None
+            self.stats.pages += 1
+            match = self._match(signature) if signature is not None else None
+            if match is None:
+                self._representatives[key] = key
+                if signature is not None:
+                    self._insert(key, signature, day)
+                    self._links[key] = link
+                    self._unsaved.append(key)
+                metrics.inc('dedup_pages_total', outcome='new')
+                return None
+
+            self._representatives[key] = match
+            self.stats.copies += 1
+            if match not in self._clustered:
+                self._clustered.add(match)
+                self.stats.clusters += 1
+            earlier = self._days[match] < day
+            self.stats.earlier += earlier
+            metrics.inc('dedup_pages_total', outcome='earlier' if earlier else 'copy')
+            return self._links.get(match, match)
+
+    def skipped(self, chunks: int, **labels):
+        """Count the chunks of a copy that were left out of relevance and sentiment."""
+        with self._lock:
+            self.stats.chunks_skipped += chunks
+        metrics.inc('dedup_chunks_skipped_total', chunks, **labels)
+
+    def representative(self, link: str) -> str:
+        """The link of the first page seen of link's story, link itself if it is the first or unknown."""
+        key = self._key(link)
+        return self._representatives.get(key, key)
+
+    def load(self, rows: List[Dict]):
+        """Add representatives saved by earlier runs, see storage.load_fingerprints."""
+        import numpy as np
+
+        with self._lock:
+            for row in rows:
+                if row['link'] not in self._representatives:
+                    self._insert(row['link'], np.frombuffer(row['signature'], dtype=np.uint32), row['date'])
+
+    def unsaved(self) -> List[Dict]:
+        """Representatives added since the last call, as rows for storage.save_fingerprints."""
+        with self._lock:
+            links, self._unsaved = self._unsaved, []
+            return [{'link': link, 'date': self._days[link], 'signature': self._signatures[link].tobytes()}
+                    for link in links]
+
+
+class ArticleClusters:
+    """One stock's articles by story, the first of each standing for its copies"""
+
+    def __init__(self, index: Optional[NearDuplicateIndex] = None):
+        self.index = index if index is not None else get_index()
+        self._first: Dict[str, object] = {}
+
+    def add(self, article) -> bool:
+        """True if article is the first of its story, otherwise it is attached to that one."""
+        if self.index is None:
+            return True
+        key = self.index.representative(article.link)
+        first = self._first.setdefault(key, article)
+        if first is article:
+            return True
+        if article.link != first.link and article.link not in first.duplicates:
+            first.duplicates.append(article.link)
+        return False
+
+
+def collapse(articles: List, index: Optional[NearDuplicateIndex] = None) -> List:
+    """articles with copies of an earlier article's story attached to it rather than listed."""
+    clusters = ArticleClusters(index)
+    return [article for article in articles if clusters.add(article)]
+
+
+_index: Optional[NearDuplicateIndex] = None
+_days = 3
+
+
+def configure(enabled: bool = True, threshold: float = 0.8, days: int = 3,
+              db_url: Optional[str] = DEFAULT_DB_URL) -> Optional[NearDuplicateIndex]:
+    """Detect copies across the shared article store, with stories from the last days days.
+
+    db_url None keeps the index for this run only.
+    """
+    global _index, _days
+    from retrieval.article_store import get_article_store
+
+    _days = days
+    _index = NearDuplicateIndex(threshold) if enabled else None
+    if _index is not None and db_url is not None:
+        _index.load(storage.load_fingerprints(date.today() - timedelta(days=days), db_url=db_url))
+    get_article_store().near_duplicates = _index
+    return _index
+
+
+def get_index() -> Optional[NearDuplicateIndex]:
+    return _index
+
+
+def save(db_url: str = DEFAULT_DB_URL):
+    """Write this run's new stories' fingerprints, forgetting ones older than the window."""
+    if _index is None:
+        return
+    storage.save_fingerprints(_index.unsaved(), keep_since=date.today() - timedelta(days=_days), db_url=db_url)
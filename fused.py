@@ -0,0 +1,222 @@
+import contextlib
+import math
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import article
+import inference_cache
+import metrics
+import models
+
+
+# Modes: 'fused' runs the relevance and sentiment pairs of every chunk in the
+# same batches, 'short-circuit' runs sentiment pairs only for chunks that
+# passed relevance
+MODES = ('fused', 'short-circuit')
+
+RELEVANCE, SENTIMENT = 0, 1
+
+# Fast tokenizers aren't safe to call from several threads at once, and
+# streaming retrieval classifies from several
+_tokenizer_lock = threading.Lock()
+
+
+def _softmax(values: Sequence[float]) -> List[float]:
+    top = max(values)
+    exps = [math.exp(value - top) for value in values]
+    total = sum(exps)
+    return [value / total for value in exps]
+
+
+def _ranked(labels: Sequence[str], scores: Sequence[float]) -> Dict:
+    """A result in the zero-shot pipeline's shape, best label first."""
+    order = sorted(range(len(labels)), key=lambda i: -scores[i])
+    return {'labels': [labels[i] for i in order], 'scores': [scores[i] for i in order]}
+
+
+@dataclass
+class FusedStats:
+    chunks: int = 0
+    relevant: int = 0
+    premises: int = 0
+    relevance_pairs: int = 0
+    sentiment_pairs: int = 0
+    # Sentiment pairs left out because their chunk had already failed relevance
+    pairs_skipped: int = 0
+    forward_passes: int = 0
+
+    def add(self, other: 'FusedStats'):
+        self.chunks += other.chunks
+        self.relevant += other.relevant
+        self.premises += other.premises
+        self.relevance_pairs += other.relevance_pairs
+        self.sentiment_pairs += other.sentiment_pairs
+        self.pairs_skipped += other.pairs_skipped
+        self.forward_passes += other.forward_passes
+
+    def __str__(self):
+        return (f"{self.chunks} chunks, {self.relevant} relevant, {self.premises} premises tokenized, "
+                f"{self.relevance_pairs + self.sentiment_pairs} pairs in {self.forward_passes} forward passes, "
+                f"{self.pairs_skipped} sentiment pairs skipped")
+
+
+class FusedClassifier:
+    """Relevance and sentiment for chunks from one pass over the NLI model.
+
+    Each premise is tokenized once and paired with the ticker's relevance
+    hypotheses and the sentiment hypotheses, and the pairs go through the
+    model together, batch_pairs at a time. Scores are worked out from the
+    logits the way the zero-shot pipeline does: relevance as multi-label
+    entailment, sentiment as a softmax of entailment across the labels. The
+    results are read from and written to the inference cache under the same
+    keys models.classify uses, so the two paths share entries.
+    """
+
+    def __init__(self, relevance_template: str, threshold: float = 0.7, mode: str = 'fused',
+                 batch_pairs: int = 64, model: Optional[str] = None, backend: Optional[str] = None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode!r}, choose from {', '.join(MODES)}")
+        self.relevance_template = relevance_template
+        self.threshold = threshold
+        self.mode = mode
+        self.batch_pairs = batch_pairs
+        self.model = model
+        self.backend = backend
+        self.sentiment_labels = list(article.LABEL_TO_SCORE)
+        self.stats = FusedStats()
+
+    def is_relevant(self, result: Dict) -> bool:
+        return max(result['scores']) > self.threshold
+
+    def _cached(self, cache, texts, template, labels, multi_label) -> Tuple[List[Optional[Dict]], Optional[List]]:
+        if cache is None:
+            return [None] * len(texts), None
+        cache_model = models.cache_model_id(self.model, self.backend)
+        keys = [cache.key(cache_model, models.ZERO_SHOT, template, labels, multi_label, text) for text in texts]
+        return cache.get_many(keys), keys
+
+    def classify(self, chunks: List[str], labels: List[str]) -> List[Optional[float]]:
+        """Sentiment score for each chunk relevant to labels, None for the others."""
+        stats = FusedStats(chunks=len(chunks))
+        cache = inference_cache.get_cache()
+        relevance, relevance_keys = self._cached(cache, chunks, self.relevance_template, labels, True)
+        # Sentiment is scored on the cleaned text, as article.zero_shot_scores does
+        sentiment, sentiment_keys = self._cached(
+            cache, [article.clean_text(chunk) for chunk in chunks], models.DEFAULT_TEMPLATE,
+            self.sentiment_labels, False
+        )
+
+        need_relevance = [i for i, result in enumerate(relevance) if result is None]
+        need_sentiment = []
+        if self.mode == 'fused':
+            need_sentiment = [i for i, result in enumerate(sentiment)
+                              if result is None and (relevance[i] is None or self.is_relevant(relevance[i]))]
+        self._run(chunks, labels, need_relevance, need_sentiment, relevance, sentiment, stats)
+
+        if self.mode == 'short-circuit':
+            irrelevant = [i for i, result in enumerate(sentiment)
+                          if result is None and not self.is_relevant(relevance[i])]
+            stats.pairs_skipped = len(irrelevant) * len(self.sentiment_labels)
+            need_sentiment = [i for i, result in enumerate(sentiment)
+                              if result is None and self.is_relevant(relevance[i])]
+            self._run(chunks, labels, [], need_sentiment, relevance, sentiment, stats)
+
+        if cache is not None:
+            fresh = {relevance_keys[i]: relevance[i] for i in need_relevance}
+            fresh.update((sentiment_keys[i], sentiment[i]) for i in need_sentiment)
+            if fresh:
+                cache.put_many(fresh)
+
+        scores = []
+        for i in range(len(chunks)):
+            if self.is_relevant(relevance[i]):
+                stats.relevant += 1
+                scores.append(article.weighted_score(sentiment[i]))
+            else:
+                scores.append(None)
+        self.stats.add(stats)
+        return scores
+
+    def _run(self, chunks, labels, need_relevance, need_sentiment, relevance, sentiment, stats):
+        """Fill in relevance and sentiment results for the chunks at the given indices."""
+        indices = sorted(set(need_relevance) | set(need_sentiment))
+        if not indices:
+            return
+        pipeline = models.get_pipeline(models.ZERO_SHOT, self.model, backend=self.backend)
+        tokenizer = pipeline.tokenizer
+        began = time.perf_counter()
+
+        # Every premise and hypothesis is tokenized once, however many pairs it is in
+        with _tokenizer_lock:
+            premises = tokenizer([chunks[i] for i in indices], add_special_tokens=False)['input_ids']
+            hypotheses = tokenizer(
+                [self.relevance_template.format(label) for label in labels] +
+                [models.DEFAULT_TEMPLATE.format(label) for label in self.sentiment_labels],
+                add_special_tokens=False
+            )['input_ids']
+        premises = dict(zip(indices, premises))
+        groups = {RELEVANCE: (hypotheses[:len(labels)], need_relevance),
+                  SENTIMENT: (hypotheses[len(labels):], need_sentiment)}
+
+        limit = tokenizer.model_max_length - tokenizer.num_special_tokens_to_add(pair=True)
+        pairs = []
+        for group, (group_hypotheses, group_indices) in groups.items():
+            for i in group_indices:
+                for position, hypothesis in enumerate(group_hypotheses):
+                    # Truncate the premise only, as the pipeline does
+                    premise = premises[i][:max(0, limit - len(hypothesis))]
+                    pairs.append(((i, group, position), tokenizer.build_inputs_with_special_tokens(premise, hypothesis)))
+        stats.premises += len(indices)
+        stats.relevance_pairs += len(need_relevance) * len(labels)
+        stats.sentiment_pairs += len(need_sentiment) * len(self.sentiment_labels)
+
+        # Similar lengths together, so each batch pads as little as possible
+        pairs.sort(key=lambda pair: len(pair[1]))
+        logits = {}
+        backend = self.backend or models.current_backend()
+        for start in range(0, len(pairs), self.batch_pairs):
+            batch = pairs[start:start + self.batch_pairs]
+            with metrics.timer('model_seconds', backend=backend):
+                rows = self._forward(pipeline, [ids for _, ids in batch])
+            for (key, _), row in zip(batch, rows):
+                logits[key] = row
+            stats.forward_passes += 1
+            metrics.inc('model_calls_total', backend=backend)
+            metrics.inc('model_pairs_total', len(batch), backend=backend)
+
+        entailment = self._entailment_id(pipeline.model)
+        contradiction = -1 if entailment == 0 else 0
+        for i in need_relevance:
+            scores = [_softmax([logits[(i, RELEVANCE, position)][contradiction],
+                                logits[(i, RELEVANCE, position)][entailment]])[1] for position in range(len(labels))]
+            relevance[i] = _ranked(labels, scores)
+        for i in need_sentiment:
+            scores = _softmax([logits[(i, SENTIMENT, position)][entailment]
+                               for position in range(len(self.sentiment_labels))])
+            sentiment[i] = _ranked(self.sentiment_labels, scores)
+
+        cache = inference_cache.get_cache()
+        if cache is not None:
+            cache.record_model_time(time.perf_counter() - began, len(need_relevance) + len(need_sentiment))
+
+    @staticmethod
+    def _entailment_id(model) -> int:
+        for label, index in model.config.label2id.items():
+            if label.lower().startswith('entail'):
+                return index
+        return -1
+
+    @staticmethod
+    def _forward(pipeline, input_ids: List[List[int]]) -> List[List[float]]:
+        """Logits for a batch of already built pairs."""
+        with _tokenizer_lock:
+            inputs = pipeline.tokenizer.pad({'input_ids': input_ids}, return_tensors='pt')
+        device = getattr(pipeline.model, 'device', None)
+        if device is not None and hasattr(inputs, 'to'):
+            inputs = inputs.to(device)
+        torch = sys.modules.get('torch')
+        with torch.inference_mode() if torch is not None else contextlib.nullcontext():
+            return pipeline.model(**inputs).logits.tolist()
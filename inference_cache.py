@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+DEFAULT_PATH = 'inference_cache.db'
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class InferenceCache:
+    """Pipeline results keyed by a hash of everything that affects them.
+
+    An in-memory LRU sits in front of a SQLite table. Disk entries are evicted
+    once they are older than max_age seconds or there are more than
+    max_entries of them, least recently used first.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, memory_entries=50000, max_entries=2000000,
+                 max_age=30 * 24 * 3600, evict_every=1000):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.evict_every = evict_every
+
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.model_seconds = 0.0
+        self.model_items = 0
+
+        # Worker processes share the file, so wait on their locks rather than fail
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def key(model: str, task: str, hypothesis_template: str, labels: List[str],
+            multi_label: bool, text: str) -> str:
+        payload = json.dumps(
+            [model, task, hypothesis_template, list(labels), bool(multi_label), normalize_text(text)]
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: List[str]) -> List[Optional[Dict]]:
+        """Look up each key, returning None for the ones not cached."""
+        results = [None] * len(keys)
+        with self._lock:
+            missing = []
+            for i, key in enumerate(keys):
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    results[i] = self._memory[key]
+                    self.memory_hits += 1
+                else:
+                    missing.append(i)
+
+            if missing:
+                wanted = list({keys[i] for i in missing})
+                found = {}
+                # Stay under SQLite's bound parameter limit
+                for start in range(0, len(wanted), 500):
+                    part = wanted[start:start + 500]
+                    rows = self._conn.execute(
+                        f'SELECT key, value FROM results WHERE key IN ({",".join("?" * len(part))})',
+                        part
+                    ).fetchall()
+                    found.update((key, json.loads(value)) for key, value in rows)
+
+                if found:
+                    self._conn.executemany(
+                        'UPDATE results SET accessed = ? WHERE key = ?',
+                        [(time.time(), key) for key in found]
+                    )
+                    self._conn.commit()
+
+                for i in missing:
+                    value = found.get(keys[i])
+                    if value is None:
+                        self.misses += 1
+                    else:
+                        self.disk_hits += 1
+                        self._remember(keys[i], value)
+                        results[i] = value
+        return results
+
+    def put_many(self, items: Dict[str, Dict]):
+        now = time.time()
+        with self._lock:
+            for key, value in items.items():
+                self._remember(key, value)
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO results (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                [(key, json.dumps(value), now, now) for key, value in items.items()]
+            )
+            self._conn.commit()
+            self._writes_since_evict += len(items)
+            should_evict = self._writes_since_evict >= self.evict_every
+
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """Drop entries past max_age, then the least recently used beyond max_entries."""
+        with self._lock:
+            self._writes_since_evict = 0
+            if self.max_age:
+                self._conn.execute('DELETE FROM results WHERE created < ?', (time.time() - self.max_age,))
+            if self.max_entries:
+                self._conn.execute(
+                    'DELETE FROM results WHERE key IN ('
+                    'SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entries,)
+                )
+            self._conn.commit()
+
+    def record_model_time(self, seconds: float, items: int):
+        """Note time spent running the model on cache misses."""
+        with self._lock:
+            self.model_seconds += seconds
+            self.model_items += items
+
+    def stats(self) -> Dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        per_item = self.model_seconds / self.model_items if self.model_items else 0.0
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+            'model_seconds': self.model_seconds,
+            'estimated_seconds_saved': hits * per_item,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute('DELETE FROM results')
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+# configure() records its choice in INFERENCE_CACHE, the path or empty for
+# off, so spawned worker processes open the same cache or none
+_enabled = os.environ.get('INFERENCE_CACHE') != ''
+
+
+def configure(path=DEFAULT_PATH, enabled=True, **kwargs):
+    """Replace the shared cache, e.g. to move it or switch it off."""
+    global _cache, _enabled
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+        _enabled = enabled
+        os.environ['INFERENCE_CACHE'] = path if enabled else ''
+        _cache = InferenceCache(path, **kwargs) if enabled else None
+
+
+def get_cache() -> Optional[InferenceCache]:
+    """The shared cache, opened on first use. None when caching is switched off."""
+    global _cache
+    if not _enabled:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None and _enabled:
+                _cache = InferenceCache(os.environ.get('INFERENCE_CACHE') or DEFAULT_PATH)
+    return _cache
@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+import metrics
+import storage
+from storage import DEFAULT_DB_URL
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveThrottle:
+    """Delay shared by all Yahoo requests, growing on HTTP 429 and easing off again on success"""
+
+    def __init__(self, min_delay=0.0, max_delay=60.0, backoff=2.0, recovery=0.8, initial_backoff=1.0):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.recovery = recovery
+        self.initial_backoff = initial_backoff
+        self.delay = min_delay
+        self.rate_limited_count = 0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until this caller's turn, spacing callers delay seconds apart."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_slot)
+            self._next_slot = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+
+    def success(self):
+        with self._lock:
+            self.delay = max(self.min_delay, self.delay * self.recovery)
+            if self.delay < 0.01:
+                self.delay = self.min_delay
+
+    def rate_limited(self):
+        with self._lock:
+            self.rate_limited_count += 1
+            self.delay = min(self.max_delay, max(self.initial_backoff, self.delay * self.backoff))
+            # Everyone waits out the new delay, not just the next caller
+            self._next_slot = max(self._next_slot, time.monotonic() + self.delay)
+
+
+def is_rate_limited(error: Exception) -> bool:
+    text = f"{type(error).__name__} {error}"
+    return 'RateLimit' in text or '429' in text or 'Too Many Requests' in text
+
+
+def fetch_ticker_data(symbol: str, throttle: AdaptiveThrottle, info: Optional[Dict] = None,
+                      retries: int = 6) -> Dict:
+    """Fetch info and news for one symbol. With info given, only the news is fetched."""
+    import yfinance as yf
+
+    ticker = yf.Ticker(symbol)
+    for attempt in range(retries):
+        throttle.wait()
+        try:
+            with metrics.timer('yahoo_seconds', ticker=symbol):
+                data = {
+                    'info': info if info is not None else ticker.info,
+                    'news': ticker.news,
+                    'date': date.today().isoformat()
+                }
+            throttle.success()
+            return data
+        except Exception as e:
+            if not is_rate_limited(e) or attempt == retries - 1:
+                raise
+            metrics.inc('yahoo_rate_limited_total')
+            throttle.rate_limited()
+    raise RuntimeError(f"Gave up on {symbol} after {retries} attempts")
+
+
+def load_cached(symbols: Iterable[str], db_url: str = DEFAULT_DB_URL,
+                day: Optional[date] = None) -> Dict[str, Dict]:
+    """Cached data for every symbol stored for day, one query per 500 symbols."""
+    return storage.load_ticker_data(symbols, day, db_url)
+
+
+def bulk_upsert(ticker_data: Dict[str, Dict], db_url: str = DEFAULT_DB_URL, day: Optional[date] = None):
+    """Write all symbols' data in a single transaction."""
+    storage.upsert_ticker_data(ticker_data, day, db_url)
+
+
+def ingest(symbols: List[str], db_url: str = DEFAULT_DB_URL, workers: int = 8,
+           refresh_news: bool = False, throttle: Optional[AdaptiveThrottle] = None) -> Dict[str, Dict]:
+    """Ticker data for every symbol, fetching only what today's cache doesn't have.
+
+    With refresh_news, symbols already cached today get fresh news but keep
+    the day's info. Symbols that fail are reported and left out.
+    """
+    throttle = throttle or AdaptiveThrottle()
+    cached = load_cached(symbols, db_url)
+
+    if refresh_news:
+        jobs = {symbol: cached.get(symbol, {}).get('info') for symbol in symbols}
+    else:
+        jobs = {symbol: None for symbol in symbols if symbol not in cached}
+    logger.info("%d of %d symbols cached today, fetching %d", len(cached), len(symbols), len(jobs))
+
+    fetched = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(fetch_ticker_data, symbol, throttle, info): symbol
+            for symbol, info in jobs.items()
+        }
+        for future in as_completed(futures):
+            symbol = futures[future]
+            try:
+                fetched[symbol] = future.result()
+            except Exception as e:
+                logger.warning("Error fetching %s: %s", symbol, e)
+
+    bulk_upsert(fetched, db_url)
+    if throttle.rate_limited_count:
+        logger.info("Rate limited %d times, delay now %.2fs", throttle.rate_limited_count, throttle.delay)
+
+    # Keep the caller's symbol order
+    return {
+        symbol: fetched.get(symbol, cached.get(symbol))
+        for symbol in symbols
+        if symbol in fetched or symbol in cached
+    }
@@ -1,15 +1,189 @@
 # main.py
-from stocks import get_sp500_stocks
+import argparse
+import logging
+import time
+from datetime import date
 
+import article
+import backends
+import cascade
+import dedup
+import fused
+import inference_cache
+import metrics
+import models
+from retrieval.article_retrieval import ArticleRetrieval
+from retrieval.article_store import get_article_store
+from retrieval.chunking import ChunkStats
+from retrieval.page_cache import configure_page_cache
+from retrieval.reddit_article_retrieval import DEFAULT_SUBREDDITS, RedditArticleRetrieval
+from retrieval.relevance import RelevanceStats
+from retrieval import tagger
+from retrieval.twitter_article_retrieval import DEFAULT_QUERIES, TwitterArticleRetrieval
+from runner import StageSizes, StagedRunner
+from streaming import stream_scored
+from stocks import (DEFAULT_RETRIEVERS, configure_retrievers, get_retrieval_classes, get_sp500_stocks,
+                    get_sp500_symbols, score_stocks, write_sentiment)
 
-def main():
 
-    # Get stock data
-    stocks = get_sp500_stocks()
+def main(parallel=False, sizes=None, stream=False, incremental=False, metrics_prefix=None, tag=False,
+         anomalies=False):
 
-    # Write results to DB
-    for stock in stocks.values():
-        stock.update_sentiment_data()
+    if parallel:
+        # Each stage gets its own pool, model workers load the model themselves
+        # Incremental reruns get today's latest news and skip the links earlier runs checked
+        StagedRunner(sizes, refresh_news=incremental, tag=tag, incremental=incremental).run(get_sp500_symbols())
+    else:
+        # Load the model once up front so the first stock doesn't pay for it
+        models.registry.warm_up()
+        for (task, model, device, backend), stats in models.registry.stats().items():
+            print(f"Loaded {model} ({task}, {backend} on device {device}) in {stats.load_seconds:.1f}s, "
+                  f"+{stats.rss_delta / 2**20:.0f} MB RSS")
+
+        # Get stock data. Incremental reruns need today's latest news, but
+        # only fetch and score the links earlier runs haven't seen
+        stocks = get_sp500_stocks(refresh_news=incremental, incremental=incremental)
+        if tag:
+            # One automaton over the whole universe, so each page is scanned once rather than per stock
+            tagger.configure([stock.info for stock in stocks.values()])
+
+        if stream:
+            # Score articles as the feeds produce them
+            start = time.perf_counter()
+            scored = 0
+            for _ in stream_scored(stocks.values()):
+                if not scored:
+                    print(f"First article scored after {time.perf_counter() - start:.1f}s")
+                scored += 1
+            print(f"Scored {scored} articles in {time.perf_counter() - start:.1f}s")
+        else:
+            # Score every article in shared batches before writing
+            score_stocks(stocks.values())
+
+        # Write results to DB in one transaction
+        write_sentiment(stocks.values())
+
+    store = get_article_store().stats
+    print(f"Pages: {store.fetches} fetched ({store.fetch_errors} failed), "
+          f"{store.parses} parsed, {store.hits} served from the run store, "
+          f"{store.evictions} evicted for memory")
+    print(f"Page cache: {get_article_store().page_cache.stats}")
+
+    relevance = RelevanceStats()
+    chunking = ChunkStats()
+    fused_stats = fused.FusedStats()
+    for retrieval in get_retrieval_classes():
+        relevance.add(retrieval.relevance_stats)
+        chunking.add(retrieval.chunk_stats)
+        if retrieval._fused is not None:
+            fused_stats.add(retrieval._fused.stats)
+    print(f"Chunking: {chunking}")
+    print(f"Relevance: {relevance}")
+    if fused_stats.chunks:
+        print(f"Fused relevance and sentiment: {fused_stats}")
+    if dedup.get_index() is not None:
+        print(f"Near duplicates: {dedup.get_index().stats}")
+
+    scorer = article.get_scorer()
+    if isinstance(scorer, cascade.CascadeScorer):
+        print(f"Cascade: {scorer.stats}")
+
+    cache = inference_cache.get_cache()
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Inference cache: {stats['memory_hits'] + stats['disk_hits']} hits, "
+              f"{stats['misses']} misses, ~{stats['estimated_seconds_saved']:.0f}s of model time saved")
+
+    if metrics.enabled():
+        summary = metrics.get_metrics().summary()
+        print("Slowest stages:")
+        for name, histogram in sorted(summary['histograms'].items(), key=lambda item: -item[1]['sum']):
+            print(f"  {name}: {histogram['sum']:.1f}s over {histogram['count']} "
+                  f"(p50 {histogram['p50'] * 1000:.0f} ms, p95 {histogram['p95'] * 1000:.0f} ms)")
+        if metrics_prefix:
+            metrics.write_summary(f"{metrics_prefix}.json")
+            metrics.write_prometheus(f"{metrics_prefix}.prom")
+            print(f"Metrics written to {metrics_prefix}.json and {metrics_prefix}.prom")
+
+    if anomalies:
+        # Imported here as it pulls in numpy and pandas
+        import analytics
+
+        # Today's sentiment against each symbol's own trailing history
+        flagged = analytics.load().anomalies(since=date.today())
+        print(f"Anomalies today: {len(flagged)}")
+        if len(flagged):
+            print(flagged.head(20).to_string(index=False))
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Update today's sentiment for the S&P 500")
+    # The staged runner finishes each stage for every stock before the next, so it can't stream
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--parallel', action='store_true', help='run as separate stages with their own pools')
+    mode.add_argument('--stream', action='store_true', help='score articles as they arrive rather than after all feeds')
+    parser.add_argument('--incremental', action='store_true',
+                        help="only fetch and score what earlier runs today haven't seen")
+    parser.add_argument('--model', help=f"NLI checkpoint, e.g. {models.DISTILLED_MODEL}")
+    parser.add_argument('--backend', choices=list(backends.BACKENDS), help='how the model is run')
+    parser.add_argument('--cascade', action='store_true',
+                        help='score with a finance lexicon first and zero-shot only the uncertain chunks')
+    parser.add_argument('--cascade-band', type=float, nargs=2, default=(-0.35, 0.35), metavar=('LOW', 'HIGH'),
+                        help='first-stage scores between these go on to zero-shot')
+    parser.add_argument('--cascade-model', help='small classifier for the first stage, e.g. ProsusAI/finbert')
+    parser.add_argument('--fused', choices=fused.MODES,
+                        help='score sentiment in the relevance pass, all pairs together or only for relevant chunks')
+    parser.add_argument('--tag', action='store_true',
+                        help='look up which companies each page mentions, using the model only for '
+                             'symbols that are also words')
+    parser.add_argument('--dedup', action='store_true',
+                        help='check and score one copy of each syndicated story, attaching the others to it')
+    parser.add_argument('--dedup-threshold', type=float, default=0.8,
+                        help='estimated shingle similarity at which pages are the same story')
+    parser.add_argument('--dedup-days', type=int, default=3, help='days a story is remembered for')
+    parser.add_argument('--reddit', nargs='*', metavar='SUBREDDIT',
+                        help=f"also read posts from these subreddits, by default {', '.join(DEFAULT_SUBREDDITS)}")
+    parser.add_argument('--twitter', nargs='*', metavar='QUERY',
+                        help='also read tweets from these recent searches, needs TWITTER_BEARER_TOKEN')
+    parser.add_argument('--page-cache-mb', type=int, default=256, help='memory ceiling for cached pages, and another for their extracted text and chunks')
+    parser.add_argument('--page-cache-text', action='store_true',
+                        help='keep extracted text on disk rather than raw HTML')
+    parser.add_argument('--metrics', metavar='PREFIX', nargs='?', const='run_metrics',
+                        help='collect per-stage metrics, writing PREFIX.json and PREFIX.prom at the end')
+    parser.add_argument('--metrics-port', type=int, help='also serve the metrics on :PORT/metrics during the run')
+    parser.add_argument('--anomalies', action='store_true',
+                        help="list today's sentiment shocks against each symbol's history after the write")
+    parser.add_argument('--log-level', default='INFO')
+    defaults = StageSizes()
+    for stage in ('ingest', 'fetch', 'extract', 'relevance', 'sentiment', 'torch_threads'):
+        parser.add_argument(f"--{stage.replace('_', '-')}", type=int, default=getattr(defaults, stage),
+                            help='torch threads per model worker' if stage == 'torch_threads'
+                            else f"{stage} pool size (0 runs it inline)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format='%(message)s')
+    if args.metrics or args.metrics_port:
+        metrics.configure(enabled=True)
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    models.configure(args.model, args.backend)
+    if args.cascade:
+        cascade.configure(band=tuple(args.cascade_band), model=args.cascade_model)
+    ArticleRetrieval.fused_mode = args.fused
+
+    # Social streams are polled once for every stock, then routed to the stocks they mention
+    social = []
+    if args.reddit is not None:
+        social.append((RedditArticleRetrieval, (args.reddit or DEFAULT_SUBREDDITS,)))
+    if args.twitter is not None:
+        social.append((TwitterArticleRetrieval, (args.twitter or DEFAULT_QUERIES,)))
+    if social:
+        configure_retrievers(DEFAULT_RETRIEVERS + social)
+
+    configure_page_cache(store_text=args.page_cache_text, memory_bytes=args.page_cache_mb * 2**20)
+    if args.dedup:
+        dedup.configure(threshold=args.dedup_threshold, days=args.dedup_days)
+
+    main(args.parallel, StageSizes(args.ingest, args.fetch, args.extract, args.relevance,
+                                   args.sentiment, args.torch_threads), args.stream, args.incremental, args.metrics,
+         args.tag, args.anomalies)
@@ -0,0 +1,284 @@
+"""Counters and latency histograms for a run, labelled by ticker, source, domain and the like.
+
+Off by default, and while off every call returns straight away, so the
+instrumentation can stay in hot paths. configure() switches it on for this
+process and any it spawns. Results come out as Prometheus text, from a file or
+an HTTP endpoint, or as a JSON summary at the end of the run. Worker
+processes hand theirs back with drain() for the parent to merge().
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+# Upper bounds in seconds, from a cached lookup to a browser load that times out
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict) -> Key:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # The last count is for values above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, counts, total):
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.count += sum(counts)
+        self.sum += total
+
+    def quantile(self, q: float) -> float:
+        """Estimated by interpolating within the bucket the quantile falls in."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.buckets[i - 1] if i else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    def __init__(self):
+        self.counters: Dict[Key, float] = {}
+        self.histograms: Dict[Key, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, amount: float = 1, labels: Optional[Dict] = None):
+        key = _key(name, labels or {})
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, labels: Optional[Dict] = None):
+        key = _key(name, labels or {})
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self) -> Dict:
+        """Everything recorded so far, in a form that pickles and merges."""
+        with self._lock:
+            return {
+                'counters': list(self.counters.items()),
+                'histograms': [(key, list(h.counts), h.sum) for key, h in self.histograms.items()],
+            }
+
+    def merge(self, snapshot: Dict):
+        with self._lock:
+            for key, amount in snapshot['counters']:
+                self.counters[key] = self.counters.get(key, 0) + amount
+            for key, counts, total in snapshot['histograms']:
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram()
+                histogram.merge(counts, total)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def prometheus_text(self) -> str:
+        def render(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{label}="{_escape(value)}"' for label, value in pairs) + '}'
+
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{render(labels)} {value:g}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{render(labels, [('le', f'{bound:g}')])} {cumulative}")
+                lines.append(f"{name}_bucket{render(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{name}_sum{render(labels)} {histogram.sum:g}")
+                lines.append(f"{name}_count{render(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> Dict:
+        """Totals per metric and per label value, with latency percentiles for histograms."""
+        result = {'counters': {}, 'histograms': {}}
+        with self._lock:
+            for (name, labels), value in self.counters.items():
+                entry = result['counters'].setdefault(name, {'total': 0, 'by_label': {}})
+                entry['total'] += value
+                for label, label_value in labels:
+                    by_value = entry['by_label'].setdefault(label, {})
+                    by_value[label_value] = by_value.get(label_value, 0) + value
+
+            merged: Dict[str, Histogram] = {}
+            by_label: Dict[str, Dict[str, Dict[str, Histogram]]] = {}
+            for (name, labels), histogram in self.histograms.items():
+                merged.setdefault(name, Histogram()).merge(histogram.counts, histogram.sum)
+                for label, label_value in labels:
+                    by_label.setdefault(name, {}).setdefault(label, {}).setdefault(
+                        label_value, Histogram()).merge(histogram.counts, histogram.sum)
+
+        def describe(histogram):
+            return {'count': histogram.count, 'sum': histogram.sum,
+                    'p50': histogram.quantile(0.5), 'p95': histogram.quantile(0.95)}
+
+        for name, histogram in merged.items():
+            entry = describe(histogram)
+            # The slowest few values of each label, which is where a slow run shows up
+            entry['slowest'] = {
+                label: dict(sorted(((value, describe(h)) for value, h in values.items()),
+                                   key=lambda item: -item[1]['sum'])[:10])
+                for label, values in by_label.get(name, {}).items()
+            }
+            result['histograms'][name] = entry
+        return result
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class _Timer:
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _metrics.observe(self.name, time.perf_counter() - self.start, self.labels)
+        if exc_type is not None:
+            _metrics.inc('errors_total', 1, dict(self.labels, stage=self.name.replace('_seconds', '')))
+        return False
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+_metrics = Metrics()
+_enabled = os.environ.get('SENTIMENT_METRICS') == '1'
+
+
+def configure(enabled: bool = True):
+    """Switch collection on or off, for this process and any it spawns."""
+    global _enabled
+    _enabled = enabled
+    if enabled:
+        os.environ['SENTIMENT_METRICS'] = '1'
+    else:
+        os.environ.pop('SENTIMENT_METRICS', None)
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def inc(name: str, amount: float = 1, **labels):
+    if _enabled:
+        _metrics.inc(name, amount, labels)
+
+
+def observe(name: str, value: float, **labels):
+    if _enabled:
+        _metrics.observe(name, value, labels)
+
+
+def timer(name: str, **labels):
+    """Time a with block into the histogram name, e.g. fetch_seconds, counting it under
+    errors_total{stage="fetch"} if it raises."""
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(name, labels)
+
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+def drain() -> Optional[Dict]:
+    """What this process has recorded since the last drain, e.g. to send back from a worker."""
+    if not _enabled:
+        return None
+    snapshot = _metrics.snapshot()
+    _metrics.reset()
+    return snapshot
+
+
+def merge(snapshot: Optional[Dict]):
+    if snapshot is not None:
+        _metrics.merge(snapshot)
+
+
+def write_prometheus(path: str):
+    """Write the metrics in Prometheus text format, e.g. for node_exporter's textfile collector."""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(_metrics.prometheus_text())
+    os.replace(tmp, path)
+
+
+def write_summary(path: str):
+    with open(path, 'w') as f:
+        json.dump(_metrics.summary(), f, indent=2)
+
+
+def serve(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serve /metrics in Prometheus text format from a background thread."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = _metrics.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
@@ -0,0 +1,269 @@
+import gc
+import os
+import resource
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import backends
+import inference_cache
+import metrics
+
+# torch and transformers take seconds to import, so they are only imported
+# once a model is actually needed
+
+
+ZERO_SHOT = "zero-shot-classification"
+DEFAULT_MODEL = "facebook/bart-large-mnli"
+# Distilled from DEFAULT_MODEL, about a third of the layers
+DISTILLED_MODEL = "valhalla/distilbart-mnli-12-3"
+DEFAULT_BACKEND = 'torch'
+# The zero-shot pipeline's own default template
+DEFAULT_TEMPLATE = "This example is {}."
+
+
+# Model and backend used when callers don't name one. Set through configure()
+# or the SENTIMENT_MODEL and SENTIMENT_BACKEND environment variables, which
+# spawned worker processes inherit.
+_settings = {
+    'model': os.environ.get('SENTIMENT_MODEL', DEFAULT_MODEL),
+    'backend': os.environ.get('SENTIMENT_BACKEND', DEFAULT_BACKEND),
+}
+
+
+def configure(model: Optional[str] = None, backend: Optional[str] = None):
+    """Choose the default model and inference backend, for this process and any it spawns."""
+    if backend is not None:
+        backends.get_backend(backend)
+        _settings['backend'] = os.environ['SENTIMENT_BACKEND'] = backend
+    if model is not None:
+        _settings['model'] = os.environ['SENTIMENT_MODEL'] = model
+
+
+def current_model() -> str:
+    return _settings['model']
+
+
+def current_backend() -> str:
+    return _settings['backend']
+
+
+def default_device() -> int:
+    """Pick the first GPU if there is one, otherwise the CPU."""
+    try:
+        import torch
+    except ImportError:
+        # Backends like ONNX Runtime run without torch, on the CPU
+        return -1
+    return 0 if torch.cuda.is_available() else -1
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is the peak rather than the current size, but it is the
+        # best we have on platforms without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@dataclass
+class LoadStats:
+    """How long a pipeline took to load and how much memory it took."""
+    load_seconds: float
+    rss_before: int
+    rss_after: int
+
+    @property
+    def rss_delta(self) -> int:
+        return self.rss_after - self.rss_before
+
+
+ModelKey = Tuple[str, str, int, str]
+
+
+class ModelRegistry:
+    """Loads each (task, model, device, backend) pipeline once and hands out the same instance"""
+
+    def __init__(self):
+        self._pipelines: Dict[ModelKey, object] = {}
+        self._tokenizers: Dict[Tuple[str, str], object] = {}
+        self._stats: Dict[ModelKey, LoadStats] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[ModelKey, threading.Lock] = {}
+
+    def _key(self, task, model, device, backend) -> ModelKey:
+        return (
+            task,
+            model or current_model(),
+            default_device() if device is None else device,
+            backend or current_backend()
+        )
+
+    def _key_lock(self, key: ModelKey) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get(self, task=ZERO_SHOT, model=None, device=None, backend=None):
+        """Return the shared pipeline, loading it through its backend on first use.
+
+        model and backend default to the configured ones, see configure().
+        """
+        key = self._key(task, model, device, backend)
+        loaded = self._pipelines.get(key)
+        if loaded is not None:
+            return loaded
+
+        # Only one thread loads a given model, others wait for it rather than
+        # loading their own copy
+        with self._key_lock(key):
+            loaded = self._pipelines.get(key)
+            if loaded is None:
+                rss_before = current_rss()
+                start = time.perf_counter()
+                loaded = backends.get_backend(key[3]).load(key[0], key[1], key[2])
+                self._stats[key] = LoadStats(
+                    load_seconds=time.perf_counter() - start,
+                    rss_before=rss_before,
+                    rss_after=current_rss()
+                )
+                self._pipelines[key] = loaded
+        return loaded
+
+    def tokenizer(self, model=None, backend=None):
+        """The model's fast tokenizer, loaded once. Far lighter than the pipeline,
+        so chunking doesn't need the model itself."""
+        key = (model or current_model(), backend or current_backend())
+        loaded = self._tokenizers.get(key)
+        if loaded is not None:
+            return loaded
+
+        with self._key_lock(('tokenizer', key[0], -1, key[1])):
+            loaded = self._tokenizers.get(key)
+            if loaded is None:
+                loaded = backends.get_backend(key[1]).tokenizer(key[0])
+                self._tokenizers[key] = loaded
+        return loaded
+
+    def warm_up(self, keys: Optional[List[Tuple]] = None):
+        """Load pipelines up front, by default the configured zero-shot model."""
+        for key in keys or [(ZERO_SHOT,)]:
+            self.get(*key)
+
+    def unload(self, task=None, model=None, device=None, backend=None) -> int:
+        """Drop every loaded pipeline matching the given fields, returns how many were dropped."""
+        with self._lock:
+            keys = [
+                key for key in self._pipelines
+                if (task is None or key[0] == task)
+                and (model is None or key[1] == model)
+                and (device is None or key[2] == device)
+                and (backend is None or key[3] == backend)
+            ]
+            for key in keys:
+                del self._pipelines[key]
+                self._stats.pop(key, None)
+
+        if keys:
+            gc.collect()
+            # Nothing can be on the GPU if torch was never imported
+            torch = sys.modules.get('torch')
+            if torch is not None and torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        return len(keys)
+
+    def is_loaded(self, task=ZERO_SHOT, model=None, device=None, backend=None) -> bool:
+        return self._key(task, model, device, backend) in self._pipelines
+
+    def stats(self) -> Dict[ModelKey, LoadStats]:
+        return dict(self._stats)
+
+
+registry = ModelRegistry()
+
+
+def get_pipeline(task=ZERO_SHOT, model=None, device=None, backend=None):
+    """Shared pipeline from the process-wide registry."""
+    return registry.get(task, model, device, backend)
+
+
+def get_tokenizer(model=None, backend=None):
+    """Shared fast tokenizer from the process-wide registry."""
+    return registry.tokenizer(model, backend)
+
+
+def cache_model_id(model=None, backend=None) -> str:
+    """What the inference cache keys results from model on backend by."""
+    model = model or current_model()
+    backend = backend or current_backend()
+    # Results from other backends differ slightly, so they are cached apart.
+    # torch keeps the bare model name so existing cache entries stay valid.
+    return model if backend == DEFAULT_BACKEND else f"{model}+{backend}"
+
+
+def classify(texts: List[str], labels: List[str], hypothesis_template=DEFAULT_TEMPLATE,
+             multi_label=False, batch_size=1, model=None, backend=None) -> List[Dict]:
+    """Zero-shot classify texts, answering from the inference cache where possible.
+
+    Texts missing from the cache are sorted by length and sent to the pipeline
+    batch_size texts at a time. Results come back in the order of texts.
+    model and backend default to the configured ones.
+    """
+    model = model or current_model()
+    backend = backend or current_backend()
+    cache_model = cache_model_id(model, backend)
+    cache = inference_cache.get_cache()
+    results = [None] * len(texts)
+    keys = None
+    if cache is not None:
+        keys = [
+            cache.key(cache_model, ZERO_SHOT, hypothesis_template, labels, multi_label, text)
+            for text in texts
+        ]
+        results = cache.get_many(keys)
+
+    # Classify each distinct missing text once
+    missing = {}
+    for i, result in enumerate(results):
+        if result is None:
+            missing.setdefault(texts[i], []).append(i)
+    pending = sorted(missing, key=len)
+    if keys is not None:
+        metrics.inc('inference_cache_total', len(texts) - sum(len(indices) for indices in missing.values()),
+                    outcome='hit')
+        metrics.inc('inference_cache_total', sum(len(indices) for indices in missing.values()), outcome='miss')
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        began = time.perf_counter()
+        # batch_size for the zero-shot pipeline counts premise/hypothesis pairs
+        pipeline = get_pipeline(ZERO_SHOT, model, backend=backend)
+        with metrics.timer('model_seconds', backend=backend):
+            outputs = pipeline(
+                batch,
+                candidate_labels=labels,
+                hypothesis_template=hypothesis_template,
+                multi_label=multi_label,
+                batch_size=len(batch) * len(labels)
+            )
+        metrics.inc('model_calls_total', backend=backend)
+        metrics.inc('model_pairs_total', len(batch) * len(labels), backend=backend)
+        if isinstance(outputs, dict):
+            outputs = [outputs]
+
+        fresh = {}
+        for text, output in zip(batch, outputs):
+            result = {'labels': output['labels'], 'scores': output['scores']}
+            for i in missing[text]:
+                results[i] = result
+                if keys is not None:
+                    fresh[keys[i]] = result
+        if cache is not None:
+            cache.record_model_time(time.perf_counter() - began, len(batch))
+            cache.put_many(fresh)
+
+    return results
@@ -1,149 +1,499 @@
-import time
-from typing import List
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Container, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
 
-from bs4 import BeautifulSoup
-import nltk
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-import torch
-from transformers import pipeline
-from webdriver_manager.chrome import ChromeDriverManager
-from typing import List
+from article import LABEL_TO_SCORE, Article, get_scorer
+import metrics
+import models
+from fused import FusedClassifier
+from .article_store import StoredPage, get_article_store
+from .browser_pool import get_browser_pool
+from .chunking import NAME_RESERVE, ChunkStats, TokenChunker
+from .extraction import Extraction, extract
+from .fetcher import get_fetcher
+from .relevance import LexicalMatcher, RelevanceStats
+from .tagger import PageTags, get_tagger
 
-from .captcha_generic_agent import CaptchaSolvingAgent
 
+logger = logging.getLogger(__name__)
 
-nltk.download('punkt', quiet=True)
+RELEVANCE_TEMPLATE = "This text is relevant to {}"
+
+# None until the first call finds out whether punkt can be had
+_punkt_ready = None
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def sent_tokenize(text):
+    """nltk's sentence splitter, fetching the punkt data the first time it is needed.
+
+    Without the data, e.g. offline, sentences are split after . ! and ?
+    """
+    global _punkt_ready
+    import nltk
+
+    if _punkt_ready is None:
+        # Newer nltk releases read punkt_tab rather than punkt
+        nltk.download('punkt', quiet=True)
+        nltk.download('punkt_tab', quiet=True)
+        try:
+            nltk.sent_tokenize('Ready.')
+            _punkt_ready = True
+        except LookupError:
+            logger.warning("punkt isn't available, splitting sentences on punctuation")
+            _punkt_ready = False
+    if _punkt_ready:
+        return nltk.sent_tokenize(text)
+    return [sentence for sentence in _SENTENCE_END.split(text) if sentence]
+
+
+def split_sentences(text):
+    """Sentences of each line of text, so none runs from one paragraph into the next."""
+    return [sentence for line in text.split('\n') if line.strip() for sentence in sent_tokenize(line)]
 
 
 class ArticleRetrieval:
 
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()))
+    # Skip the model for chunks that never mention the company
+    lexical_prefilter = True
+    # Extra names per symbol for the lexical prefilter
+    aliases: Dict[str, List[str]] = {}
+    relevance_threshold = 0.7
+    # Links fetched together when streaming, see iter_articles
+    prefetch_window = 8
+    # Tokens of whole sentences repeated between consecutive chunks
+    chunk_overlap = 0
+    # Cap on tokens per premise and hypothesis pair, None for the model's own limit
+    max_tokens = None
+    # 'fused' or 'short-circuit' to score sentiment in the relevance pass, see
+    # fused.FusedClassifier. None keeps the two apart, as does a cascade scorer.
+    fused_mode: Optional[str] = None
+    # Fused scores kept for chunk_scores to pick up, the least recently used dropped first
+    fused_score_entries = 4096
 
     def __init__(self, requests_per_second=10):
-        self.relevance_pipeline = pipeline(
-            "zero-shot-classification",
-            model="facebook/bart-large-mnli",
-            device=0 if torch.cuda.is_available() else -1
-        )
-        self.max_length = 512
-        self.delay = 1.0 / requests_per_second if requests_per_second > 0 else 0
-        self.last_request_time = 0
-        self._url_cache = {}
-
-    def _is_article_page(self, page_source):
+        self._chunker = None
+        self.chunk_stats = ChunkStats()
+        # Plain HTTP goes through the shared fetcher and JS-only pages through
+        # the shared browser pool, each with its own rate limit
+        self.fetcher = get_fetcher()
+        self.browser_pool = get_browser_pool()
+        self.article_store = get_article_store()
+        self._matchers = {}
+        self.relevance_stats = RelevanceStats()
+        self._fused = None
+        # Sentiment of the chunks the fused pass found relevant, shared by streaming threads
+        self._fused_scores: OrderedDict = OrderedDict()
+        self._fused_lock = threading.Lock()
+
+    @property
+    def relevance_pipeline(self):
+        return models.get_pipeline()
+
+    def candidates(self, data) -> List[Tuple[str, str]]:
+        """(title, link) pairs worth checking for the stock in data"""
+        raise NotImplementedError
+
+    @property
+    def source(self) -> str:
+        """What metrics label this retriever's work with."""
+        return type(self).__name__
+
+    def describe(self, data) -> str:
+        return f"{type(self).__name__} articles for {data['info']['symbol']}"
+
+    def iter_checked(self, data, prefetch_window: Optional[int] = None,
+                     skip: Container[str] = ()) -> Iterator[Tuple[str, str, List[str]]]:
+        """(title, link, relevant chunks) for each candidate, as each one is ready.
+
+        Chunks are empty for pages with nothing relevant. Links in skip are
+        left alone, and pages that couldn't be fetched are left out so a later
+        run tries them again. Links are fetched prefetch_window at a time, so
+        the first result doesn't wait for every page in the feed. 0 fetches
+        them all up front.
+        """
+        if prefetch_window is None:
+            prefetch_window = self.prefetch_window
+        # Remove URL arguments
+        candidates = [(title, link, link.split('?')[0]) for title, link in self.candidates(data)]
+        candidates = [candidate for candidate in candidates if candidate[2] not in skip]
+        window = prefetch_window or max(1, len(candidates))
+
+        for start in range(0, len(candidates), window):
+            batch = candidates[start:start + window]
+            links = [link for _, link, _ in batch]
+            self.prefetch(links)
+            self.process_pages(links)
+            for title, link, base_url in batch:
+                relevant_chunks = self.get_link_relevant_chunks(link, data['info'])
+                page = self.article_store.peek(link)
+                if relevant_chunks or page is None or page.error is None:
+                    yield title, base_url, relevant_chunks
+
+    def iter_articles(self, data, prefetch_window: Optional[int] = None,
+                      skip: Container[str] = ()) -> Iterator[Article]:
+        """Relevant articles for the stock in data, yielded as each one is ready."""
+        for title, link, relevant_chunks in self.iter_checked(data, prefetch_window, skip):
+            if relevant_chunks:
+                yield Article(title=title, link=link, chunks=relevant_chunks,
+                              chunk_scores=self.chunk_scores(relevant_chunks))
+
+    def fetch_data(self, data) -> List[Article]:
+        articles = []
+        logger.info("Processing %s:", self.describe(data))
+
+        for article in self.iter_articles(data, prefetch_window=0):
+            logger.info("  - %s", article.title)
+            articles.append(article)
+
+        if not articles:
+            logger.info("  No relevant articles found")
+        logger.info("  Total articles found: %d", len(articles))
+        return articles
+
+    def _is_article_page(self, page):
+        """Whether page, HTML or its Extraction, reads as an article."""
         try:
-            soup = BeautifulSoup(page_source, 'html.parser')
-            text = ' '.join([p.get_text() for p in soup.find_all('p')])
+            extraction = page if isinstance(page, Extraction) else self._extract(page)
+            text = ' '.join(extraction.paragraph_texts)
 
-            if len(text.split()) < 50:
+            if extraction.word_count < 50:
                 return False
 
             hypothesis_template = "This text is an article."
             labels = ["article", "non-article"]
 
-            result = self.relevance_pipeline(
-                text,
-                labels,
-                hypothesis_template=hypothesis_template,
-                multi_label=True
-            )
+            with metrics.timer('article_check_seconds', source=self.source):
+                result, = models.classify(
+                    [text],
+                    labels,
+                    hypothesis_template=hypothesis_template,
+                    multi_label=True
+                )
 
             return result['labels'][0] == "article" and result['scores'][0] > 0.7
 
         except Exception as e:
-            print(f"Error determining article status: {str(e)}")
+            logger.warning("Error determining article status: %s", e)
             return False
 
     def _rate_limited_request(self, url):
-        if url in self._url_cache:
-            return self._url_cache[url]
-
-        now = time.time()
-        time_since_last = now - self.last_request_time
-        
-        if time_since_last < self.delay:
-            time.sleep(self.delay - time_since_last)
-        
-        self.driver.get(url)
-        self.last_request_time = time.time()
-        self._solve_captcha()
-        page_source = self.driver.page_source
-        
-        self._url_cache[url] = page_source
-        return page_source
-
-    def _solve_captcha(self):
+        return self.article_store.get_html(url, self._fetch_page)
+
+    def _fetch_page(self, url):
+        """Fetch over plain HTTP, only using the browser for pages that look JS-gated or blocked."""
+        if url not in self.fetcher.blocked_urls:
+            result = self.fetcher.fetch(url)
+            if result.ok:
+                return result.text
+            if not result.blocked:
+                raise RuntimeError(result.error or f"HTTP {result.status}")
+        return self._browser_fetch(url)
+
+    def _browser_fetch(self, url):
+        return self.browser_pool.fetch(url, after_load=self._solve_captcha)
+
+    def prefetch(self, links):
+        """Fetch links not yet in the article store concurrently over plain HTTP.
+
+        Pages that need a browser are then loaded across the browser pool in
+        parallel.
+        """
+        links = self.article_store.missing(links)
+        blocked = []
+        for result in self.fetcher.fetch_many(links):
+            if result.ok:
+                self.article_store.put_html(result.url, result.text)
+            elif result.blocked:
+                blocked.append(result.url)
+
+        for url, html in zip(blocked, self.browser_pool.fetch_many(blocked, after_load=self._solve_captcha)):
+            if html is not None:
+                self.article_store.put_html(url, html)
+
+    def _solve_captcha(self, driver):
+        # Imported here as it pulls in the BLIP-2 and agent stacks
+        from .captcha_generic_agent import CaptchaSolvingAgent
+
         # Choose the appropriate solver based on CAPTCHA type
-        captcha_solver = CaptchaSolvingAgent(self.driver)
+        captcha_solver = CaptchaSolvingAgent(driver)
         captcha_solver.run()
 
+    @property
+    def chunker(self) -> TokenChunker:
+        """Chunker sized for the sentiment and relevance hypotheses, built on first use."""
+        if self._chunker is None:
+            hypotheses = [models.DEFAULT_TEMPLATE.format(label) for label in LABEL_TO_SCORE]
+            hypotheses.append(RELEVANCE_TEMPLATE.format(''))
+            self._chunker = TokenChunker(
+                models.get_tokenizer(), split_sentences, hypotheses,
+                reserve=NAME_RESERVE, overlap=self.chunk_overlap, max_tokens=self.max_tokens
+            )
+        return self._chunker
+
     def chunk_text(self, text):
-        sentences = nltk.sent_tokenize(text)
-        chunks = []
-        current_chunk = []
-        current_length = 0
-        
-        for sentence in sentences:
-            sentence_length = len(sentence.split())
-            
-            if current_length + sentence_length <= self.max_length:
-                current_chunk.append(sentence)
-                current_length += sentence_length
-            else:
-                if current_chunk:
-                    chunks.append(' '.join(current_chunk))
-                current_chunk = [sentence]
-                current_length = sentence_length
-        
-        if current_chunk:
-            chunks.append(' '.join(current_chunk))
-            
+        return self.chunk_texts([text])[0]
+
+    def chunk_texts(self, texts) -> List[List[str]]:
+        """Chunks for each text, measured with one call to the model's tokenizer."""
+        with metrics.timer('chunk_seconds', source=self.source):
+            chunks = self.chunker.chunk_many(texts, self.chunk_stats)
+        metrics.inc('chunks_total', sum(len(text_chunks) for text_chunks in chunks), source=self.source)
         return chunks
 
     def _preprocess_text(self, text: str) -> str:
-        text = ' '.join(text.split())
+        # Paragraphs stay on lines of their own for split_sentences
+        text = '\n'.join(' '.join(line.split()) for line in text.split('\n') if line.strip())
         return text.lower()
 
+    def _extract(self, page_source) -> Extraction:
+        with metrics.timer('extract_seconds', source=self.source):
+            return extract(page_source)
+
+    def _process_text(self, text):
+        return self._process_texts([text])[0]
+
+    def _process_texts(self, texts) -> List[Tuple[str, List[str]]]:
+        return list(zip(texts, self.prepare_many(texts)))
+
+    def _process_page(self, page_source) -> Tuple[Extraction, List[str]]:
+        return self._process_pages([page_source])[0]
+
+    def _process_pages(self, page_sources) -> List[Tuple[Extraction, List[str]]]:
+        """Each page parsed once, then all of them chunked together."""
+        extractions = [self._extract(page_source) for page_source in page_sources]
+        return list(zip(extractions, self.prepare_many([extraction.text for extraction in extractions])))
+
+    def process_pages(self, links):
+        """Extract and chunk every fetched but unprocessed page among links in one batch."""
+        pending, htmls = [], []
+        for link in dict.fromkeys(links):
+            page = self.article_store.peek(link)
+            html = self.article_store.html(link) if page is None or page.chunks is None else None
+            if html is not None:
+                pending.append(link)
+                htmls.append(html)
+        if not pending:
+            return
+        try:
+            processed = self._process_pages(htmls)
+        except Exception as e:
+            # Left for get_page to retry one at a time
+            logger.warning("Error processing pages: %s", e)
+            metrics.inc('errors_total', stage='extract', source=self.source)
+            return
+        for link, (extraction, chunks) in zip(pending, processed):
+            self.article_store.put_page(link, extraction, chunks)
+
     def get_link_relevant_chunks(self, link, info):
+        domain = urlsplit(link).netloc
+        metrics.inc('pages_checked_total', source=self.source, domain=domain)
         try:
-            page_source = self._rate_limited_request(link)
-            article_soup = BeautifulSoup(page_source, 'html.parser')
-            paragraphs = article_soup.find_all('p')
-            article_text = ' '.join([p.get_text() for p in paragraphs])
-            
-            if article_text:
-                return self.extract_relevant_chunks(article_text, info)
+            # Fetched, parsed and chunked once per run, whichever ticker asks first
+            page = self.article_store.get_page(link, self._fetch_page, self._process_page, self._process_text)
+            if page.duplicate_of is not None:
+                page = self._original(page, info)
+
+            if page is not None and page.chunks:
+                return self.relevant_page_chunks(page, info)
                     
         except Exception as e:
-            print(f"Error fetching article from {link}: {str(e)}")
-            
+            logger.warning("Error fetching article from %s: %s", link, e)
+            metrics.inc('errors_total', stage='page', source=self.source, domain=domain)
+
         return []
 
+    def _original(self, page, info) -> Optional[StoredPage]:
+        """The page a copy was syndicated from, whose chunks stand in for its own.
+
+        None when the story was first seen on an earlier day and has been
+        counted already. The copy itself when the two don't both mention the
+        company, or both not, as with results stories written from a template.
+        """
+        original = self.stored_page(page.duplicate_of)
+        if original is not None and original.chunks is not None:
+            matcher = self._matcher(info)
+            if matcher.matches(page.text or '') != matcher.matches(original.text or ''):
+                return page
+        index = self.article_store.near_duplicates
+        if index is not None:
+            index.skipped(len(page.chunks or []), source=self.source)
+        if original is None or original.chunks is None:
+            return None
+        # Checking the same chunks as the original gets its results from the inference cache
+        return original
+
+    def stored_page(self, link) -> Optional[StoredPage]:
+        """The page stored for link without fetching it, unless it was evicted and has to be processed again."""
+        page = self.article_store.peek(link)
+        if page is not None and page.evicted:
+            try:
+                page = self.article_store.get_page(link, self._fetch_page, self._process_page, self._process_text)
+            except Exception as e:
+                logger.warning("Error fetching article from %s: %s", link, e)
+                metrics.inc('errors_total', stage='page', source=self.source, domain=urlsplit(link).netloc)
+        return page
+
+    def relevant_page_chunks(self, page: StoredPage, info) -> List[str]:
+        """Relevant chunks of a stored page, looked up in its tags when there is a tagger."""
+        chunks = self.tagged_chunks(page, info)
+        if chunks is not None:
+            return chunks
+        ambiguous = self.ambiguous_chunks(page, info)
+        if ambiguous is not None:
+            return self.select_relevant_chunks(ambiguous, info, prefilter=False)
+        return self.select_relevant_chunks(page.chunks, info)
+
+    def page_tags(self, page: StoredPage) -> Optional[PageTags]:
+        """The companies page mentions, tagged once whichever ticker asks first. None without a tagger."""
+        tagger = get_tagger()
+        if tagger is None or page.chunks is None:
+            return None
+        if page.tags is None:
+            with metrics.timer('tag_seconds', source=self.source):
+                page.tags = tagger.tag_page(page.text, page.chunks)
+        return page.tags
+
+    def tagged_chunks(self, page: StoredPage, info) -> Optional[List[str]]:
+        """The chunks of page that mention the company, None when the model has to decide.
+
+        It does when the page only mentions the company by a symbol that is
+        also a word, or in no chunk on its own, or the tagger doesn't know it.
+        """
+        tags = self.page_tags(page)
+        symbol = info['symbol']
+        if tags is None or symbol not in get_tagger().symbols:
+            return None
+        mentions = tags.mentions.get(symbol)
+        if mentions is not None and mentions.ambiguous:
+            return None
+        chunks = [chunk for chunk, symbols in zip(page.chunks, tags.chunks) if symbol in symbols]
+        if mentions is not None and not chunks:
+            return None
+
+        self.relevance_stats.add(RelevanceStats(chunks=len(page.chunks), lexical_rejects=len(page.chunks) - len(chunks),
+                                                relevant=len(chunks), tagged=len(chunks)))
+        labels = {'ticker': symbol, 'source': self.source}
+        metrics.inc('relevance_chunks_total', len(page.chunks) - len(chunks), outcome='lexical_reject', **labels)
+        metrics.inc('relevance_chunks_total', len(chunks), outcome='tagged', **labels)
+        return chunks
+
+    def ambiguous_chunks(self, page: StoredPage, info) -> Optional[List[str]]:
+        """When page only mentions the company by an ambiguous symbol or name, the chunks with it in
+        them, for the model to check without the lexical prefilter. Otherwise None."""
+        tags = self.page_tags(page)
+        mentions = tags.mentions.get(info['symbol']) if tags is not None else None
+        if mentions is None or not mentions.ambiguous:
+            return None
+        return [chunk for chunk, symbols in zip(page.chunks, tags.mentioned) if info['symbol'] in symbols]
+
+    def _matcher(self, info) -> LexicalMatcher:
+        matcher = self._matchers.get(info['symbol'])
+        if matcher is None:
+            matcher = LexicalMatcher(info, self.aliases.get(info['symbol']))
+            self._matchers[info['symbol']] = matcher
+        return matcher
+
+    def prepare_chunks(self, text) -> List[str]:
+        """Normalise and chunk text, the part of relevance that doesn't depend on the ticker."""
+        return self.prepare_many([text])[0]
+
+    def prepare_many(self, texts) -> List[List[str]]:
+        """prepare_chunks for many texts at once, empty texts giving no chunks."""
+        cleaned = [self._preprocess_text(text) if text else '' for text in texts]
+        return self.chunk_texts(cleaned)
+
+    @property
+    def fused_classifier(self) -> Optional[FusedClassifier]:
+        """The classifier for the fused pass, or None when relevance runs on its own."""
+        if not self.fused_mode or get_scorer() is not None:
+            return None
+        if self._fused is None or (self._fused.mode, self._fused.threshold) != \
+                (self.fused_mode, self.relevance_threshold):
+            self._fused = FusedClassifier(RELEVANCE_TEMPLATE, self.relevance_threshold, self.fused_mode)
+        return self._fused
+
+    def chunk_scores(self, chunks) -> Optional[List[float]]:
+        """Sentiment the fused pass gave chunks, None unless it scored every one of them."""
+        with self._fused_lock:
+            scores = [self._fused_scores.get(chunk) for chunk in chunks]
+            for chunk, score in zip(chunks, scores):
+                if score is not None:
+                    self._fused_scores.move_to_end(chunk)
+        return None if not scores or None in scores else scores
+
+    def _remember_scores(self, scored: Dict[str, float]):
+        with self._fused_lock:
+            for chunk, score in scored.items():
+                self._fused_scores[chunk] = score
+                self._fused_scores.move_to_end(chunk)
+            while len(self._fused_scores) > self.fused_score_entries:
+                self._fused_scores.popitem(last=False)
+
     def extract_relevant_chunks(self, text, info) -> List[str]:
         try:
-            relevant_chunks = []
-            text = self._preprocess_text(text)
-            chunks = self.chunk_text(text)
+            return self.select_relevant_chunks(self.prepare_chunks(text), info)
+        except Exception as e:
+            logger.warning("Error determining relevance: %s", e)
+            metrics.inc('errors_total', stage='relevance', source=self.source)
+            return []
 
-            for chunk in chunks:
-                hypothesis_template = "This text is relevant to {}"
-                labels = [info['symbol'], info['shortName']]
+    def select_relevant_chunks(self, chunks, info, prefilter: Optional[bool] = None) -> List[str]:
+        """Chunks the model finds relevant, of those that pass the lexical prefilter unless prefilter is False."""
+        labels = {'ticker': info['symbol'], 'source': self.source}
+        with metrics.timer('relevance_seconds', **labels):
+            # Caught inside the timer so the error is counted once, per source like the other stages
+            try:
+                relevant_chunks, stats = self._select(chunks, info, prefilter)
+            except Exception as e:
+                logger.warning("Error determining relevance: %s", e)
+                metrics.inc('errors_total', stage='relevance', source=self.source)
+                return []
 
-                result = self.relevance_pipeline(
-                    chunk,
-                    labels,
-                    hypothesis_template=hypothesis_template,
-                    multi_label=True
-                )
+        self.relevance_stats.add(stats)
+        metrics.inc('relevance_chunks_total', stats.lexical_rejects, outcome='lexical_reject', **labels)
+        metrics.inc('relevance_chunks_total', stats.candidates - stats.relevant, outcome='rejected', **labels)
+        metrics.inc('relevance_chunks_total', stats.relevant, outcome='relevant', **labels)
+        return relevant_chunks
 
-                for i, label in enumerate(labels):
-                    if result['scores'][i] > 0.7:
-                        relevant_chunks.append(chunk)
-                        break
+    def _select(self, chunks, info, prefilter: Optional[bool] = None) -> Tuple[List[str], RelevanceStats]:
+        stats = RelevanceStats(chunks=len(chunks))
 
-            return relevant_chunks
+        # Stage 1: drop chunks that never mention the company
+        if self.lexical_prefilter if prefilter is None else prefilter:
+            matcher = self._matcher(info)
+            candidates = [chunk for chunk in chunks if matcher.matches(chunk)]
+        else:
+            candidates = chunks
+        stats.lexical_rejects = len(chunks) - len(candidates)
+        stats.candidates = len(candidates)
 
-        except Exception as e:
-            print(f"Error determining relevance: {str(e)}")
-            return []
\ No newline at end of file
+        # Stage 2: one batched model call for the remaining chunks
+        relevant_chunks = []
+        if candidates and self.fused_classifier is not None:
+            scores = self.fused_classifier.classify(candidates, [info['symbol'], info['shortName']])
+            stats.model_calls = 1
+            relevant_chunks = [chunk for chunk, score in zip(candidates, scores) if score is not None]
+            self._remember_scores({chunk: score for chunk, score in zip(candidates, scores) if score is not None})
+        elif candidates:
+            hypothesis_template = RELEVANCE_TEMPLATE
+            labels = [info['symbol'], info['shortName']]
+
+            results = models.classify(
+                candidates,
+                labels,
+                hypothesis_template=hypothesis_template,
+                multi_label=True,
+                batch_size=len(candidates)
+            )
+            stats.model_calls = 1
+
+            for chunk, result in zip(candidates, results):
+                if max(result['scores']) > self.relevance_threshold:
+                    relevant_chunks.append(chunk)
+
+        stats.relevant = len(relevant_chunks)
+        return relevant_chunks, stats
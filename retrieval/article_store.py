@@ -0,0 +1,230 @@
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from .extraction import Extraction, as_extraction
+from .page_cache import PageCache, get_page_cache
+from .tagger import PageTags
+
+# What processing a page gives: its extraction, or just the text, and the chunks
+Processed = Tuple[Union[Extraction, str], List[str]]
+
+
+@dataclass
+class StoredPage:
+    """A URL seen this run with its extracted text and chunks. The HTML lives in the page cache."""
+    url: str
+    text: Optional[str] = None
+    chunks: Optional[List[str]] = None
+    error: Optional[str] = None
+    # Title, published time and paragraphs as well as the text
+    extraction: Optional[Extraction] = None
+    # The first page seen of the same story, when this one is a copy, see dedup
+    duplicate_of: Optional[str] = None
+    # The companies it mentions, filled in on first lookup when there is a tagger
+    tags: Optional[PageTags] = None
+    # Its text and chunks were dropped to stay under the memory ceiling, see ArticleStore
+    evicted: bool = False
+
+
+@dataclass
+class StoreStats:
+    fetches: int = 0
+    fetch_errors: int = 0
+    parses: int = 0
+    hits: int = 0
+    evictions: int = 0
+
+
+class ArticleStore:
+    """Pages fetched during a run, shared by every retrieval instance.
+
+    Each URL is fetched, parsed and chunked once no matter how many retrievers
+    or tickers ask for it, so per-ticker work is just the relevance pass. A
+    per-URL lock stops two threads doing the same work at the same time.
+
+    Raw HTML is kept in a PageCache, so it is bounded in memory and reused by
+    later runs. With store_text the cache keeps each page's extraction on
+    disk instead, and the HTML only until it has been processed.
+
+    Processed pages are bounded too: once their text and chunks come to more
+    than memory_bytes, by default the page cache's own ceiling, the least
+    recently used are replaced by an evicted StoredPage keeping only the URL
+    and what it is a copy of. get_page processes those again from the cache.
+    """
+
+    def __init__(self, page_cache: Optional[PageCache] = None, store_text: bool = False,
+                 memory_bytes: Optional[int] = None):
+        self.page_cache = page_cache if page_cache is not None else PageCache(path=None)
+        self.store_text = store_text
+        self.memory_bytes = memory_bytes
+        self._pages: Dict[str, StoredPage] = {}
+        # url -> size of each processed page, least recently used first
+        self._processed_sizes: OrderedDict = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self._url_locks: Dict[str, threading.Lock] = {}
+        self.stats = StoreStats()
+        # A dedup.NearDuplicateIndex to find copies of the same story among pages, or None
+        self.near_duplicates = None
+
+    def _url_lock(self, url) -> threading.Lock:
+        with self._lock:
+            return self._url_locks.setdefault(url, threading.Lock())
+
+    def _entry(self, url) -> StoredPage:
+        with self._lock:
+            return self._pages.setdefault(url, StoredPage(url))
+
+    def _cache_html(self, url: str, html: str):
+        self.page_cache.put(url, html, persist=not self.store_text)
+
+    def get_html(self, url: str, fetch: Callable[[str], str]) -> str:
+        """Raw HTML for url, fetched unless cached. Failed fetches are not retried this run."""
+        page = self._entry(url)
+        with self._url_lock(url):
+            html = None
+            if page.error is None:
+                html = self.page_cache.get(url)
+                if html is None:
+                    self.stats.fetches += 1
+                    try:
+                        html = fetch(url)
+                        self._cache_html(url, html)
+                    except Exception as e:
+                        self.stats.fetch_errors += 1
+                        page.error = str(e)
+                else:
+                    self.stats.hits += 1
+        if page.error is not None:
+            raise RuntimeError(page.error)
+        return html
+
+    def html(self, url: str) -> Optional[str]:
+        """Cached HTML for url without fetching anything, None if there isn't any."""
+        return self.page_cache.get(url)
+
+    def put_html(self, url: str, html: str):
+        """Store HTML fetched elsewhere, e.g. by a concurrent prefetch."""
+        self._entry(url)
+        with self._url_lock(url):
+            self.stats.fetches += 1
+            self._cache_html(url, html)
+
+    def put_page(self, url: str, extraction: Union[Extraction, str], chunks: List[str]):
+        """Store an extraction, or text, and chunks made elsewhere, e.g. in a worker process."""
+        page = self._entry(url)
+        with self._url_lock(url):
+            if page.chunks is None:
+                self.stats.parses += 1
+                self._set(page, extraction, chunks)
+                self._processed(url, page.extraction)
+
+    def _set(self, page: StoredPage, extraction: Union[Extraction, str], chunks: List[str]):
+        page.extraction = as_extraction(extraction)
+        page.text, page.chunks = page.extraction.text, chunks
+        page.evicted = False
+        if self.near_duplicates is not None:
+            page.duplicate_of = self.near_duplicates.add(page.url, page.text)
+        self._remember(page)
+
+    @property
+    def memory_size(self) -> int:
+        return self._memory_size
+
+    def _remember(self, page: StoredPage):
+        """Count page against the ceiling, evicting the least recently used pages other than it."""
+        size = sys.getsizeof(page.text) + sum(sys.getsizeof(chunk) for chunk in page.chunks)
+        ceiling = self.memory_bytes if self.memory_bytes is not None else self.page_cache.memory_bytes
+        with self._lock:
+            self._memory_size += size - self._processed_sizes.pop(page.url, 0)
+            self._processed_sizes[page.url] = size
+            while self._memory_size > ceiling and len(self._processed_sizes) > 1:
+                url, evicted = self._processed_sizes.popitem(last=False)
+                self._memory_size -= evicted
+                # Replaced rather than cleared, so threads still using the page keep its chunks
+                self._pages[url] = StoredPage(url, duplicate_of=self._pages[url].duplicate_of, evicted=True)
+                self.stats.evictions += 1
+
+    def _touch(self, url: str):
+        with self._lock:
+            if url in self._processed_sizes:
+                self._processed_sizes.move_to_end(url)
+
+    def _processed(self, url: str, extraction: Extraction):
+        if self.store_text:
+            self.page_cache.put(url, extraction.to_json(), kind='extraction')
+            self.page_cache.discard(url)
+
+    def peek(self, url: str) -> Optional[StoredPage]:
+        """The stored page for url without fetching anything, None if there isn't one. It may be evicted."""
+        return self._pages.get(url)
+
+    def missing(self, urls: List[str]) -> List[str]:
+        """The urls, without duplicates, with nothing fetched, processed or cached for them."""
+        urls = [
+            url for url in dict.fromkeys(urls)
+            if url not in self._pages or (self._pages[url].chunks is None and self._pages[url].error is None)
+        ]
+        cached = self.page_cache.cached(urls)
+        if self.store_text:
+            cached |= self.page_cache.cached(urls, kind='extraction')
+        return [url for url in urls if url not in cached]
+
+    def get_page(self, url: str, fetch: Callable[[str], str], process: Callable[[str], Processed],
+                 process_text: Optional[Callable[[str], Processed]] = None) -> StoredPage:
+        """Page for url with its extraction and chunks, processing it on first use.
+
+        process turns HTML into (extraction or text, chunks). With store_text,
+        process_text chunks the text of an extraction cached by an earlier run
+        without fetching the page again.
+        """
+        page = self._entry(url)
+        if page.chunks is not None:
+            self.stats.hits += 1
+            self._touch(url)
+            return page
+
+        cached = self.page_cache.get(url, kind='extraction') if self.store_text and process_text else None
+        html = self.get_html(url, fetch) if cached is None else None
+        with self._url_lock(url):
+            if page.chunks is None:
+                self.stats.parses += 1
+                if cached is not None:
+                    extraction = Extraction.from_json(cached)
+                    self._set(page, extraction, process_text(extraction.text)[1])
+                else:
+                    self._set(page, *process(html))
+                    self._processed(url, page.extraction)
+        return page
+
+    def __contains__(self, url) -> bool:
+        return url in self._pages
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def clear(self):
+        """Forget everything seen this run. The page cache is left alone."""
+        with self._lock:
+            self._pages.clear()
+            self._url_locks.clear()
+            self._processed_sizes.clear()
+            self._memory_size = 0
+            self.stats = StoreStats()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_article_store() -> ArticleStore:
+    """The store shared by all retrieval instances in this process, over the shared page cache."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ArticleStore(get_page_cache())
+    return _store
@@ -0,0 +1,245 @@
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import metrics
+from .fetcher import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+# Requests the browser never makes: images, media, fonts and the usual ad and
+# tracking hosts. Page text doesn't depend on any of them.
+BLOCKED_URL_PATTERNS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.avif', '*.svg', '*.ico',
+    '*.mp4', '*.webm', '*.m3u8', '*.mp3', '*.ogg',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*doubleclick.net*', '*googlesyndication.com*', '*googletagmanager.com*',
+    '*google-analytics.com*', '*amazon-adsystem.com*', '*facebook.net*',
+    '*scorecardresearch.com*', '*taboola.com*', '*outbrain.com*', '*chartbeat.com*',
+    '*quantserve.com*', '*adnxs.com*', '*criteo.com*', '*hotjar.com*',
+]
+
+
+def make_driver(headless=True, page_timeout=30):
+    """Chrome set up for reading text: eager page loads and no images, media, fonts or trackers."""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from webdriver_manager.chrome import ChromeDriverManager
+
+    options = webdriver.ChromeOptions()
+    options.page_load_strategy = 'eager'
+    if headless:
+        options.add_argument('--headless=new')
+    options.add_argument('--disable-gpu')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--blink-settings=imagesEnabled=false')
+    options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+
+    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+    driver.set_page_load_timeout(page_timeout)
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+    return driver
+
+
+class BrowserWorker:
+    """One driver plus the bookkeeping needed to decide when to recycle it"""
+
+    def __init__(self, factory: Callable):
+        self.factory = factory
+        self.driver = factory()
+        self.pages = 0
+        self.baseline_heap = self.heap_size()
+
+    def heap_size(self) -> int:
+        try:
+            return int(self.driver.execute_script(
+                'return (performance.memory && performance.memory.usedJSHeapSize) || 0'
+            ) or 0)
+        except Exception:
+            return 0
+
+    def restart(self):
+        self.quit()
+        # None until the factory succeeds, so a failed restart leaves no stale driver
+        self.driver = None
+        self.driver = self.factory()
+        self.pages = 0
+        self.baseline_heap = self.heap_size()
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception:
+            pass
+
+
+@dataclass
+class PoolStats:
+    pages: int = 0
+    failures: int = 0
+    restarts: int = 0
+    recycles: int = 0
+    load_seconds: Dict[str, List[float]] = field(default_factory=lambda: defaultdict(list))
+
+    def by_domain(self) -> Dict[str, Dict]:
+        """Page count, mean and worst load time per domain."""
+        return {
+            domain: {
+                'pages': len(times),
+                'mean_seconds': sum(times) / len(times),
+                'max_seconds': max(times),
+            }
+            for domain, times in self.load_seconds.items()
+        }
+
+
+class BrowserPool:
+    """A fixed number of browsers shared by every retriever.
+
+    Drivers are created on demand up to size. A driver is recycled after
+    max_pages pages or once its JS heap has grown by max_heap_growth_mb, and
+    restarted if it crashes, in which case the page is retried once on the
+    fresh driver. A worker whose driver can't be restarted is dropped, making
+    room for a new one on the next fetch. after_load, here or per fetch, is called with the driver
+    after each page, e.g. to deal with a captcha.
+    """
+
+    def __init__(self, size=2, max_pages=50, max_heap_growth_mb=512, requests_per_second=10,
+                 driver_factory: Callable = make_driver, after_load: Optional[Callable] = None):
+        self.size = size
+        self.max_pages = max_pages
+        self.max_heap_growth = max_heap_growth_mb * 2**20
+        self.driver_factory = driver_factory
+        self.after_load = after_load
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self.stats = PoolStats()
+
+        self._idle: queue.Queue = queue.Queue()
+        self._workers: List[BrowserWorker] = []
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> BrowserWorker:
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    if len(self._workers) < self.size:
+                        try:
+                            worker = BrowserWorker(self.driver_factory)
+                        except Exception:
+                            # Let the next waiter have a go at creating one
+                            self._idle.put(None)
+                            raise
+                        self._workers.append(worker)
+                        return worker
+                worker = self._idle.get()
+            # None is put when a worker is dropped, so there is room for a new one
+            if worker is not None:
+                return worker
+
+    def _release(self, worker: BrowserWorker):
+        """Put worker back for the next fetch, recycling it first if it's due. Never raises."""
+        try:
+            if worker.driver is None:
+                # A restart after a crash failed
+                worker.restart()
+            elif worker.pages >= self.max_pages or (
+                    self.max_heap_growth and worker.heap_size() - worker.baseline_heap > self.max_heap_growth):
+                self.stats.recycles += 1
+                worker.restart()
+        except Exception as e:
+            logger.warning("Dropping a browser that failed to restart: %s", e)
+            with self._lock:
+                if worker in self._workers:
+                    self._workers.remove(worker)
+            self._idle.put(None)
+            return
+        self._idle.put(worker)
+
+    def _load(self, worker: BrowserWorker, url: str, after_load: Optional[Callable]) -> str:
+        self.rate_limiter.acquire()
+        start = time.perf_counter()
+        worker.driver.get(url)
+        if after_load is not None:
+            after_load(worker.driver)
+        html = worker.driver.page_source
+        worker.pages += 1
+        self.stats.pages += 1
+        self.stats.load_seconds[urlsplit(url).netloc].append(time.perf_counter() - start)
+        metrics.observe('fetch_seconds', time.perf_counter() - start, domain=urlsplit(url).netloc, method='browser')
+        metrics.inc('pages_fetched_total', domain=urlsplit(url).netloc, method='browser', outcome='ok')
+        return html
+
+    def fetch(self, url: str, after_load: Optional[Callable] = None) -> str:
+        """Load url in an idle browser and return the page source."""
+        after_load = after_load or self.after_load
+        worker = self._acquire()
+        try:
+            try:
+                return self._load(worker, url, after_load)
+            except Exception:
+                # Most likely a crashed or wedged driver, so start afresh and
+                # give the page one more go
+                self.stats.restarts += 1
+                worker.restart()
+                return self._load(worker, url, after_load)
+        except Exception:
+            self.stats.failures += 1
+            metrics.inc('pages_fetched_total', domain=urlsplit(url).netloc, method='browser', outcome='error')
+            raise
+        finally:
+            self._release(worker)
+
+    def fetch_many(self, urls: List[str], after_load: Optional[Callable] = None) -> List[Optional[str]]:
+        """Load urls across all browsers in parallel, None for pages that failed."""
+        def fetch_or_none(url):
+            try:
+                return self.fetch(url, after_load)
+            except Exception as e:
+                logger.warning("Error loading %s in browser: %s", url, e)
+                return None
+
+        if not urls:
+            return []
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(fetch_or_none, urls))
+
+    def close(self):
+        with self._lock:
+            for worker in self._workers:
+                worker.quit()
+            self._workers.clear()
+            self._idle = queue.Queue()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure_browser_pool(**kwargs) -> BrowserPool:
+    """Replace the shared pool, e.g. to change its size for a deployment."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = BrowserPool(**kwargs)
+    return _pool
+
+
+def get_browser_pool() -> BrowserPool:
+    """The pool shared by all retrieval instances. No browser starts until a page needs one."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = BrowserPool()
+    return _pool
@@ -0,0 +1,131 @@
+import threading
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Tuple
+
+
+# Tokens kept free for the company name in the relevance hypothesis, which
+# changes with the ticker while the chunks are shared by all of them
+NAME_RESERVE = 24
+
+
+@dataclass
+class ChunkStats:
+    """How many chunks articles need and how full those chunks are"""
+    articles: int = 0
+    chunks: int = 0
+    tokens: int = 0
+    capacity: int = 0
+
+    @property
+    def chunks_per_article(self) -> float:
+        return self.chunks / self.articles if self.articles else 0.0
+
+    @property
+    def utilization(self) -> float:
+        """Share of the token budget the chunks actually use."""
+        return self.tokens / self.capacity if self.capacity else 0.0
+
+    def add(self, other: 'ChunkStats'):
+        self.articles += other.articles
+        self.chunks += other.chunks
+        self.tokens += other.tokens
+        self.capacity += other.capacity
+
+    def __str__(self):
+        return (f"{self.articles} articles in {self.chunks} chunks "
+                f"({self.chunks_per_article:.1f} per article), {self.utilization:.0%} of the token budget used")
+
+
+class TokenChunker:
+    """Packs sentences into chunks measured in the model's own tokens.
+
+    The budget is the model's input limit less the special tokens of a
+    premise/hypothesis pair, the longest of hypotheses and reserve, so no
+    chunk is ever truncated by the pipeline. Sentences longer than the budget
+    are cut on token boundaries. Consecutive chunks repeat up to overlap
+    tokens of whole sentences. All the sentences of every text passed to
+    chunk_many are measured in one tokenizer call.
+    """
+
+    def __init__(self, tokenizer, split: Callable[[str], List[str]], hypotheses: Sequence[str] = (),
+                 reserve: int = 0, overlap: int = 0, max_tokens: Optional[int] = None):
+        self.tokenizer = tokenizer
+        self.split = split
+        self.overlap = overlap
+        # Fast tokenizers aren't safe to call from several threads at once
+        self._lock = threading.Lock()
+
+        limit = tokenizer.model_max_length
+        if max_tokens is not None:
+            limit = min(limit, max_tokens)
+        hypothesis_tokens = max(
+            (len(ids) for ids in self._encode(list(hypotheses))['input_ids']), default=0
+        ) if hypotheses else 0
+        self.budget = limit - tokenizer.num_special_tokens_to_add(pair=True) - hypothesis_tokens - reserve
+        if self.budget <= 0:
+            raise ValueError(f"No room for text: {limit} token limit, {hypothesis_tokens} taken by the hypothesis")
+
+    def _encode(self, texts: List[str]):
+        with self._lock:
+            return self.tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True)
+
+    def _pieces(self, sentence: str, ids: List[int], offsets: List[Tuple[int, int]]) -> List[Tuple[str, int]]:
+        """The sentence, or budget-sized cuts of it, with their token counts."""
+        if len(ids) <= self.budget:
+            return [(sentence.strip(), len(ids))]
+        pieces = []
+        for start in range(0, len(ids), self.budget):
+            end = min(start + self.budget, len(ids))
+            pieces.append((sentence[offsets[start][0]:offsets[end - 1][1]].strip(), end - start))
+        return pieces
+
+    def _pack(self, pieces: List[Tuple[str, int]], stats: Optional[ChunkStats]) -> List[str]:
+        chunks = []
+        current: List[Tuple[str, int]] = []
+        length = 0
+
+        def emit():
+            chunks.append(' '.join(piece for piece, _ in current))
+            if stats is not None:
+                stats.tokens += length
+
+        for piece, tokens in pieces:
+            if current and length + tokens > self.budget:
+                emit()
+                # Carry the last sentences over, as long as they and the new one still fit
+                kept, kept_length = [], 0
+                for previous, previous_tokens in reversed(current):
+                    if kept_length + previous_tokens > self.overlap or \
+                            kept_length + previous_tokens + tokens > self.budget:
+                        break
+                    kept.insert(0, (previous, previous_tokens))
+                    kept_length += previous_tokens
+                current, length = kept, kept_length
+            current.append((piece, tokens))
+            length += tokens
+        if current:
+            emit()
+        return chunks
+
+    def chunk_many(self, texts: List[str], stats: Optional[ChunkStats] = None) -> List[List[str]]:
+        """Chunks for each of texts, with a single tokenizer call for all of them."""
+        sentences = [self.split(text) if text else [] for text in texts]
+        flat = [sentence for text_sentences in sentences for sentence in text_sentences]
+        # Measured with the space they'll be joined with, as BPE counts it
+        encoded = self._encode([' ' + sentence for sentence in flat]) if flat else None
+
+        results = []
+        position = 0
+        for text_sentences in sentences:
+            pieces = []
+            for sentence in text_sentences:
+                pieces.extend(self._pieces(' ' + sentence, encoded['input_ids'][position],
+                                           encoded['offset_mapping'][position]))
+                position += 1
+            chunks = self._pack([piece for piece in pieces if piece[0]], stats)
+            if stats is not None and chunks:
+                stats.articles += 1
+                stats.chunks += len(chunks)
+                stats.capacity += len(chunks) * self.budget
+            results.append(chunks)
+        return results
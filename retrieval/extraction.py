@@ -0,0 +1,187 @@
+"""The article in a page's HTML, parsed once with lxml.
+
+Scripts, navigation, headers, footers, asides and anything whose class or id
+looks like a cookie banner, share bar, newsletter box or related-links list
+are dropped. The body is the <p> paragraphs of the container holding most of
+the page's paragraph text, preferring an articleBody, <article> or <main>
+that holds at least half as much as the densest container. Paragraphs go
+into the text one per line, with their offsets kept alongside, so chunking
+can keep sentences within a paragraph.
+"""
+import json
+import re
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional, Tuple, Union
+
+import lxml.html
+from lxml import etree
+
+
+_DROPPED_TAGS = ('script', 'style', 'noscript', 'template', 'nav', 'header', 'footer', 'aside', 'form',
+                 'button', 'iframe', 'svg', 'figcaption')
+# Matched at the start of each word of an element's class and id
+_BOILERPLATE = re.compile(
+    r'(?:^|[\s_-])(?:cookie|consent|gdpr|newsletter|subscri|promo|advert|sponsor|share|social|related|'
+    r'recommend|comment|breadcrumb|footer|navbar|menu|sidebar|popup|modal|banner|paywall)', re.I
+)
+_CONTAINERS = '//*[@itemprop="articleBody"] | //article | //main'
+# Paragraphs shorter than this don't count towards a container's density, e.g. bylines
+_MIN_DENSE_PARAGRAPH = 40
+
+_PUBLISHED_META = [
+    ('property', 'article:published_time'), ('property', 'og:published_time'),
+    ('itemprop', 'datePublished'), ('name', 'parsely-pub-date'), ('name', 'pubdate'),
+    ('name', 'publishdate'), ('name', 'date'), ('name', 'DC.date.issued'),
+]
+_TITLE_META = [('property', 'og:title'), ('name', 'twitter:title')]
+_JSON_LD_PUBLISHED = re.compile(r'"datePublished"\s*:\s*"([^"]+)"')
+
+
+@dataclass
+class Extraction:
+    """What a page says: its title, when it was published and the paragraphs of its body"""
+    title: str = ''
+    # As the page gives it, usually ISO 8601
+    published: Optional[str] = None
+    # Paragraphs one per line
+    text: str = ''
+    # (start, end) of each paragraph in text
+    paragraphs: List[Tuple[int, int]] = field(default_factory=list)
+
+    @property
+    def paragraph_texts(self) -> List[str]:
+        return [self.text[start:end] for start, end in self.paragraphs]
+
+    @property
+    def word_count(self) -> int:
+        return len(self.text.split())
+
+    @classmethod
+    def from_paragraphs(cls, paragraphs: List[str], title: str = '', published: Optional[str] = None):
+        offsets, position = [], 0
+        for paragraph in paragraphs:
+            offsets.append((position, position + len(paragraph)))
+            position += len(paragraph) + 1
+        return cls(title, published, '\n'.join(paragraphs), offsets)
+
+    @classmethod
+    def from_text(cls, text: str) -> 'Extraction':
+        """An extraction of plain text, taking each non-blank line as a paragraph."""
+        return cls.from_paragraphs([line.strip() for line in (text or '').splitlines() if line.strip()])
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, value: str) -> 'Extraction':
+        data = json.loads(value)
+        data['paragraphs'] = [tuple(span) for span in data['paragraphs']]
+        return cls(**data)
+
+
+def as_extraction(value: Union[str, Extraction, None]) -> Extraction:
+    """value as an Extraction, treating a string as text already extracted."""
+    return value if isinstance(value, Extraction) else Extraction.from_text(value or '')
+
+
+def _clean(text: str) -> str:
+    return ' '.join(text.split())
+
+
+def _parse(html: str):
+    try:
+        return lxml.html.document_fromstring(html)
+    except ValueError:
+        # lxml refuses str with an XML encoding declaration
+        return lxml.html.document_fromstring(html.encode('utf-8'))
+
+
+def _drop_boilerplate(doc):
+    for element in list(doc.iter(*_DROPPED_TAGS)):
+        element.drop_tree()
+    for element in doc.xpath('//body//*[@class or @id]'):
+        if element.tag in ('article', 'main') or element.xpath('.//article | .//*[@itemprop="articleBody"]'):
+            continue
+        if _BOILERPLATE.search(f"{element.get('class', '')} {element.get('id', '')}"):
+            element.drop_tree()
+
+
+def _paragraphs(root) -> List[str]:
+    return [text for text in (_clean(p.text_content()) for p in root.iter('p')) if text]
+
+
+def _body(doc) -> List[str]:
+    # Readability's rule of thumb: a paragraph counts fully for its parent and half for the grandparent
+    scores = {}
+    for paragraph in doc.iter('p'):
+        length = len(_clean(paragraph.text_content()))
+        if length < _MIN_DENSE_PARAGRAPH:
+            continue
+        parent = paragraph.getparent()
+        if parent is not None:
+            scores[parent] = scores.get(parent, 0) + length
+            grandparent = parent.getparent()
+            if grandparent is not None:
+                scores[grandparent] = scores.get(grandparent, 0) + length / 2
+    if not scores:
+        return _paragraphs(doc)
+
+    densest = max(scores, key=scores.get)
+    densest_length = sum(len(paragraph) for paragraph in _paragraphs(densest))
+    best = None
+    for container in doc.xpath(_CONTAINERS):
+        paragraphs = _paragraphs(container)
+        length = sum(len(paragraph) for paragraph in paragraphs)
+        if length * 2 >= densest_length and (best is None or length > best[0]):
+            best = (length, paragraphs)
+    return best[1] if best else _paragraphs(densest)
+
+
+def _meta(doc, attributes) -> Optional[str]:
+    for attribute, value in attributes:
+        for element in doc.xpath(f'//meta[@{attribute}=$value]', value=value):
+            content = _clean(element.get('content') or '')
+            if content:
+                return content
+    return None
+
+
+def _title(doc) -> str:
+    title = _meta(doc, _TITLE_META)
+    if title:
+        return title
+    # The headline rather than the <title>, which usually carries the site's name too
+    for tag in ('h1', 'title'):
+        for element in doc.iter(tag):
+            title = _clean(element.text_content())
+            if title:
+                return title
+    return ''
+
+
+def _published(doc) -> Optional[str]:
+    published = _meta(doc, _PUBLISHED_META)
+    if published:
+        return published
+    for element in doc.xpath('//time[@datetime]'):
+        return element.get('datetime').strip() or None
+    for script in doc.xpath('//script[@type="application/ld+json"]'):
+        match = _JSON_LD_PUBLISHED.search(script.text or '')
+        if match:
+            return match.group(1)
+    return None
+
+
+def extract(html: str) -> Extraction:
+    """Title, published time and main text of a page, with one parse of its HTML."""
+    if not html or not html.strip():
+        return Extraction()
+    try:
+        doc = _parse(html)
+    except etree.ParserError:
+        # Nothing but whitespace or comments
+        return Extraction()
+    # Read from the head and JSON-LD before those go with the boilerplate
+    title, published = _title(doc), _published(doc)
+    _drop_boilerplate(doc)
+    return Extraction.from_paragraphs(_body(doc), title, published)
@@ -0,0 +1,229 @@
+import asyncio
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+import metrics
+
+
+DEFAULT_HEADERS = {
+    'User-Agent': ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                   '(KHTML, like Gecko) Chrome/131.0 Safari/537.36'),
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+# Statuses that usually mean a bot wall rather than a missing page
+BLOCKED_STATUSES = {401, 403, 429, 503}
+
+BLOCKED_MARKERS = re.compile(
+    r'captcha|are you a robot|verify you are human|access denied|just a moment\.\.\.|'
+    r'cf-browser-verification|enable javascript|javascript is (?:disabled|required)|'
+    r'please enable js|unusual traffic',
+    re.IGNORECASE
+)
+
+_PARAGRAPH = re.compile(r'<p[\s>]', re.IGNORECASE)
+_SCRIPT = re.compile(r'<script[\s>]', re.IGNORECASE)
+
+
+def looks_blocked(status: int, html: str) -> bool:
+    """Guess whether a response needs a real browser to get the content."""
+    if status in BLOCKED_STATUSES:
+        return True
+    head = html[:20000]
+    if BLOCKED_MARKERS.search(head) and len(_PARAGRAPH.findall(html)) < 5:
+        return True
+    # Client-rendered shells have plenty of script and next to no text
+    return len(_PARAGRAPH.findall(html)) == 0 and len(_SCRIPT.findall(html)) >= 3
+
+
+class TokenBucket:
+    """Allows rate requests per second on average, with bursts of up to burst"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token, returning how long to wait before using it."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+@dataclass
+class FetchResult:
+    url: str
+    final_url: Optional[str] = None
+    status: int = 0
+    text: str = ''
+    elapsed: float = 0.0
+    error: Optional[str] = None
+    blocked: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and 200 <= self.status < 300 and not self.blocked
+
+
+@dataclass
+class FetcherStats:
+    requests: int = 0
+    errors: int = 0
+    blocked: int = 0
+    seconds: float = 0.0
+    by_status: Dict[int, int] = field(default_factory=dict)
+
+
+class AsyncFetcher:
+    """Pooled HTTP fetcher with per-host concurrency caps and rate limits.
+
+    Runs its own event loop on a background thread so synchronous code can use
+    fetch()/fetch_many() while the requests themselves overlap. Redirects and
+    gzip are handled by httpx, brotli too when the brotli package is installed.
+    """
+
+    def __init__(self, requests_per_second: float = 10, burst: int = 2,
+                 per_host_concurrency: int = 4, max_connections: int = 100,
+                 timeout: float = 15.0, max_redirects: int = 5, headers: Optional[Dict] = None):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.per_host_concurrency = per_host_concurrency
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.headers = dict(DEFAULT_HEADERS, **(headers or {}))
+        self.stats = FetcherStats()
+        # URLs that came back blocked, so callers can go straight to a browser
+        self.blocked_urls = set()
+
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='fetcher', daemon=True)
+                self._thread.start()
+        return self._loop
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                follow_redirects=True,
+                max_redirects=self.max_redirects,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+        return self._client
+
+    def _host_limits(self, host):
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.per_host_concurrency)
+            self._buckets[host] = TokenBucket(self.requests_per_second, self.burst)
+        return self._semaphores[host], self._buckets[host]
+
+    async def fetch_async(self, url: str) -> FetchResult:
+        result = FetchResult(url=url)
+        semaphore, bucket = self._host_limits(urlsplit(url).netloc)
+        async with semaphore:
+            await bucket.acquire_async()
+            start = time.perf_counter()
+            try:
+                response = await self._get_client().get(url)
+                result.status = response.status_code
+                result.final_url = str(response.url)
+                result.text = response.text
+                result.blocked = looks_blocked(result.status, result.text)
+            except httpx.HTTPError as e:
+                result.error = f"{type(e).__name__}: {e}"
+            result.elapsed = time.perf_counter() - start
+
+        self.stats.requests += 1
+        self.stats.seconds += result.elapsed
+        host = urlsplit(url).netloc
+        metrics.observe('fetch_seconds', result.elapsed, domain=host, method='http')
+        metrics.inc('pages_fetched_total', domain=host, method='http',
+                    outcome='error' if result.error else 'blocked' if result.blocked else str(result.status))
+        if result.error:
+            self.stats.errors += 1
+        else:
+            self.stats.by_status[result.status] = self.stats.by_status.get(result.status, 0) + 1
+        if result.blocked:
+            self.stats.blocked += 1
+            self.blocked_urls.add(url)
+        return result
+
+    async def fetch_many_async(self, urls: List[str]) -> List[FetchResult]:
+        return await asyncio.gather(*(self.fetch_async(url) for url in urls))
+
+    def fetch(self, url: str) -> FetchResult:
+        """Fetch one URL from synchronous code."""
+        return asyncio.run_coroutine_threadsafe(self.fetch_async(url), self._ensure_loop()).result()
+
+    def fetch_many(self, urls: List[str]) -> List[FetchResult]:
+        """Fetch many URLs concurrently from synchronous code, results in the same order."""
+        if not urls:
+            return []
+        return asyncio.run_coroutine_threadsafe(self.fetch_many_async(urls), self._ensure_loop()).result()
+
+    def close(self):
+        with self._start_lock:
+            if self._loop is None:
+                return
+            if self._client is not None:
+                asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+                self._client = None
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._semaphores.clear()
+            self._buckets.clear()
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher() -> AsyncFetcher:
+    """The fetcher shared by all retrieval instances, so they share its connection pool."""
+    global _fetcher
+    if _fetcher is None:
+        with _fetcher_lock:
+            if _fetcher is None:
+                _fetcher = AsyncFetcher()
+    return _fetcher
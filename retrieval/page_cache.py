@@ -0,0 +1,271 @@
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+
+DEFAULT_PATH = 'page_cache.db'
+DEFAULT_TTL = 24 * 3600
+# Search result pages go stale much faster than articles
+DOMAIN_TTLS = {'google.com': 3600}
+
+
+@dataclass
+class PageCacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    disk_evictions: int = 0
+    bytes_in: int = 0
+    bytes_stored: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+    @property
+    def bytes_saved(self) -> int:
+        """Bytes compression kept off the disk"""
+        return self.bytes_in - self.bytes_stored
+
+    def __str__(self):
+        return (f"{self.hit_ratio:.0%} hit ratio ({self.memory_hits} memory, {self.disk_hits} disk, "
+                f"{self.misses} misses), {self.evictions} evicted from memory, "
+                f"{self.bytes_saved / 2**20:.0f} MB saved by compression")
+
+
+class PageCache:
+    """Fetched pages, bounded in memory and kept compressed on disk between runs.
+
+    The memory tier is an LRU holding at most memory_bytes of strings. Behind
+    it a SQLite table holds zlib-compressed copies for up to disk_bytes,
+    least recently used first out. Entries expire after the TTL for their
+    domain, see ttl(). Values are stored per kind, e.g. raw 'html' or
+    an 'extraction' of it, so callers can choose which one to keep. path None
+    keeps memory only.
+    """
+
+    def __init__(self, path: Optional[str] = DEFAULT_PATH, memory_bytes=256 * 2**20, disk_bytes=4 * 2**30,
+                 default_ttl=DEFAULT_TTL, domain_ttls: Optional[Dict[str, float]] = None,
+                 compress_level=6, evict_every=500):
+        self.path = path
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.default_ttl = default_ttl
+        self.domain_ttls = DOMAIN_TTLS if domain_ttls is None else domain_ttls
+        self.compress_level = compress_level
+        self.evict_every = evict_every
+        self.stats = PageCacheStats()
+
+        # (kind, url) -> (value, expires, size)
+        self._memory: OrderedDict = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes_since_evict = 0
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        """The disk tier, opened on first use so idle processes never touch the file."""
+        if self.path is None:
+            return None
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS pages ('
+                'kind TEXT NOT NULL, url TEXT NOT NULL, value BLOB NOT NULL, size INTEGER NOT NULL, '
+                'expires REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (kind, url))'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed)')
+            self._conn.commit()
+        return self._conn
+
+    def ttl(self, url: str) -> float:
+        """Seconds a page from url stays fresh, from the most specific matching entry in domain_ttls."""
+        host = urlsplit(url).netloc.lower().split(':')[0]
+        parts = host.split('.')
+        for start in range(len(parts)):
+            domain = '.'.join(parts[start:])
+            if domain in self.domain_ttls:
+                return self.domain_ttls[domain]
+        return self.default_ttl
+
+    def _remember(self, key: Tuple[str, str], value: str, expires: float):
+        size = sys.getsizeof(value)
+        self._forget(key)
+        if size > self.memory_bytes:
+            return
+        self._memory[key] = (value, expires, size)
+        self._memory_size += size
+        while self._memory_size > self.memory_bytes:
+            _, (_, _, evicted) = self._memory.popitem(last=False)
+            self._memory_size -= evicted
+            self.stats.evictions += 1
+
+    def _forget(self, key: Tuple[str, str]):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_size -= entry[2]
+
+    def get(self, url: str, kind: str = 'html') -> Optional[str]:
+        """The cached value, or None if there isn't a fresh one."""
+        key = (kind, url)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self.stats.memory_hits += 1
+                    return entry[0]
+                self._forget(key)
+
+            db = self._db()
+            row = None
+            if db is not None:
+                row = db.execute(
+                    'SELECT value, expires FROM pages WHERE kind = ? AND url = ? AND expires > ?', (kind, url, now)
+                ).fetchone()
+            if row is None:
+                self.stats.misses += 1
+                return None
+
+            db.execute('UPDATE pages SET accessed = ? WHERE kind = ? AND url = ?', (now, kind, url))
+            db.commit()
+            value = zlib.decompress(row[0]).decode('utf-8')
+            self.stats.disk_hits += 1
+            self._remember(key, value, row[1])
+            return value
+
+    def cached(self, urls: Iterable[str], kind: str = 'html') -> Set[str]:
+        """Which of urls have a fresh value, checking the disk in bulk."""
+        urls = list(dict.fromkeys(urls))
+        now = time.time()
+        with self._lock:
+            found = {url for url in urls if (kind, url) in self._memory and self._memory[(kind, url)][1] > now}
+            db = self._db()
+            wanted = [url for url in urls if url not in found]
+            if db is not None:
+                # Stay under SQLite's bound parameter limit
+                for start in range(0, len(wanted), 500):
+                    part = wanted[start:start + 500]
+                    found.update(url for url, in db.execute(
+                        f'SELECT url FROM pages WHERE kind = ? AND expires > ? AND url IN ({",".join("?" * len(part))})',
+                        [kind, now, *part]
+                    ))
+        return found
+
+    def put(self, url: str, value: str, kind: str = 'html', persist: bool = True):
+        """Cache value for url. Without persist it only lives in the memory tier."""
+        expires = time.time() + self.ttl(url)
+        raw = compressed = None
+        if persist and self.path is not None:
+            # Compress before taking the lock, it's the slow part
+            raw = value.encode('utf-8')
+            compressed = zlib.compress(raw, self.compress_level)
+        with self._lock:
+            self._remember((kind, url), value, expires)
+            db = self._db() if compressed is not None else None
+            if db is None:
+                return
+            self.stats.bytes_in += len(raw)
+            self.stats.bytes_stored += len(compressed)
+            db.execute(
+                'INSERT OR REPLACE INTO pages (kind, url, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?, ?)',
+                (kind, url, compressed, len(compressed), expires, time.time())
+            )
+            db.commit()
+            self._writes_since_evict += 1
+            should_evict = self._writes_since_evict >= self.evict_every
+
+        if should_evict:
+            self.evict()
+
+    def discard(self, url: str, kind: str = 'html'):
+        with self._lock:
+            self._forget((kind, url))
+            db = self._db()
+            if db is not None:
+                db.execute('DELETE FROM pages WHERE kind = ? AND url = ?', (kind, url))
+                db.commit()
+
+    def evict(self):
+        """Drop expired pages from disk, then the least recently used beyond disk_bytes."""
+        with self._lock:
+            self._writes_since_evict = 0
+            db = self._db()
+            if db is None:
+                return
+            db.execute('DELETE FROM pages WHERE expires <= ?', (time.time(),))
+            if self.disk_bytes:
+                total, = db.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()
+                excess = total - self.disk_bytes
+                if excess > 0:
+                    doomed = []
+                    for kind, url, size in db.execute('SELECT kind, url, size FROM pages ORDER BY accessed'):
+                        doomed.append((kind, url))
+                        excess -= size
+                        if excess <= 0:
+                            break
+                    db.executemany('DELETE FROM pages WHERE kind = ? AND url = ?', doomed)
+                    self.stats.disk_evictions += len(doomed)
+            db.commit()
+
+    @property
+    def memory_size(self) -> int:
+        return self._memory_size
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            db = self._db()
+            if db is not None:
+                db.execute('DELETE FROM pages')
+                db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def configure_page_cache(store_text: bool = False, **kwargs) -> PageCache:
+    """Replace the shared cache, e.g. to set the memory ceiling for a deployment.
+
+    With store_text the article store keeps extracted text on disk rather
+    than raw HTML.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+        _cache = PageCache(**kwargs)
+    from .article_store import get_article_store
+
+    store = get_article_store()
+    store.page_cache = _cache
+    store.store_text = store_text
+    return _cache
+
+
+def get_page_cache() -> PageCache:
+    """The cache shared by the article store, created on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PageCache()
+    return _cache
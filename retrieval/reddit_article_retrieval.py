@@ -1,27 +1,88 @@
-import praw
 import os
-from .article_retrieval import ArticleRetrieval
-
-class RedditArticleRetrieval(ArticleRetrieval):
-    def __init__(self):
-        super().__init__()
-        # Get credentials from environment variables
-        client_id = os.getenv('REDDIT_CLIENT_ID')
-        client_secret = os.getenv('REDDIT_CLIENT_SECRET')
-        user_agent = os.getenv('REDDIT_USER_AGENT')
-
-        # Validate credentials
-        if not all([client_id, client_secret, user_agent]):
-            raise ValueError("Missing Reddit API credentials. Please set the REDDIT_CLIENT_ID, "
-                           "REDDIT_CLIENT_SECRET, and REDDIT_USER_AGENT environment variables.")
-
-        # Initialize Reddit API
-        self.reddit = praw.Reddit(
-            client_id=client_id,
-            client_secret=client_secret,
-            user_agent=user_agent
-        )
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from storage import DEFAULT_DB_URL
+from .stream_retrieval import Post, StreamRetrieval
+
+DEFAULT_SUBREDDITS = ('stocks', 'investing', 'StockMarket', 'wallstreetbets')
+
+
+class RedditArticleRetrieval(StreamRetrieval):
+    """Self posts from the newest listings of a few subreddits, paged with Reddit's before cursor.
+
+    With REDDIT_CLIENT_ID and REDDIT_CLIENT_SECRET set the OAuth API is used
+    with an app-only token, otherwise the public JSON listings.
+    """
+
+    def __init__(self, subreddits: Sequence[str] = DEFAULT_SUBREDDITS, base_url: Optional[str] = None,
+                 auth_url: str = 'https://www.reddit.com', requests_per_second: float = 1,
+                 db_url: Optional[str] = DEFAULT_DB_URL):
+        self.client_id = os.getenv('REDDIT_CLIENT_ID')
+        self.client_secret = os.getenv('REDDIT_CLIENT_SECRET')
+        self.user_agent = os.getenv('REDDIT_USER_AGENT') or 'sentiment/1.0'
+        if base_url is None:
+            oauth = self.client_id and self.client_secret
+            base_url = 'https://oauth.reddit.com' if oauth else 'https://www.reddit.com'
+        super().__init__(subreddits, base_url, requests_per_second, db_url)
+        self.auth_url = auth_url.rstrip('/')
+        self._token: Optional[Tuple[str, float]] = None
 
-    def fetch_data(self, query, count=100):
-        submissions = self.reddit.subreddit(query).new(limit=count)
-        return [submission.title + ' ' + submission.selftext for submission in submissions if submission.selftext]
+    @property
+    def source(self) -> str:
+        return 'reddit'
+
+    def stream_key(self, stream: str) -> str:
+        return f"{self.base_url}/r/{stream}/new"
+
+    def headers(self) -> Dict[str, str]:
+        headers = {'User-Agent': self.user_agent}
+        if self.client_id and self.client_secret:
+            if self._token is None or self._token[1] < time.time():
+                response = self._client.post(f"{self.auth_url}/api/v1/access_token",
+                                             auth=(self.client_id, self.client_secret),
+                                             data={'grant_type': 'client_credentials'}, headers=headers)
+                response.raise_for_status()
+                body = response.json()
+                # Renewed a minute early rather than failing a request
+                self._token = (body['access_token'], time.time() + body.get('expires_in', 3600) - 60)
+            headers['Authorization'] = f"bearer {self._token[0]}"
+        return headers
+
+    def poll_stream(self, stream: str, cursor: Optional[str]) -> Tuple[List[Post], Optional[str]]:
+        """The subreddit's posts newer than the fullname in cursor, newest first.
+
+        Reddit's before cursor gives the page of posts just newer than it, so
+        paging carries on from the newest post of each page until a short one.
+        """
+        posts, before, newest = [], cursor, None
+        for _ in range(self.max_pages):
+            params = {'limit': self.page_size, 'raw_json': 1}
+            if before:
+                params['before'] = before
+            listing = self.get_json(f"/r/{stream}/new.json", params)['data']['children']
+            page = [child['data'] for child in listing if child.get('kind') == 't3']
+            if not page:
+                break
+            if newest is None or page[0]['created_utc'] > newest['created_utc']:
+                newest = page[0]
+            posts.extend(page)
+            # With no cursor yet, the newest page is enough
+            if cursor is None or len(listing) < self.page_size:
+                break
+            before = page[0]['name']
+        posts = [self._post(data) for data in posts if self._is_self_post(data)]
+        return posts, newest['name'] if newest else cursor
+
+    @staticmethod
+    def _is_self_post(data: Dict) -> bool:
+        return bool(data.get('selftext')) and data['selftext'] not in ('[removed]', '[deleted]')
+
+    @staticmethod
+    def _post(data: Dict) -> Post:
+        return Post(
+            link=f"https://www.reddit.com{data['permalink']}",
+            title=data.get('title', ''),
+            text=f"{data.get('title', '')}\n{data['selftext']}",
+            created=float(data['created_utc'])
+        )
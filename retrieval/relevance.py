@@ -0,0 +1,141 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+
+# Extra names a company is commonly referred to by, keyed by symbol
+DEFAULT_ALIASES: Dict[str, List[str]] = {
+    'GOOGL': ['Google', 'Alphabet'],
+    'GOOG': ['Google', 'Alphabet'],
+    'META': ['Facebook', 'Instagram', 'WhatsApp'],
+    'BRK.B': ['Berkshire Hathaway', 'Berkshire'],
+    'JPM': ['JPMorgan', 'JP Morgan', 'Chase'],
+    'KO': ['Coca-Cola', 'Coke'],
+    'WMT': ['Walmart'],
+    'XOM': ['Exxon', 'ExxonMobil'],
+    'AMZN': ['Amazon', 'AWS'],
+    'MSFT': ['Microsoft'],
+    'TSLA': ['Tesla'],
+}
+
+# Symbols that are also everyday words (or too short to be meaningful on their
+# own), so a bare match means nothing without a cashtag or exchange prefix
+AMBIGUOUS_SYMBOLS = {
+    'A', 'ALL', 'ARE', 'BALL', 'BEN', 'BIG', 'BRO', 'CAT', 'CE', 'COST', 'DAY',
+    'DG', 'EL', 'FAST', 'GL', 'HAS', 'HD', 'HE', 'IT', 'J', 'K', 'KEY', 'L',
+    'LOW', 'MA', 'MAR', 'MO', 'NOW', 'O', 'ON', 'PM', 'PEAK', 'PH', 'RE', 'SO',
+    'T', 'TECH', 'V', 'WELL', 'WAT'
+}
+
+# One-word company names and aliases that are also ordinary words, places or
+# people, so a match is only a company when written capitalised, and even
+# then could be something else
+COMMON_WORD_NAMES = {
+    'adobe', 'alphabet', 'amazon', 'american', 'apple', 'arch', 'ball', 'block', 'booking', 'brown',
+    'cadence', 'cardinal', 'carnival', 'carrier', 'caterpillar', 'charter', 'chase', 'chevron', 'chipotle',
+    'cincinnati', 'citizens', 'coke', 'constellation', 'delta', 'devon', 'diamondback', 'discover', 'dollar',
+    'dominion', 'dover', 'dow', 'duke', 'edison', 'equity', 'everest', 'ford', 'fox', 'franklin', 'freeport',
+    'gap', 'general', 'globe', 'hartford', 'henry', 'hilton', 'host', 'huntington', 'intel', 'johnson',
+    'lilly', 'lincoln', 'marathon', 'marsh', 'match', 'meta', 'micron', 'mohawk', 'monster', 'mosaic',
+    'nasdaq', 'news', 'norwegian', 'oracle', 'paramount', 'pool', 'principal', 'progressive', 'prudential',
+    'public', 'quest', 'regions', 'shell', 'southern', 'stanley', 'synchrony', 'tapestry', 'target',
+    'travelers', 'united', 'vertex', 'visa', 'waters', 'williams', 'workday', 'xylem', 'yum', 'zebra',
+}
+
+# Corporate suffixes dropped to get the name people actually write
+_SUFFIX = re.compile(
+    r'[\s,]+(inc\.?|incorporated|corp\.?|corporation|co\.?|company|ltd\.?|limited|plc|'
+    r'holdings?|group|n\.v\.|s\.a\.|& co\.?|class [a-c])$',
+    re.IGNORECASE
+)
+
+
+def core_name(name: str) -> str:
+    """Strip corporate suffixes, 'NVIDIA Corporation' -> 'NVIDIA'."""
+    name = name.strip()
+    while True:
+        stripped = _SUFFIX.sub('', name).strip(' ,')
+        if stripped == name or not stripped:
+            return name
+        name = stripped
+
+
+class LexicalMatcher:
+    """Cheap check for whether a piece of text could be about a company.
+
+    Names and aliases match case-insensitively on word boundaries. The symbol
+    matches as a cashtag or exchange-prefixed ticker anywhere, and on its own
+    unless it is an everyday word. With case_sensitive_symbols the bare symbol
+    only counts when written in capitals, which needs text that still has its
+    original case.
+    """
+
+    def __init__(self, info: Dict, aliases: Optional[Iterable[str]] = None,
+                 case_sensitive_symbols: bool = False):
+        symbol = info['symbol']
+        names = set()
+        for key in ('shortName', 'longName'):
+            if info.get(key):
+                names.add(info[key])
+                names.add(core_name(info[key]))
+        names.update(DEFAULT_ALIASES.get(symbol, []))
+        names.update(aliases or [])
+        names = sorted((name for name in names if len(name) > 1), key=len, reverse=True)
+
+        escaped = re.escape(symbol)
+        self._tagged = re.compile(
+            rf'(\${escaped}|\b(?:nasdaq|nyse|amex|ticker)\s*:\s*{escaped})(?!\w)',
+            re.IGNORECASE
+        )
+        self._bare = None
+        if symbol.upper() not in AMBIGUOUS_SYMBOLS:
+            flags = 0 if case_sensitive_symbols else re.IGNORECASE
+            self._bare = re.compile(rf'(?<![\w$]){escaped}(?!\w)', flags)
+        self._names = None
+        if names:
+            self._names = re.compile(
+                r'(?<!\w)(' + '|'.join(re.escape(name) for name in names) + r')(?!\w)',
+                re.IGNORECASE
+            )
+
+    def matches(self, text: str) -> bool:
+        return bool(
+            self._tagged.search(text)
+            or (self._bare is not None and self._bare.search(text))
+            or (self._names is not None and self._names.search(text))
+        )
+
+
+@dataclass
+class RelevanceStats:
+    """Counts from the two relevance stages, for tuning the prefilter"""
+    chunks: int = 0
+    lexical_rejects: int = 0
+    candidates: int = 0
+    relevant: int = 0
+    model_calls: int = 0
+    # Of the relevant chunks, those the tagger settled without the model
+    tagged: int = 0
+
+    @property
+    def reject_rate(self) -> float:
+        return self.lexical_rejects / self.chunks if self.chunks else 0.0
+
+    @property
+    def model_calls_saved(self) -> int:
+        """Model calls avoided compared with one call per chunk."""
+        return self.chunks - self.model_calls
+
+    def add(self, other: 'RelevanceStats'):
+        self.chunks += other.chunks
+        self.lexical_rejects += other.lexical_rejects
+        self.candidates += other.candidates
+        self.relevant += other.relevant
+        self.model_calls += other.model_calls
+        self.tagged += other.tagged
+
+    def __str__(self):
+        return (f"{self.chunks} chunks, {self.lexical_rejects} rejected lexically "
+                f"({self.reject_rate:.0%}), {self.candidates} sent to the model in "
+                f"{self.model_calls} calls, {self.relevant} relevant ({self.tagged} by tag lookup), "
+                f"{self.model_calls_saved} model calls saved")
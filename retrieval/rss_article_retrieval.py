@@ -1,25 +1,66 @@
 from datetime import datetime
-from typing import List
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 
 import feedparser
 
-from article import Article
-
+import metrics
+import storage
+from storage import DEFAULT_DB_URL
 from .article_retrieval import ArticleRetrieval
 
+logger = logging.getLogger(__name__)
+
+
+def _entry_state(entry) -> Dict:
+    """The parts of a feed entry candidates() uses, in a form that can be stored as JSON"""
+    published = entry.get('published_parsed')
+    return {
+        'title': entry.get('title', ''),
+        'link': entry.get('link'),
+        'published_parsed': list(published[:6]) if published else None,
+    }
+
+
 class RSSArticleRetrieval(ArticleRetrieval):
-    def __init__(self, feed_url, requests_per_second=10):
+    def __init__(self, feed_url, requests_per_second=10, db_url: Optional[str] = DEFAULT_DB_URL):
         super().__init__(requests_per_second)
         self.feed_url = feed_url
+        # Where the feed's ETag/Last-Modified are kept between runs, None to always fetch in full
+        self.db_url = db_url
         self._cached_feed = None
         self._cached_entries = None
+        self._feed_lock = threading.Lock()
 
     def _get_feed_entries(self):
-        """Get feed entries from cache or fetch if not cached"""
-        if self._cached_entries is None:
-            print(f"Fetching RSS feed from {self.feed_url}")
-            self._cached_feed = feedparser.parse(self.feed_url)
-            self._cached_entries = self._cached_feed.entries
+        """Get feed entries from cache or fetch if not cached
+
+        The feed is polled with the validators from the last run, and a 304
+        reuses the entries saved then.
+        """
+        # Candidates are listed from many threads at once in the staged runner, the feed is only polled once
+        with self._feed_lock:
+            if self._cached_entries is None:
+                state = storage.load_feed_state(self.feed_url, self.db_url) if self.db_url else None
+                logger.info("Fetching RSS feed from %s", self.feed_url)
+                with metrics.timer('feed_seconds', source=self.source):
+                    self._cached_feed = feedparser.parse(
+                        self.feed_url,
+                        etag=state['etag'] if state else None,
+                        modified=state['modified'] if state else None
+                    )
+                if state is not None and self._cached_feed.get('status') == 304:
+                    logger.info("  Feed unchanged since the last run")
+                    metrics.inc('feed_polls_total', source=self.source, outcome='not_modified')
+                    self._cached_entries = state['entries']
+                else:
+                    self._cached_entries = [_entry_state(entry) for entry in self._cached_feed.entries]
+                    metrics.inc('feed_polls_total', source=self.source, outcome='fetched')
+                    etag, modified = self._cached_feed.get('etag'), self._cached_feed.get('modified')
+                    if self.db_url and (etag or modified):
+                        storage.save_feed_state(self.feed_url, etag, modified, self._cached_entries, self.db_url)
         return self._cached_entries
 
     def is_published_today(self, published_time):
@@ -34,28 +75,18 @@ class RSSArticleRetrieval(ArticleRetrieval):
         except (TypeError, ValueError):
             return False
 
-    def fetch_data(self, data) -> List[Article]:
-        entries = self._get_feed_entries()
-        articles = []
-        print(f"\nProcessing RSS feed articles for {data['info']['symbol']} from {self.feed_url}:")
-
-        for entry in entries:
+    def candidates(self, data) -> List[Tuple[str, str]]:
+        """Today's feed entries as (title, link)"""
+        return [
+            (entry.get('title', ''), entry['link'])
+            for entry in self._get_feed_entries()
             # Check if entry was published today
-            if not self.is_published_today(entry.get('published_parsed')):
-                continue
-
-            title = entry.get('title', '')
-            link = entry.get('link', '')
-            # Remove URL arguments
-            base_url = link.split('?')[0]
-            
-            if link:
-                relevant_chunks = self.get_link_relevant_chunks(link, data['info'])
-                if relevant_chunks:
-                    print(f"  - {title}")
-                    articles.append(Article(title=title, link=base_url, chunks=relevant_chunks))
-
-        if not articles:
-            print("  No relevant articles found")
-        print(f"  Total articles found: {len(articles)}")
-        return articles
+            if entry.get('link') and self.is_published_today(entry.get('published_parsed'))
+        ]
+
+    @property
+    def source(self) -> str:
+        return f"rss:{urlsplit(self.feed_url).netloc}"
+
+    def describe(self, data) -> str:
+        return f"RSS feed articles for {data['info']['symbol']} from {self.feed_url}"
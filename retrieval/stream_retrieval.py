@@ -0,0 +1,180 @@
+"""Social posts as articles, from streams polled once per interval for every stock.
+
+A stream is a subreddit, a search query or the like. Each poll asks only for
+posts newer than the cursor the last one ended at, kept in the database so
+the next run carries on from there. New posts go into the article store as
+pages of their own, so relevance and sentiment treat them like any other
+article, and are routed to the stocks they mention: by the tagger's index
+when there is one, by each stock's lexical matcher otherwise.
+"""
+import logging
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import date, datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+import metrics
+import storage
+from storage import DEFAULT_DB_URL
+from .article_retrieval import ArticleRetrieval
+from .extraction import Extraction
+from .fetcher import TokenBucket
+from .tagger import get_tagger
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Post:
+    link: str
+    title: str
+    text: str
+    # Unix time
+    created: float
+
+    @property
+    def published_today(self) -> bool:
+        return date.fromtimestamp(self.created) == date.today()
+
+
+class StreamRetrieval(ArticleRetrieval):
+    """Posts from a shared set of streams, fetched once for all stocks rather than searched per stock"""
+
+    # Seconds before the streams are polled again, e.g. when streaming
+    poll_interval = 300
+    # Most pages of results fetched from one stream in one poll
+    max_pages = 10
+    page_size = 100
+
+    def __init__(self, streams: Sequence[str], base_url: str, requests_per_second: float = 1,
+                 db_url: Optional[str] = DEFAULT_DB_URL, timeout: float = 10):
+        super().__init__(requests_per_second)
+        self.streams = list(streams)
+        self.base_url = base_url.rstrip('/')
+        # Where cursors and today's posts are kept between runs, None to start afresh each run
+        self.db_url = db_url
+        self._client = httpx.Client(timeout=timeout)
+        self._bucket = TokenBucket(requests_per_second)
+        self._lock = threading.Lock()
+        self._cursors: Dict[str, Optional[str]] = {}
+        # Today's posts by link, in the order they were fetched, and the links each stream gave
+        self._posts: Dict[str, Post] = {}
+        self._stream_links: Dict[str, List[str]] = {}
+        self._last_poll: Optional[float] = None
+        self._loaded = False
+        # Symbol -> links, from the tagger last used to route posts
+        self._routes: Dict[str, List[str]] = {}
+        self._routed_by = None
+        self._routed = 0
+
+    def stream_key(self, stream: str) -> str:
+        """What a stream's state is saved under."""
+        raise NotImplementedError
+
+    def headers(self) -> Dict[str, str]:
+        return {}
+
+    def poll_stream(self, stream: str, cursor: Optional[str]) -> Tuple[List[Post], Optional[str]]:
+        """Posts newer than cursor, or the newest page of them with no cursor, and the cursor to use next."""
+        raise NotImplementedError
+
+    def get_json(self, path: str, params: Dict) -> Dict:
+        self._bucket.acquire()
+        response = self._client.get(f"{self.base_url}{path}", params=params, headers=self.headers())
+        metrics.inc('api_requests_total', source=self.source, status=response.status_code)
+        response.raise_for_status()
+        return response.json()
+
+    def _load(self):
+        for stream in self.streams:
+            state = storage.load_stream_state(self.stream_key(stream), self.db_url) if self.db_url else None
+            if state is None:
+                continue
+            self._cursors[stream] = state['cursor']
+            for post in (Post(**fields) for fields in state['posts']):
+                if post.published_today:
+                    self._posts.setdefault(post.link, post)
+                    self._stream_links.setdefault(stream, []).append(post.link)
+        self._loaded = True
+
+    def poll(self, force: bool = False) -> List[Post]:
+        """Posts that are new since the last poll, polling at most once per poll_interval unless forced."""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            now = time.monotonic()
+            if not force and self._last_poll is not None and now - self._last_poll < self.poll_interval:
+                return []
+            self._last_poll = now
+
+            new = []
+            for stream in self.streams:
+                try:
+                    with metrics.timer('feed_seconds', source=self.source):
+                        posts, cursor = self.poll_stream(stream, self._cursors.get(stream))
+                except Exception as e:
+                    logger.warning("Error polling %s: %s", self.stream_key(stream), e)
+                    metrics.inc('errors_total', stage='feed', source=self.source)
+                    continue
+                metrics.inc('feed_polls_total', source=self.source, outcome='fetched')
+                posts = [post for post in posts if post.published_today and post.link not in self._posts]
+                metrics.inc('posts_total', len(posts), source=self.source)
+                links = self._stream_links.setdefault(stream, [])
+                for post in posts:
+                    self._posts[post.link] = post
+                    links.append(post.link)
+                new.extend(posts)
+                self._cursors[stream] = cursor or self._cursors.get(stream)
+                if self.db_url:
+                    today = [asdict(self._posts[link]) for link in links if self._posts[link].published_today]
+                    storage.save_stream_state(self.stream_key(stream), self._cursors[stream], today, self.db_url)
+            logger.info("%d new posts from %s", len(new), self.source)
+            return new
+
+    def _store(self, posts: List[Post]):
+        """Put posts the article store doesn't have yet into it, chunked in one batch."""
+        posts = [post for post in posts if self.article_store.peek(post.link) is None]
+        if not posts:
+            return
+        extractions = [
+            Extraction.from_paragraphs([line.strip() for line in post.text.splitlines() if line.strip()],
+                                       title=post.title,
+                                       published=datetime.fromtimestamp(post.created).isoformat())
+            for post in posts
+        ]
+        for post, extraction, chunks in zip(posts, extractions,
+                                            self.prepare_many([extraction.text for extraction in extractions])):
+            self.article_store.put_page(post.link, extraction, chunks)
+
+    def mentioning(self, info) -> List[Post]:
+        """Today's posts that mention the company, by cashtag, symbol or name."""
+        tagger = get_tagger()
+        with self._lock:
+            posts = list(self._posts.values())
+            if tagger is not None and info['symbol'] in tagger.symbols:
+                if self._routed_by is not tagger:
+                    self._routes, self._routed_by, self._routed = {}, tagger, 0
+                for post in posts[self._routed:]:
+                    for symbol in tagger.tag(post.text):
+                        self._routes.setdefault(symbol, []).append(post.link)
+                self._routed = len(posts)
+                return [self._posts[link] for link in self._routes.get(info['symbol'], [])]
+        matcher = self._matcher(info)
+        return [post for post in posts if matcher.matches(post.text)]
+
+    def candidates(self, data) -> List[Tuple[str, str]]:
+        """Today's posts mentioning the stock as (title, link), polling the streams if it is time to"""
+        self.poll()
+        posts = self.mentioning(data['info'])
+        # Posts are their own pages, there is nothing to fetch
+        self._store(posts)
+        return [(post.title, post.link) for post in posts]
+
+    def _fetch_page(self, url):
+        raise ValueError(f"{url} is a post, not a page to fetch")
+
+    def describe(self, data) -> str:
+        return f"{type(self).__name__} posts for {data['info']['symbol']}"
@@ -0,0 +1,230 @@
+"""Which companies of the universe a text mentions, found in one pass over it.
+
+An Aho-Corasick automaton over every company's names, aliases, cashtag,
+exchange-prefixed ticker and bare symbol is built once, then each page and
+its chunks are scanned once for all of them, rather than once per company.
+Matches count on word boundaries. Names, cashtags and exchange prefixes
+match case-insensitively. A bare symbol only counts when written in
+capitals, and a one-word name that is also an ordinary word
+(COMMON_WORD_NAMES) only when capitalised, so "ups and downs" or "price
+target" mention nobody. Bare symbols that are everyday words
+(AMBIGUOUS_SYMBOLS) or two letters long, and those ordinary-word names, are
+then only ambiguous mentions for the model to settle. Single letters never
+count bare.
+
+Chunks have lost their case, so in a chunk a bare symbol or ordinary-word
+name counts when the page's own text had it in capitals.
+
+pyahocorasick is used when installed, otherwise a pure Python automaton.
+"""
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .relevance import AMBIGUOUS_SYMBOLS, COMMON_WORD_NAMES, DEFAULT_ALIASES, core_name
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+EXCHANGES = ('nasdaq', 'nyse', 'amex', 'ticker')
+
+# Kinds of pattern, all but AMBIGUOUS and WORD being enough on their own
+NAME, TAG, SYMBOL, AMBIGUOUS, WORD = 'name', 'tag', 'symbol', 'ambiguous', 'word'
+# Kinds that only count with the right case
+_CASED = {SYMBOL: str.isupper, AMBIGUOUS: str.isupper, WORD: lambda match: match[0].isupper()}
+
+
+class _Automaton:
+    """Aho-Corasick over lowercase patterns, yielding (end index, value) of every match"""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List] = [[]]
+
+    def add(self, pattern: str, value):
+        state = 0
+        for char in pattern:
+            following = self._goto[state].get(char)
+            if following is None:
+                following = len(self._goto)
+                self._goto[state][char] = following
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = following
+        self._out[state].append(value)
+
+    def build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, following in self._goto[state].items():
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[following] = self._goto[fallback].get(char, 0)
+                if self._fail[following] == following:
+                    self._fail[following] = 0
+                # Shorter patterns ending here match too
+                self._out[following] = self._out[following] + self._out[self._fail[following]]
+
+    def iter(self, text: str) -> Iterator[Tuple[int, object]]:
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for value in out[state]:
+                yield index, value
+
+
+class _PyAhoCorasick:
+    def __init__(self):
+        self._automaton = ahocorasick.Automaton()
+        self._values: Dict[str, List] = {}
+
+    def add(self, pattern: str, value):
+        self._values.setdefault(pattern, []).append(value)
+
+    def build(self):
+        for pattern, values in self._values.items():
+            self._automaton.add_word(pattern, values)
+        self._automaton.make_automaton()
+
+    def iter(self, text: str) -> Iterator[Tuple[int, object]]:
+        for end, values in self._automaton.iter(text):
+            for value in values:
+                yield end, value
+
+
+@dataclass
+class Mentions:
+    """Where one company is mentioned in a text"""
+    positions: List[Tuple[int, int]] = field(default_factory=list)
+    kinds: Set[str] = field(default_factory=set)
+
+    @property
+    def count(self) -> int:
+        return len(self.positions)
+
+    @property
+    def ambiguous(self) -> bool:
+        """Whether every mention is one the model has to confirm"""
+        return self.kinds <= {AMBIGUOUS, WORD}
+
+
+@dataclass
+class PageTags:
+    """A page's mentions, the companies each of its chunks mentions unambiguously, and at all"""
+    mentions: Dict[str, Mentions]
+    chunks: List[Set[str]]
+    mentioned: List[Set[str]] = field(default_factory=list)
+
+
+def _boundary(text: str, start: int, end: int, symbol_like: bool) -> bool:
+    before = text[start - 1] if start > 0 else ' '
+    after = text[end] if end < len(text) else ' '
+    if after.isalnum() or after == '_':
+        return False
+    if before.isalnum() or before == '_':
+        return False
+    # $NVDA is a cashtag match, not a bare symbol one
+    return not (symbol_like and before == '$')
+
+
+class TickerTagger:
+    """Companies mentioned in a text, for a whole universe of them at once"""
+
+    def __init__(self, infos: Iterable[Dict], aliases: Optional[Dict[str, List[str]]] = None):
+        self._automaton = _PyAhoCorasick() if ahocorasick is not None else _Automaton()
+        self.symbols: Set[str] = set()
+        patterns: Set[Tuple[str, str, str]] = set()
+        for info in infos:
+            symbol = info['symbol']
+            self.symbols.add(symbol)
+            names = set(DEFAULT_ALIASES.get(symbol, []))
+            names.update((aliases or {}).get(symbol, []))
+            for key in ('shortName', 'longName'):
+                if info.get(key):
+                    names.add(info[key])
+                    names.add(core_name(info[key]))
+            patterns.update((name.lower(), symbol, WORD if name.lower() in COMMON_WORD_NAMES else NAME)
+                            for name in names if len(name) > 1)
+
+            lower = symbol.lower()
+            patterns.add((f"${lower}", symbol, TAG))
+            for exchange in EXCHANGES:
+                patterns.add((f"{exchange}: {lower}", symbol, TAG))
+                patterns.add((f"{exchange}:{lower}", symbol, TAG))
+            if len(symbol) > 2 and symbol.upper() not in AMBIGUOUS_SYMBOLS:
+                patterns.add((lower, symbol, SYMBOL))
+            elif len(symbol) > 1:
+                patterns.add((lower, symbol, AMBIGUOUS))
+
+        for pattern, symbol, kind in sorted(patterns):
+            self._automaton.add(pattern, (symbol, kind, len(pattern)))
+        self._automaton.build()
+        self.patterns = len(patterns)
+
+    def tag(self, text: str, cased: Optional[Dict[str, Mentions]] = None) -> Dict[str, Mentions]:
+        """Mentions of each company in text, by symbol.
+
+        text is taken to have its original case, unless cased gives the
+        mentions found in the text it was lowercased from: then bare symbols
+        and ordinary-word names only count for the companies, and kinds of
+        mention, found there.
+        """
+        found: Dict[str, Mentions] = {}
+        lowered = text.lower()
+        for end, (symbol, kind, length) in self._automaton.iter(lowered):
+            start = end + 1 - length
+            if not _boundary(lowered, start, end + 1, kind in (SYMBOL, AMBIGUOUS)):
+                continue
+            if kind in _CASED:
+                if cased is None:
+                    if not _CASED[kind](text[start:end + 1]):
+                        continue
+                elif symbol not in cased or kind not in cased[symbol].kinds:
+                    continue
+            mentions = found.setdefault(symbol, Mentions())
+            positions = mentions.positions
+            # Keep the longest of overlapping matches, e.g. Berkshire Hathaway over Berkshire
+            if positions and start < positions[-1][1]:
+                if end + 1 - start > positions[-1][1] - positions[-1][0]:
+                    positions[-1] = (start, end + 1)
+            else:
+                positions.append((start, end + 1))
+            mentions.kinds.add(kind)
+        return found
+
+    def tag_page(self, text: str, chunks: List[str]) -> PageTags:
+        """Mentions in a page's original text, and the companies each of its lowercased chunks mentions."""
+        mentions = self.tag(text or '')
+        tagged = [self.tag(chunk, cased=mentions) for chunk in chunks]
+        return PageTags(
+            mentions=mentions,
+            chunks=[{symbol for symbol, found in chunk.items() if not found.ambiguous} for chunk in tagged],
+            mentioned=[set(chunk) for chunk in tagged]
+        )
+
+
+_tagger: Optional[TickerTagger] = None
+_lock = threading.Lock()
+
+
+def configure(infos: Optional[Iterable[Dict]], aliases: Optional[Dict[str, List[str]]] = None) -> Optional[TickerTagger]:
+    """Build the shared tagger for a universe of ticker infos, or drop it with None."""
+    global _tagger
+    with _lock:
+        _tagger = TickerTagger(infos, aliases) if infos is not None else None
+    return _tagger
+
+
+def get_tagger() -> Optional[TickerTagger]:
+    return _tagger
@@ -1,7 +1,6 @@
-from typing import List
+from typing import List, Tuple
 from datetime import datetime
 
-from article import Article
 from .article_retrieval import ArticleRetrieval
 
 class TickerArticleRetrieval(ArticleRetrieval):
@@ -14,27 +13,14 @@ class TickerArticleRetrieval(ArticleRetrieval):
         """Check if the article was published today"""
         return datetime.fromtimestamp(published_time).date() == datetime.now().date()
 
-    def fetch_data(self, data) -> List[Article]:
-        articles = []
-        print(f"\nProcessing Ticker feed articles for {data['info']['symbol']}:")
-
-        for entry in data['news']:
+    def candidates(self, data) -> List[Tuple[str, str]]:
+        """Today's Yahoo news items for the ticker as (title, link)"""
+        return [
+            (entry.get('title', ''), entry['link'])
+            for entry in data['news']
             # Check if entry was published today
-            if not self.is_published_today(entry.get('providerPublishTime')):
-                continue
-
-            title = entry.get('title', '')
-            link = entry.get('link', '')
-            # Remove URL arguments
-            base_url = link.split('?')[0]
-            
-            if link:
-                relevant_chunks = self.get_link_relevant_chunks(link, data['info'])
-                if relevant_chunks:
-                    print(f"  - {title}")
-                    articles.append(Article(title=title, link=base_url, chunks=relevant_chunks))
+            if entry.get('link') and self.is_published_today(entry.get('providerPublishTime'))
+        ]
 
-        if not articles:
-            print("  No relevant articles found")
-        print(f"  Total articles found: {len(articles)}")
-        return articles
+    def describe(self, data) -> str:
+        return f"Ticker feed articles for {data['info']['symbol']}"
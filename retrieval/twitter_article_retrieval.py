@@ -1,29 +1,61 @@
-import tweepy
 import os
-from .article_retrieval import ArticleRetrieval
-
-class TwitterArticleRetrieval(ArticleRetrieval):
-    def __init__(self):
-        super().__init__()
-        # Get credentials from environment variables
-        api_key = os.getenv('TWITTER_API_KEY')
-        api_secret = os.getenv('TWITTER_API_SECRET')
-        access_token = os.getenv('TWITTER_ACCESS_TOKEN')
-        access_token_secret = os.getenv('TWITTER_ACCESS_TOKEN_SECRET')
-
-        # Validate credentials
-        if not all([api_key, api_secret, access_token, access_token_secret]):
-            raise ValueError("Missing Twitter API credentials. Please set the TWITTER_API_KEY, "
-                           "TWITTER_API_SECRET, TWITTER_ACCESS_TOKEN, and "
-                           "TWITTER_ACCESS_TOKEN_SECRET environment variables.")
-
-        # Initialize Twitter API
-        auth = tweepy.OAuthHandler(api_key, api_secret)
-        auth.set_access_token(access_token, access_token_secret)
-        self.api = tweepy.API(auth)
-
-    def fetch_data(self, stock_data, count=100):
-        # Search using both symbol and company name for better results
-        query = f"{stock_data.symbol} OR {stock_data.company_name}"
-        tweets = self.api.search_tweets(q=query, count=count)
-        return [tweet.text for tweet in tweets]
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from storage import DEFAULT_DB_URL
+from .stream_retrieval import Post, StreamRetrieval
+
+# Stock chatter in English, with retweets left out as copies
+DEFAULT_QUERIES = ('has:cashtags lang:en -is:retweet (stock OR shares OR earnings)',)
+
+
+class TwitterArticleRetrieval(StreamRetrieval):
+    """Tweets from the v2 recent search for a few shared queries, paged with since_id and next_token"""
+
+    # Longest title cut from a tweet's text
+    title_length = 100
+
+    def __init__(self, queries: Sequence[str] = DEFAULT_QUERIES, base_url: str = 'https://api.twitter.com',
+                 bearer_token: Optional[str] = None, requests_per_second: float = 1,
+                 db_url: Optional[str] = DEFAULT_DB_URL):
+        self.bearer_token = bearer_token or os.getenv('TWITTER_BEARER_TOKEN')
+        if not self.bearer_token:
+            raise ValueError("Missing Twitter API credentials. Please set the TWITTER_BEARER_TOKEN "
+                             "environment variable.")
+        super().__init__(queries, base_url, requests_per_second, db_url)
+
+    @property
+    def source(self) -> str:
+        return 'twitter'
+
+    def stream_key(self, stream: str) -> str:
+        return f"{self.base_url}/2/tweets/search/recent?query={stream}"
+
+    def headers(self) -> Dict[str, str]:
+        return {'Authorization': f"Bearer {self.bearer_token}"}
+
+    def poll_stream(self, stream: str, cursor: Optional[str]) -> Tuple[List[Post], Optional[str]]:
+        """Tweets matching the query with ids above the since_id in cursor."""
+        params = {'query': stream, 'max_results': self.page_size, 'tweet.fields': 'created_at'}
+        if cursor:
+            params['since_id'] = cursor
+        tweets = []
+        for _ in range(self.max_pages):
+            body = self.get_json('/2/tweets/search/recent', params)
+            tweets.extend(body.get('data', []))
+            next_token = body.get('meta', {}).get('next_token')
+            # With no since_id yet, the newest page is enough
+            if cursor is None or not next_token:
+                break
+            params['next_token'] = next_token
+        newest = max((tweet['id'] for tweet in tweets), key=int, default=cursor)
+        return [self._post(tweet) for tweet in tweets], newest
+
+    def _post(self, tweet: Dict) -> Post:
+        text = tweet['text']
+        title = ' '.join(text.split())
+        if len(title) > self.title_length:
+            title = title[:self.title_length - 1].rsplit(' ', 1)[0] + '…'
+        created = datetime.fromisoformat(tweet['created_at'].replace('Z', '+00:00')).timestamp()
+        return Post(link=f"https://twitter.com/i/web/status/{tweet['id']}", title=title, text=text,
+                    created=created)
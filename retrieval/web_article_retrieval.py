@@ -1,6 +1,7 @@
 # web_sentiment.py
+from typing import List, Tuple
+
 from bs4 import BeautifulSoup
-from article import Article
 from .article_retrieval import ArticleRetrieval
 
 class WebArticleRetrieval(ArticleRetrieval):
@@ -8,30 +9,18 @@ class WebArticleRetrieval(ArticleRetrieval):
         super().__init__(requests_per_second)
         self.domain = domain
 
-    def fetch_data(self, data) -> List[Article]:
-        """Fetch and analyze articles from web search"""
+    def candidates(self, data) -> List[Tuple[str, str]]:
+        """Search result links on the domain as (title, link)"""
         search_url = f"https://www.google.com/search?q=site:{self.domain}+{data['info']['symbol']}+{data['info']['shortName']}"
         response = self._rate_limited_request(search_url)
         soup = BeautifulSoup(response, 'html.parser')
         
-        # Find all search result links
-        articles = []
-        print(f"\nProcessing web articles for {data['info']['symbol']} from {self.domain}:")
-        
-        for link in soup.find_all('a'):
-            href = link.get('href', '')
-            link_text = link.get_text()
-            
-            # Filter for actual article links
-            if href.startswith('http') and self.domain in href:
-                # Remove URL arguments
-                base_url = href.split('?')[0]
-                relevant_chunks = self.get_link_relevant_chunks(href, data['info'])
-                if relevant_chunks:
-                    print(f"  - {link_text}")
-                    articles.append(Article(title=link_text, link=base_url, chunks=relevant_chunks))
-        
-        if not articles:
-            print("  No relevant articles found")
-        print(f"  Total articles found: {len(articles)}")
-        return articles
+        # Filter for actual article links
+        return [
+            (link.get_text(), link['href'])
+            for link in soup.find_all('a')
+            if link.get('href', '').startswith('http') and self.domain in link.get('href', '')
+        ]
+
+    def describe(self, data) -> str:
+        return f"web articles for {data['info']['symbol']} from {self.domain}"
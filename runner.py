@@ -0,0 +1,355 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import repeat
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import article
+import cascade
+import dedup
+import metrics
+import storage
+from ingest import ingest
+from retrieval.article_retrieval import ArticleRetrieval
+from retrieval.article_store import get_article_store
+from retrieval.chunking import ChunkStats
+from retrieval.extraction import Extraction
+from retrieval.relevance import RelevanceStats
+from retrieval import tagger
+from stocks import Stock, get_retrieval_classes, write_sentiment
+from storage import DEFAULT_DB_URL
+
+logger = logging.getLogger(__name__)
+
+
+def _cpus() -> int:
+    return os.cpu_count() or 1
+
+
+@dataclass
+class StageSizes:
+    """Pool size for each stage. 0 runs the stage inline in this process."""
+    ingest: int = 8
+    fetch: int = 16
+    extract: int = field(default_factory=lambda: max(1, _cpus() // 4))
+    relevance: int = field(default_factory=lambda: max(1, _cpus() // 8))
+    sentiment: int = field(default_factory=lambda: max(1, _cpus() // 8))
+    # Threads torch may use in each model worker, by default the cores split
+    # evenly between the relevance and sentiment workers
+    torch_threads: Optional[int] = None
+
+    def model_threads(self) -> int:
+        if self.torch_threads:
+            return self.torch_threads
+        return max(1, _cpus() // max(1, self.relevance + self.sentiment))
+
+
+# Worker process state. Each worker builds these once in its initializer
+# rather than per task.
+_worker_retrieval: Optional[ArticleRetrieval] = None
+_model_worker = False
+
+
+def _init_worker(torch_threads: Optional[int] = None, load_model: bool = False):
+    global _worker_retrieval, _model_worker
+    _worker_retrieval = ArticleRetrieval()
+    if torch_threads:
+        try:
+            import torch
+        except ImportError:
+            # Backends that don't run on torch, e.g. stub, have no threads to set
+            torch = None
+        if torch is not None:
+            torch.set_num_threads(torch_threads)
+    if load_model:
+        import models
+
+        _model_worker = True
+        models.registry.warm_up()
+        # Score the way the parent process was set up to
+        cascade.configure_from_env()
+
+
+def _with_metrics(fn: Callable, *args):
+    """Run a task in a worker, sending back the metrics it recorded along with its result."""
+    result = fn(*args)
+    return result, metrics.drain()
+
+
+def _extract_task(htmls: List[str]) -> Tuple[List[Tuple[Extraction, List[str]]], ChunkStats]:
+    """Extraction and chunks for a slice of pages, chunked with one tokenizer call."""
+    _worker_retrieval.chunk_stats = ChunkStats()
+    return _worker_retrieval._process_pages(htmls), _worker_retrieval.chunk_stats
+
+
+def _relevance_task(info: Dict, settings: Tuple, pages: List[Tuple[str, List[str]]]):
+    """Relevant chunks of each page for one stock, using the settings of the retriever that found them.
+
+    With a fused pass the chunks come back with their sentiment scores too,
+    otherwise the scores are None.
+    """
+    (_worker_retrieval.lexical_prefilter, _worker_retrieval.aliases, _worker_retrieval.relevance_threshold,
+     _worker_retrieval.fused_mode) = settings
+    _worker_retrieval.relevance_stats = RelevanceStats()
+    relevant = {}
+    for link, chunks in pages:
+        chunks = _worker_retrieval.select_relevant_chunks(chunks, info)
+        relevant[link] = (chunks, _worker_retrieval.chunk_scores(chunks))
+    return relevant, _worker_retrieval.relevance_stats
+
+
+def _sentiment_task(texts: List[str], batch_size: int) -> Tuple[List[float], Optional[cascade.CascadeStats]]:
+    """Scores for texts, plus a model worker's cascade stats for just this task."""
+    scorer = article.get_scorer()
+    if _model_worker and isinstance(scorer, cascade.CascadeScorer):
+        scorer.stats = cascade.CascadeStats()
+    scores = article.score_texts(texts, batch_size)
+    return scores, scorer.stats if _model_worker and isinstance(scorer, cascade.CascadeScorer) else None
+
+
+class StagedRunner:
+    """Runs the daily sentiment update as separate stages, each with its own pool.
+
+    ingest (threads) -> plan and fetch pages (threads over the async fetcher
+    and browser pool) -> extract and chunk (processes) -> relevance
+    (processes, one model per worker) -> sentiment (processes, one model per
+    worker) -> one database transaction.
+
+    Articles are assembled in the same order, with the same dedup, as
+    Stock.articles, so the stored results match the serial path. With
+    incremental, links earlier runs today already checked are left out of the
+    plan and their articles come back from the journal, as with
+    Stock(incremental=True).
+    """
+
+    def __init__(self, sizes: Optional[StageSizes] = None, db_url: str = DEFAULT_DB_URL,
+                 batch_size: int = article.SENTIMENT_BATCH_SIZE, refresh_news: bool = False, tag: bool = False,
+                 incremental: bool = False):
+        self.sizes = sizes or StageSizes()
+        self.db_url = db_url
+        self.batch_size = batch_size
+        self.refresh_news = refresh_news
+        # Settle relevance by tag lookup, see retrieval.tagger
+        self.tag = tag
+        # Reuse what earlier runs today already fetched and scored, see storage.load_journal
+        self.incremental = incremental
+        self.timings: Dict[str, float] = {}
+        self.store = get_article_store()
+
+    def _threads(self, size) -> Optional[Executor]:
+        return ThreadPoolExecutor(max_workers=size) if size else None
+
+    def _processes(self, size, load_model=False) -> Optional[Executor]:
+        if not size:
+            if _worker_retrieval is None:
+                _init_worker()
+            return None
+        # spawn rather than fork, so workers don't inherit torch threads or
+        # a half-initialised CUDA context
+        return ProcessPoolExecutor(
+            max_workers=size,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.sizes.model_threads() if load_model else None, load_model)
+        )
+
+    def _map(self, executor: Optional[Executor], fn: Callable, *iterables) -> List:
+        if executor is None:
+            return list(map(fn, *iterables))
+        with executor:
+            if not isinstance(executor, ProcessPoolExecutor):
+                return list(executor.map(fn, *iterables))
+            results = []
+            for result, snapshot in executor.map(_with_metrics, repeat(fn), *iterables):
+                metrics.merge(snapshot)
+                results.append(result)
+            return results
+
+    def _timed(self, stage: str, fn: Callable, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.timings[stage] = time.perf_counter() - start
+        metrics.observe('stage_seconds', self.timings[stage], stage=stage)
+        logger.info("%s: %.1fs", stage, self.timings[stage])
+        return result
+
+    def run(self, symbols: List[str]) -> Dict[str, Stock]:
+        retrievers = get_retrieval_classes()
+
+        ticker_data = self._timed('ingest', self._ingest, symbols)
+        if self.tag:
+            tagger.configure([data['info'] for data in ticker_data.values()])
+        journal = storage.load_journal(list(ticker_data), db_url=self.db_url) if self.incremental else {}
+        plan = self._timed('plan', self._plan, retrievers, ticker_data, journal)
+        links = list(dict.fromkeys(link for entries in plan.values() for _, _, link in entries))
+        self._timed('fetch', self._fetch, retrievers, links)
+        self._timed('extract', self._extract, retrievers, links)
+        relevant = self._timed('relevance', self._relevance, retrievers, ticker_data, plan)
+        stocks = self._assemble(ticker_data, plan, relevant, journal)
+        self._timed('sentiment', self._sentiment, stocks.values())
+        self._timed('write', write_sentiment, stocks.values(), self.db_url)
+        return stocks
+
+    def _ingest(self, symbols):
+        return ingest(symbols, self.db_url, workers=max(1, self.sizes.ingest), refresh_news=self.refresh_news)
+
+    def _plan(self, retrievers, ticker_data, journal=None) -> Dict[str, List[Tuple[int, str, str]]]:
+        """Candidate (retriever index, title, link) for every stock, in retriever order.
+
+        Links in the stock's journal, checked by an earlier run today, are left out.
+        """
+        def plan_stock(data):
+            seen = (journal or {}).get(data['info']['symbol'], {}).get('seen', ())
+            entries = []
+            for index, retrieval in enumerate(retrievers):
+                try:
+                    entries.extend((index, title, link) for title, link in retrieval.candidates(data)
+                                   if link.split('?')[0] not in seen)
+                except Exception as e:
+                    logger.warning("Error listing %s: %s", retrieval.describe(data), e)
+                    metrics.inc('errors_total', stage='plan', source=retrieval.source)
+            return entries
+
+        symbols = list(ticker_data)
+        return dict(zip(symbols, self._map(self._threads(self.sizes.fetch), plan_stock,
+                                            [ticker_data[symbol] for symbol in symbols])))
+
+    def _fetch(self, retrievers, links):
+        def fetch(link):
+            try:
+                self.store.get_html(link, retrievers[0]._fetch_page)
+            except Exception as e:
+                logger.warning("Error fetching article from %s: %s", link, e)
+
+        self._map(self._threads(self.sizes.fetch), fetch, self.store.missing(links))
+
+    def _extract(self, retrievers, links, slice_size=64):
+        pending, htmls = [], []
+        for link in links:
+            page = self.store.peek(link)
+            # Pages cached by an earlier run have html but no entry in the run store yet
+            html = self.store.html(link) if page is None or page.chunks is None else None
+            if html is not None:
+                pending.append(link)
+                htmls.append(html)
+
+        size = max(1, min(slice_size, -(-len(htmls) // max(1, self.sizes.extract))))
+        slices = [htmls[start:start + size] for start in range(0, len(htmls), size)]
+        processed = []
+        for pages, stats in self._map(self._processes(self.sizes.extract), _extract_task, slices):
+            processed.extend(pages)
+            retrievers[0].chunk_stats.add(stats)
+        for link, (extraction, chunks) in zip(pending, processed):
+            self.store.put_page(link, extraction, chunks)
+
+    def _relevance(self, retrievers, ticker_data, plan) -> Dict[Tuple[str, int, str],
+                                                                 Tuple[List[str], Optional[List[float]]]]:
+        tasks = []
+        relevant = {}
+        # Copies are checked as the page they were syndicated from
+        originals: Dict[str, str] = {}
+        for symbol, entries in plan.items():
+            info = ticker_data[symbol]['info']
+            # Pages for the model by retriever, and whether they go through the lexical prefilter
+            by_retriever: Dict[Tuple[int, bool], Dict[str, List[str]]] = {}
+            for index, _, link in entries:
+                retrieval = retrievers[index]
+                page = retrieval.stored_page(link)
+                if page is not None and page.duplicate_of is not None:
+                    originals[link] = page.duplicate_of
+                    page = retrieval._original(page, info)
+                if page is None or not page.chunks:
+                    continue
+                # With a tagger most pages are settled here, without the model
+                tagged = retrieval.tagged_chunks(page, info)
+                if tagged is not None:
+                    relevant[(symbol, index, page.url)] = (tagged, None)
+                    continue
+                ambiguous = retrieval.ambiguous_chunks(page, info)
+                if ambiguous is not None:
+                    by_retriever.setdefault((index, False), {})[page.url] = ambiguous
+                else:
+                    by_retriever.setdefault((index, True), {})[page.url] = page.chunks
+            for (index, prefilter), pages in by_retriever.items():
+                retrieval = retrievers[index]
+                settings = (retrieval.lexical_prefilter and prefilter, retrieval.aliases,
+                            retrieval.relevance_threshold, retrieval.fused_mode)
+                tasks.append((symbol, index, info, settings, list(pages.items())))
+
+        outputs = self._map(
+            self._processes(self.sizes.relevance, load_model=True),
+            _relevance_task,
+            [task[2] for task in tasks], [task[3] for task in tasks], [task[4] for task in tasks]
+        )
+
+        for (symbol, index, _, _, _), (chunks_by_link, stats) in zip(tasks, outputs):
+            retrievers[index].relevance_stats.add(stats)
+            for link, scored in chunks_by_link.items():
+                relevant[(symbol, index, link)] = scored
+        for symbol, entries in plan.items():
+            for index, _, link in entries:
+                if link in originals and (symbol, index, originals[link]) in relevant:
+                    relevant[(symbol, index, link)] = relevant[(symbol, index, originals[link])]
+        return relevant
+
+    def _assemble(self, ticker_data, plan, relevant, journal=None) -> Dict[str, Stock]:
+        """Build each Stock's articles the way Stock.articles would, or Stock._incremental_articles with a journal."""
+        stocks = {}
+        for symbol, entries in plan.items():
+            articles = []
+            seen_urls = set()
+            checked = []
+            clusters = dedup.ArticleClusters()
+            if self.incremental:
+                articles = [
+                    article.Article(title=a['title'], link=a['link'], chunks=a['chunks'],
+                                    chunk_scores=a['chunk_scores'])
+                    for a in journal[symbol]['articles']
+                ]
+                seen_urls = set(journal[symbol]['seen'])
+                for item in articles:
+                    clusters.add(item)
+            for index, title, link in entries:
+                chunks, scores = relevant.get((symbol, index, link), ([], None))
+                # Remove URL arguments
+                base_url = link.split('?')[0]
+                if self.incremental and not chunks:
+                    # Pages that couldn't be fetched are left for a later run to try again
+                    page = self.store.peek(link)
+                    if base_url not in seen_urls and (page is None or page.error is None):
+                        seen_urls.add(base_url)
+                        checked.append(base_url)
+                    continue
+                if chunks and base_url not in seen_urls:
+                    seen_urls.add(base_url)
+                    item = article.Article(title=title, link=base_url, chunks=chunks, chunk_scores=scores)
+                    if clusters.add(item):
+                        articles.append(item)
+            stocks[symbol] = Stock(symbol=symbol, _ticker_data=ticker_data[symbol],
+                                   _articles=articles, db_url=self.db_url)
+            stocks[symbol]._checked = checked
+        return stocks
+
+    def _sentiment(self, stocks: Iterable[Stock]):
+        articles = [a for stock in stocks for a in stock.articles if a.chunk_scores is None]
+        texts = sorted({chunk for a in articles for chunk in a.chunks}, key=len)
+
+        # Contiguous slices of the length-sorted chunks keep each worker's
+        # batches evenly padded
+        workers = max(1, self.sizes.sentiment)
+        size = -(-len(texts) // workers) if texts else 0
+        slices = [texts[start:start + size] for start in range(0, len(texts), size)] if size else []
+        scores = {}
+        scorer = article.get_scorer()
+        for part, (part_scores, stats) in zip(slices, self._map(self._processes(self.sizes.sentiment, load_model=True),
+                                                                _sentiment_task, slices, [self.batch_size] * len(slices))):
+            scores.update(zip(part, part_scores))
+            # Inline, the stats are already in this process's scorer
+            if stats is not None and isinstance(scorer, cascade.CascadeScorer):
+                scorer.stats.add(stats)
+
+        for a in articles:
+            a.chunk_scores = [scores[chunk] for chunk in a.chunks]
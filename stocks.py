@@ -1,37 +1,48 @@
-import csv
 from dataclasses import dataclass
 from datetime import date
-import json
-import os
-import time
-from typing import Dict, List
-
-import pandas as pd
-import yfinance as yf
-from sqlalchemy import create_engine, Column, String, JSON, Date
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import func
+import logging
+from typing import Dict, Iterable, Iterator, List
 
 import article
+import dedup
+import metrics
+import storage
+from storage import DEFAULT_DB_URL
 from retrieval.rss_article_retrieval import RSSArticleRetrieval
 from retrieval.ticker_article_retrieval import TickerArticleRetrieval
 
-retrieval_classes = [
-    TickerArticleRetrieval(),
-    RSSArticleRetrieval('http://feeds.marketwatch.com/marketwatch/topstories/'),
-    RSSArticleRetrieval('https://www.reutersagency.com/feed/?best-topics=business-finance&post-type=best'),
-    RSSArticleRetrieval('https://www.msn.com/en-us/money/rss'),
+logger = logging.getLogger(__name__)
+
+# Retrievers used by every Stock, as (class, args). They are only built the
+# first time a Stock needs them, see get_retrieval_classes().
+DEFAULT_RETRIEVERS = [
+    (TickerArticleRetrieval, ()),
+    (RSSArticleRetrieval, ('http://feeds.marketwatch.com/marketwatch/topstories/',)),
+    (RSSArticleRetrieval, ('https://www.reutersagency.com/feed/?best-topics=business-finance&post-type=best',)),
+    (RSSArticleRetrieval, ('https://www.msn.com/en-us/money/rss',)),
 ]
 
-Base = declarative_base()
+_retrievers = DEFAULT_RETRIEVERS
+_retrieval_classes = None
+
+
+def configure_retrievers(retrievers):
+    """Choose the retrievers Stocks use, as (class, args) pairs or ready-made instances."""
+    global _retrievers, _retrieval_classes
+    _retrievers = list(retrievers)
+    _retrieval_classes = None
+
 
-class TickerCache(Base):
-    __tablename__ = 'ticker_cache'
+def get_retrieval_classes() -> List:
+    """The shared retriever instances, built on first use."""
+    global _retrieval_classes
+    if _retrieval_classes is None:
+        _retrieval_classes = [
+            retriever if not isinstance(retriever, tuple) else retriever[0](*retriever[1])
+            for retriever in _retrievers
+        ]
+    return _retrieval_classes
 
-    symbol = Column(String, primary_key=True)
-    date = Column(Date, primary_key=True)
-    data = Column(JSON)
 
 
 @dataclass
@@ -39,71 +50,109 @@ class Stock:
     symbol: str
     _articles: List[article.Article] = None
     _ticker_data: Dict = None
-    db_url: str = 'sqlite:///ticker_cache.db'
+    db_url: str = DEFAULT_DB_URL
+    sentiment_batch_size: int = article.SENTIMENT_BATCH_SIZE
+    # Reuse what earlier runs today already fetched and scored, see storage.load_journal
+    incremental: bool = False
 
     def __post_init__(self):
-        self.retrieval_classes = retrieval_classes
-        self._articles = []
-        self._init_db()
-        self._ticker_data = self.load_cached_data() or self.fetch_and_cache_data()
-
-    def _init_db(self):
-        """Initialize SQLAlchemy engine and create tables if they don't exist."""
-        self.engine = create_engine(self.db_url)
-        Base.metadata.create_all(self.engine)
-        self.Session = sessionmaker(bind=self.engine)
+        self.retrieval_classes = get_retrieval_classes()
+        # Links looked at this run that had nothing relevant
+        self._checked: List[str] = []
+        if self._ticker_data is None:
+            self._ticker_data = self.load_cached_data() or self.fetch_and_cache_data()
 
     def load_cached_data(self):
         """Load ticker data from database if it exists and is from today."""
-        with self.Session() as session:
-            result = session.query(TickerCache).filter(
-                TickerCache.symbol == self.symbol,
-                TickerCache.date == date.today()
-            ).first()
-            if result:
-                return result.data
-        return None
+        return storage.load_ticker_data([self.symbol], db_url=self.db_url).get(self.symbol)
 
     def fetch_and_cache_data(self):
         """Fetch ticker data from Yahoo Finance and cache it."""
+        import yfinance as yf
+
         ticker = yf.Ticker(self.symbol)
-        ticker_data = {
-            'info': ticker.info,
-            'news': ticker.news,
-            'date': date.today().isoformat()
-        }
-        
-        with self.Session() as session:
-            cache_entry = TickerCache(
-                symbol=self.symbol,
-                date=date.today(),
-                data=ticker_data
-            )
-            session.merge(cache_entry)
-            session.commit()
-        
+        with metrics.timer('yahoo_seconds', ticker=self.symbol):
+            ticker_data = {
+                'info': ticker.info,
+                'news': ticker.news,
+                'date': date.today().isoformat()
+            }
+        storage.upsert_ticker_data({self.symbol: ticker_data}, db_url=self.db_url)
         return ticker_data
 
     @property
     def articles(self) -> List[article.Article]:
         """Fetch sentiment data and append unique articles"""
-        if self._articles:
+        if self._articles is not None:
+            return self._articles
+        if self.incremental:
+            self._articles = self._incremental_articles()
             return self._articles
 
-        seen_urls = {article.link for article in self._articles}
+        self._articles = []
+        seen_urls = set()
+        # Copies of a story already found are attached to it rather than counted again
+        clusters = dedup.ArticleClusters()
 
         for retrieval in self.retrieval_classes:
             new_articles = retrieval.fetch_data(self._ticker_data)
             for article in new_articles:
                 if article.link not in seen_urls:
-                    self._articles.append(article)
                     seen_urls.add(article.link)
+                    if clusters.add(article):
+                        self._articles.append(article)
         
         return self._articles
 
+    def _incremental_articles(self) -> List[article.Article]:
+        """Today's journalled articles with their scores, plus whatever the retrievers have that's new."""
+        journal = storage.load_journal([self.symbol], db_url=self.db_url)[self.symbol]
+        articles = [
+            article.Article(title=a['title'], link=a['link'], chunks=a['chunks'], chunk_scores=a['chunk_scores'])
+            for a in journal['articles']
+        ]
+        seen_urls = set(journal['seen'])
+        clusters = dedup.ArticleClusters()
+        for a in articles:
+            clusters.add(a)
+        new = 0
+
+        for retrieval in self.retrieval_classes:
+            for title, link, chunks in retrieval.iter_checked(self._ticker_data, prefetch_window=0, skip=seen_urls):
+                if link in seen_urls:
+                    continue
+                seen_urls.add(link)
+                if chunks:
+                    item = article.Article(title=title, link=link, chunks=chunks,
+                                           chunk_scores=retrieval.chunk_scores(chunks))
+                    if clusters.add(item):
+                        articles.append(item)
+                        new += 1
+                else:
+                    self._checked.append(link)
+
+        logger.info("%s: %d articles from earlier runs today, %d new", self.symbol, len(journal['articles']), new)
+        return articles
+
+    def iter_articles(self, maxsize: int = 32) -> Iterator[article.Article]:
+        """Unique articles as the retrievers produce them, all retrievers at once.
+
+        Once every article has been yielded they are kept, so articles doesn't
+        fetch them again.
+        """
+        if self._articles is not None:
+            yield from self._articles
+            return
+
+        from streaming import stream_articles
+
+        for _, item in stream_articles([self], maxsize=maxsize, workers=len(self.retrieval_classes)):
+            yield item
+
     @property
     def total_sentiment(self) -> float:
-        return sum(article.sentiment_score for article in self.articles)
+        article.score_articles(self.articles, self.sentiment_batch_size)
+        return sum(a.sentiment_score for a in self.articles)
 
     @property
     def average_sentiment(self) -> float:
@@ -115,23 +164,22 @@ class Stock:
     def sentiment_count(self) -> int:
         return len(self.articles)
 
+    def sentiment_result(self) -> Dict:
+        """Sentiment and the articles behind it, in the form storage.save_sentiment takes."""
+        return {
+            'count': self.sentiment_count,
+            'average': self.average_sentiment,
+            'articles': [
+                {'link': a.link, 'title': a.title, 'chunks': a.chunks, 'chunk_scores': a.chunk_scores,
+                 'duplicates': a.duplicates}
+                for a in self.articles
+            ],
+            'checked': list(self._checked)
+        }
+
     def update_sentiment_data(self):
-        """Update ticker data with sentiment analysis in the database."""
-        ticker_data = self.load_cached_data()
-        if ticker_data:
-            ticker_data['sentiment'] = {
-                'count': self.sentiment_count,
-                'average': self.average_sentiment
-            }
-            with self.Session() as session:
-                cache_entry = session.query(TickerCache).filter(
-                    TickerCache.symbol == self.symbol,
-                    TickerCache.date == date.today()
-                ).first()
-                if cache_entry:
-                    cache_entry.data = ticker_data
-                    session.commit()
-                    self._ticker_data = ticker_data
+        """Write today's sentiment for this stock to the database."""
+        write_sentiment([self], self.db_url)
 
     @property
     def info(self):
@@ -142,14 +190,49 @@ class Stock:
         return self._ticker_data['news']
 
 
-def get_sp500_stocks() -> Dict[str, Stock]:
+def score_stocks(stocks: Iterable[Stock], batch_size: int = article.SENTIMENT_BATCH_SIZE):
+    """Score the articles of many stocks together so batches are shared across stocks."""
+    article.score_articles(
+        [a for stock in stocks for a in stock.articles],
+        batch_size
+    )
+
+
+def write_sentiment(stocks: Iterable[Stock], db_url: str = DEFAULT_DB_URL):
+    """Write today's sentiment for all stocks in one transaction."""
+    stocks = list(stocks)
+    results = {stock.symbol: stock.sentiment_result() for stock in stocks}
+    storage.save_sentiment(results, db_url=db_url)
+    dedup.save(db_url)
+    for stock in stocks:
+        stock._ticker_data['sentiment'] = {
+            'count': results[stock.symbol]['count'],
+            'average': results[stock.symbol]['average']
+        }
+
+
+def get_sp500_symbols() -> List[str]:
+    import pandas as pd
+
     url = 'https://en.wikipedia.org/wiki/List_of_S%26P_500_companies'
     sp500_table = pd.read_html(url)
     sp500_df = sp500_table[0]
+    return list(sp500_df['Symbol'])
+
+
+def get_sp500_stocks(workers: int = 8, refresh_news: bool = False,
+                     db_url: str = DEFAULT_DB_URL, incremental: bool = False) -> Dict[str, Stock]:
+    """Build a Stock for every S&P 500 symbol.
+
+    Symbols already cached today come from one database query, the rest are
+    fetched concurrently. With refresh_news, today's info is reused and only
+    the news is fetched again. incremental Stocks only fetch and score links
+    earlier runs today haven't seen.
+    """
+    from ingest import ingest
 
-    stocks_data = {}
-    for symbol in sp500_df['Symbol']:
-        stocks_data[symbol] = Stock(symbol=symbol)
-        time.sleep(0.5)  # 500ms delay so we don't hit the rate limit
-    
-    return stocks_data
+    ticker_data = ingest(get_sp500_symbols(), db_url, workers=workers, refresh_news=refresh_news)
+    return {
+        symbol: Stock(symbol=symbol, _ticker_data=data, db_url=db_url, incremental=incremental)
+        for symbol, data in ticker_data.items()
+    }
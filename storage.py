@@ -0,0 +1,444 @@
+import threading
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import (Boolean, Column, Date, Float, Index, Integer, JSON, LargeBinary, String, create_engine,
+                        delete, event, func, select)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+import metrics
+
+
+DEFAULT_DB_URL = 'sqlite:///ticker_cache.db'
+
+Base = declarative_base()
+
+
+class TickerCache(Base):
+    """Legacy one-blob-per-day table, only read when migrating old databases"""
+    __tablename__ = 'ticker_cache'
+
+    symbol = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True)
+    data = Column(JSON)
+
+
+class TickerInfo(Base):
+    __tablename__ = 'ticker_info'
+
+    symbol = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True)
+    data = Column(JSON)
+
+
+class NewsItem(Base):
+    __tablename__ = 'news_item'
+
+    symbol = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True)
+    uuid = Column(String, primary_key=True)
+    position = Column(Integer)
+    title = Column(String)
+    link = Column(String)
+    publish_time = Column(Integer)
+    data = Column(JSON)
+
+
+class ArticleRecord(Base):
+    __tablename__ = 'article'
+
+    symbol = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True)
+    link = Column(String, primary_key=True)
+    title = Column(String)
+    chunk_count = Column(Integer)
+    sentiment = Column(Float)
+
+
+class ChunkScore(Base):
+    __tablename__ = 'chunk_score'
+
+    symbol = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True)
+    link = Column(String, primary_key=True)
+    chunk_index = Column(Integer, primary_key=True)
+    text = Column(String)
+    score = Column(Float)
+
+
+class DailySentiment(Base):
+    __tablename__ = 'daily_sentiment'
+
+    symbol = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True)
+    count = Column(Integer)
+    average = Column(Float)
+
+
+class SeenLink(Base):
+    """Every link checked for a symbol on a day, relevant or not, so reruns can skip it"""
+    __tablename__ = 'seen_link'
+
+    symbol = Column(String, primary_key=True)
+    date = Column(Date, primary_key=True)
+    link = Column(String, primary_key=True)
+    relevant = Column(Boolean)
+
+
+class FeedState(Base):
+    """Validators and entries from the last time a feed changed"""
+    __tablename__ = 'feed_state'
+
+    url = Column(String, primary_key=True)
+    etag = Column(String)
+    modified = Column(String)
+    entries = Column(JSON)
+
+
+class StreamState(Base):
+    """Where paging through a social stream got to, with the posts fetched from it today"""
+    __tablename__ = 'stream_state'
+
+    stream = Column(String, primary_key=True)
+    # Since-id or before-cursor of the newest post fetched
+    cursor = Column(String)
+    posts = Column(JSON)
+
+
+class ArticleFingerprint(Base):
+    """MinHash signature of a story's text, so copies syndicated on later days are recognised"""
+    __tablename__ = 'article_fingerprint'
+
+    link = Column(String, primary_key=True)
+    date = Column(Date)
+    signature = Column(LargeBinary)
+
+
+# The primary keys already index (symbol, date, ...), these cover whole-universe
+# queries for a single day
+Index('ix_daily_sentiment_date', DailySentiment.date)
+Index('ix_news_item_date', NewsItem.date)
+Index('ix_article_link', ArticleRecord.link)
+Index('ix_article_fingerprint_date', ArticleFingerprint.date)
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers carry on while a writer commits
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+def get_engine(db_url: str = DEFAULT_DB_URL):
+    """The engine for db_url, shared by the whole process and created with its tables on first use."""
+    engine = _engines.get(db_url)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(db_url)
+            if engine is None:
+                engine = create_engine(db_url)
+                if engine.dialect.name == 'sqlite':
+                    event.listen(engine, 'connect', _sqlite_pragmas)
+                Base.metadata.create_all(engine)
+                _engines[db_url] = engine
+    return engine
+
+
+def get_session(db_url: str = DEFAULT_DB_URL):
+    return sessionmaker(bind=get_engine(db_url))()
+
+
+def _upsert(connection, model, rows: List[Dict], batch_size=200):
+    """Insert rows, replacing the non-key columns of any that already exist."""
+    if not rows:
+        return
+    if connection.dialect.name != 'sqlite':
+        with sessionmaker(bind=connection)() as session:
+            for row in rows:
+                session.merge(model(**row))
+            session.flush()
+        return
+
+    keys = [column.name for column in model.__table__.primary_key.columns]
+    # Split to stay under SQLite's bound parameter limit
+    for start in range(0, len(rows), batch_size):
+        statement = sqlite_insert(model).values(rows[start:start + batch_size])
+        updates = {
+            column.name: statement.excluded[column.name]
+            for column in model.__table__.columns if column.name not in keys
+        }
+        connection.execute(statement.on_conflict_do_update(index_elements=keys, set_=updates))
+
+
+def _delete_day(connection, model, symbols: List[str], day: date, batch_size=500):
+    """Delete the symbols' rows for day from model's table."""
+    for start in range(0, len(symbols), batch_size):
+        connection.execute(delete(model).where(model.symbol.in_(symbols[start:start + batch_size]),
+                                               model.date == day))
+
+
+def _news_rows(symbol, day, news):
+    return [
+        {
+            'symbol': symbol,
+            'date': day,
+            'uuid': item.get('uuid') or item.get('id') or item.get('link') or str(position),
+            'position': position,
+            'title': item.get('title'),
+            'link': item.get('link'),
+            'publish_time': item.get('providerPublishTime'),
+            'data': item,
+        }
+        for position, item in enumerate(news or [])
+    ]
+
+
+def upsert_ticker_data(ticker_data: Dict[str, Dict], day: Optional[date] = None,
+                       db_url: str = DEFAULT_DB_URL):
+    """Write info and news for many symbols in a single transaction."""
+    if not ticker_data:
+        return
+    day = day or date.today()
+    info_rows = []
+    news_rows = []
+    for symbol, data in ticker_data.items():
+        info_rows.append({'symbol': symbol, 'date': day, 'data': data.get('info')})
+        news_rows.extend(_news_rows(symbol, day, data.get('news')))
+
+    with metrics.timer('db_write_seconds', table='ticker_data'), get_engine(db_url).begin() as connection:
+        _upsert(connection, TickerInfo, info_rows)
+        # Replace rather than merge, so news that has dropped off the feed goes too
+        _delete_day(connection, NewsItem, list(ticker_data), day)
+        _upsert(connection, NewsItem, news_rows)
+    metrics.inc('db_rows_written_total', len(info_rows) + len(news_rows), table='ticker_data')
+
+
+def load_ticker_data(symbols: Iterable[str], day: Optional[date] = None,
+                     db_url: str = DEFAULT_DB_URL) -> Dict[str, Dict]:
+    """{'info', 'news', 'date'} for every symbol with info stored for day."""
+    day = day or date.today()
+    symbols = list(symbols)
+    loaded = {}
+    with get_engine(db_url).connect() as connection:
+        for start in range(0, len(symbols), 500):
+            part = symbols[start:start + 500]
+            for symbol, info in connection.execute(
+                    select(TickerInfo.symbol, TickerInfo.data)
+                    .where(TickerInfo.symbol.in_(part), TickerInfo.date == day)):
+                loaded[symbol] = {'info': info, 'news': [], 'date': day.isoformat()}
+            for symbol, item in connection.execute(
+                    select(NewsItem.symbol, NewsItem.data)
+                    .where(NewsItem.symbol.in_(part), NewsItem.date == day)
+                    .order_by(NewsItem.symbol, NewsItem.position)):
+                if symbol in loaded:
+                    loaded[symbol]['news'].append(item)
+    return loaded
+
+
+def save_sentiment(results: Dict[str, Dict], day: Optional[date] = None,
+                   db_url: str = DEFAULT_DB_URL):
+    """Write many symbols' sentiment in one transaction.
+
+    results maps symbol to {'count', 'average', 'articles'}, where articles is
+    a list of {'link', 'title', 'chunks', 'chunk_scores'} and optionally
+    'duplicates', links to copies of the same story. An optional 'checked'
+    list holds links that were looked at but had nothing relevant. All of
+    them end up in the seen-link journal, see load_journal. A symbol's
+    articles and chunk scores replace any written for it earlier that day.
+    """
+    day = day or date.today()
+    daily_rows, article_rows, chunk_rows, seen_rows = [], [], [], []
+    for symbol, result in results.items():
+        daily_rows.append({'symbol': symbol, 'date': day,
+                           'count': result['count'], 'average': result['average']})
+        seen_rows.extend({'symbol': symbol, 'date': day, 'link': link, 'relevant': False}
+                         for link in result.get('checked', []))
+        for article in result.get('articles', []):
+            seen_rows.append({'symbol': symbol, 'date': day, 'link': article['link'], 'relevant': True})
+            seen_rows.extend({'symbol': symbol, 'date': day, 'link': link, 'relevant': True}
+                             for link in article.get('duplicates', []))
+            scores = article.get('chunk_scores') or []
+            article_rows.append({
+                'symbol': symbol, 'date': day, 'link': article['link'], 'title': article.get('title'),
+                'chunk_count': len(article.get('chunks', [])),
+                'sentiment': sum(scores) / len(scores) if scores else None,
+            })
+            for index, (text, score) in enumerate(zip(article.get('chunks', []), scores)):
+                chunk_rows.append({'symbol': symbol, 'date': day, 'link': article['link'],
+                                   'chunk_index': index, 'text': text, 'score': score})
+
+    with metrics.timer('db_write_seconds', table='sentiment'), get_engine(db_url).begin() as connection:
+        _upsert(connection, DailySentiment, daily_rows)
+        # Replace rather than merge, so articles a rerun no longer counts don't linger in the journal
+        for model in (ArticleRecord, ChunkScore):
+            _delete_day(connection, model, list(results), day)
+        _upsert(connection, ArticleRecord, article_rows)
+        _upsert(connection, ChunkScore, chunk_rows)
+        _upsert(connection, SeenLink, seen_rows)
+    metrics.inc('db_rows_written_total', len(daily_rows) + len(article_rows) + len(chunk_rows) + len(seen_rows),
+                table='sentiment')
+
+
+def load_journal(symbols: Iterable[str], day: Optional[date] = None,
+                 db_url: str = DEFAULT_DB_URL) -> Dict[str, Dict]:
+    """What earlier runs today already did, per symbol.
+
+    {'seen': links already checked, 'articles': [{'link', 'title', 'chunks',
+    'chunk_scores'}]} for the relevant ones, in the form save_sentiment takes.
+    """
+    day = day or date.today()
+    symbols = list(symbols)
+    journal = {symbol: {'seen': set(), 'articles': []} for symbol in symbols}
+    with get_engine(db_url).connect() as connection:
+        for start in range(0, len(symbols), 500):
+            part = symbols[start:start + 500]
+            for symbol, link in connection.execute(
+                    select(SeenLink.symbol, SeenLink.link)
+                    .where(SeenLink.symbol.in_(part), SeenLink.date == day)):
+                journal[symbol]['seen'].add(link)
+
+            articles = {}
+            for symbol, link, title in connection.execute(
+                    select(ArticleRecord.symbol, ArticleRecord.link, ArticleRecord.title)
+                    .where(ArticleRecord.symbol.in_(part), ArticleRecord.date == day)):
+                articles[(symbol, link)] = {'link': link, 'title': title, 'chunks': [], 'chunk_scores': []}
+                journal[symbol]['articles'].append(articles[(symbol, link)])
+            for symbol, link, text, score in connection.execute(
+                    select(ChunkScore.symbol, ChunkScore.link, ChunkScore.text, ChunkScore.score)
+                    .where(ChunkScore.symbol.in_(part), ChunkScore.date == day)
+                    .order_by(ChunkScore.symbol, ChunkScore.link, ChunkScore.chunk_index)):
+                if (symbol, link) in articles:
+                    articles[(symbol, link)]['chunks'].append(text)
+                    articles[(symbol, link)]['chunk_scores'].append(score)
+
+    # Articles from before the journal existed count as seen too
+    for entry in journal.values():
+        entry['seen'].update(article['link'] for article in entry['articles'])
+    return journal
+
+
+def load_feed_state(url: str, db_url: str = DEFAULT_DB_URL) -> Optional[Dict]:
+    """{'etag', 'modified', 'entries'} saved for a feed, or None."""
+    with get_engine(db_url).connect() as connection:
+        row = connection.execute(
+            select(FeedState.etag, FeedState.modified, FeedState.entries).where(FeedState.url == url)
+        ).first()
+    if row is None:
+        return None
+    return {'etag': row.etag, 'modified': row.modified, 'entries': row.entries or []}
+
+
+def save_feed_state(url: str, etag: Optional[str], modified: Optional[str], entries: List[Dict],
+                    db_url: str = DEFAULT_DB_URL):
+    with metrics.timer('db_write_seconds', table='feed_state'), get_engine(db_url).begin() as connection:
+        _upsert(connection, FeedState, [{'url': url, 'etag': etag, 'modified': modified, 'entries': entries}])
+
+
+def load_stream_state(stream: str, db_url: str = DEFAULT_DB_URL) -> Optional[Dict]:
+    """{'cursor', 'posts'} saved for a stream, or None."""
+    with get_engine(db_url).connect() as connection:
+        row = connection.execute(
+            select(StreamState.cursor, StreamState.posts).where(StreamState.stream == stream)
+        ).first()
+    if row is None:
+        return None
+    return {'cursor': row.cursor, 'posts': row.posts or []}
+
+
+def save_stream_state(stream: str, cursor: Optional[str], posts: List[Dict], db_url: str = DEFAULT_DB_URL):
+    with metrics.timer('db_write_seconds', table='stream_state'), get_engine(db_url).begin() as connection:
+        _upsert(connection, StreamState, [{'stream': stream, 'cursor': cursor, 'posts': posts}])
+
+
+def load_fingerprints(since: date, db_url: str = DEFAULT_DB_URL) -> List[Dict]:
+    """{'link', 'date', 'signature'} of the stories fingerprinted since a day, oldest first."""
+    with get_engine(db_url).connect() as connection:
+        return [
+            {'link': link, 'date': day, 'signature': signature}
+            for link, day, signature in connection.execute(
+                select(ArticleFingerprint.link, ArticleFingerprint.date, ArticleFingerprint.signature)
+                .where(ArticleFingerprint.date >= since).order_by(ArticleFingerprint.date))
+        ]
+
+
+def save_fingerprints(rows: List[Dict], keep_since: Optional[date] = None, db_url: str = DEFAULT_DB_URL):
+    """Write {'link', 'date', 'signature'} rows, dropping any older than keep_since."""
+    with metrics.timer('db_write_seconds', table='article_fingerprint'), get_engine(db_url).begin() as connection:
+        _upsert(connection, ArticleFingerprint, rows)
+        if keep_since is not None:
+            connection.execute(delete(ArticleFingerprint).where(ArticleFingerprint.date < keep_since))
+    metrics.inc('db_rows_written_total', len(rows), table='article_fingerprint')
+
+
+def sentiment_history(symbol: str, start: Optional[date] = None, end: Optional[date] = None,
+                      db_url: str = DEFAULT_DB_URL) -> List[Dict]:
+    """Daily sentiment for symbol between start and end inclusive, oldest first."""
+    query = select(DailySentiment.date, DailySentiment.count, DailySentiment.average) \
+        .where(DailySentiment.symbol == symbol)
+    if start is not None:
+        query = query.where(DailySentiment.date >= start)
+    if end is not None:
+        query = query.where(DailySentiment.date <= end)
+    with get_engine(db_url).connect() as connection:
+        return [
+            {'date': day, 'count': count, 'average': average}
+            for day, count, average in connection.execute(query.order_by(DailySentiment.date))
+        ]
+
+
+def load_daily_sentiment(start: Optional[date] = None, end: Optional[date] = None,
+                         db_url: str = DEFAULT_DB_URL) -> List[Tuple[str, date, int, Optional[float]]]:
+    """(symbol, date, count, average) for every symbol between start and end inclusive, in one query."""
+    query = select(DailySentiment.symbol, DailySentiment.date, DailySentiment.count, DailySentiment.average)
+    if start is not None:
+        query = query.where(DailySentiment.date >= start)
+    if end is not None:
+        query = query.where(DailySentiment.date <= end)
+    with get_engine(db_url).connect() as connection:
+        return [tuple(row) for row in connection.execute(query)]
+
+
+def load_price_moves(start: Optional[date] = None, end: Optional[date] = None,
+                     db_url: str = DEFAULT_DB_URL) -> List[Tuple[str, date, float]]:
+    """(symbol, date, fractional change on the previous close) from the info cached each day.
+
+    The prices are read out of the JSON in the database rather than loading
+    whole info blobs. Days without both prices are left out.
+    """
+    price = func.coalesce(TickerInfo.data['currentPrice'].as_float(),
+                          TickerInfo.data['regularMarketPrice'].as_float())
+    previous = func.coalesce(TickerInfo.data['previousClose'].as_float(),
+                             TickerInfo.data['regularMarketPreviousClose'].as_float())
+    query = select(TickerInfo.symbol, TickerInfo.date, price, previous)
+    if start is not None:
+        query = query.where(TickerInfo.date >= start)
+    if end is not None:
+        query = query.where(TickerInfo.date <= end)
+    with get_engine(db_url).connect() as connection:
+        return [
+            (symbol, day, current / previous_close - 1)
+            for symbol, day, current, previous_close in connection.execute(query)
+            if current is not None and previous_close
+        ]
+
+
+def migrate_legacy_cache(db_url: str = DEFAULT_DB_URL) -> int:
+    """Copy rows from the old ticker_cache JSON table into the new tables, returns how many."""
+    with get_engine(db_url).connect() as connection:
+        rows = connection.execute(select(TickerCache.symbol, TickerCache.date, TickerCache.data)).all()
+
+    by_day: Dict[date, Dict[str, Dict]] = {}
+    for symbol, day, data in rows:
+        by_day.setdefault(day, {})[symbol] = data or {}
+    for day, ticker_data in by_day.items():
+        upsert_ticker_data(ticker_data, day, db_url)
+        save_sentiment({
+            symbol: data['sentiment'] for symbol, data in ticker_data.items() if data.get('sentiment')
+        }, day, db_url)
+    return len(rows)
@@ -0,0 +1,154 @@
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Tuple
+
+import article
+import dedup
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Marks the end of one producer's stream on the shared queue
+_DONE = object()
+
+
+def _put(out: queue.Queue, item, stop: threading.Event) -> bool:
+    """Block until there's room for item, giving up if the consumer has gone away."""
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _produce(out: queue.Queue, stop: threading.Event, key: Hashable, make: Callable[[], Iterable]):
+    try:
+        for item in make():
+            if not _put(out, (key, item), stop):
+                return
+    except Exception as e:
+        logger.warning("Error streaming %s: %s", key, e)
+        metrics.inc('errors_total', stage='stream')
+    finally:
+        _put(out, (key, _DONE), stop)
+
+
+def merge_streams(streams: List[Tuple[Hashable, Callable[[], Iterable]]], maxsize: int = 32,
+                  workers: int = 8) -> Iterator[Tuple[Hashable, object]]:
+    """(key, item) from every stream, in whatever order they are produced.
+
+    Each stream is a key and a function returning an iterable, run on its own
+    thread, up to workers at a time. Producers share a queue of maxsize items
+    and block when it is full, so they never get more than that ahead of the
+    consumer. A stream that raises is reported and ends, the rest carry on.
+    Stopping early stops the producers at their next item.
+    """
+    if not streams:
+        return
+    out: queue.Queue = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(streams))))
+    try:
+        for key, make in streams:
+            executor.submit(_produce, out, stop, key, make)
+        remaining = len(streams)
+        while remaining:
+            key, item = out.get()
+            if item is _DONE:
+                remaining -= 1
+            else:
+                yield key, item
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _journals(stocks: List) -> Dict[int, Dict]:
+    """Today's journal for each incremental stock, one query per database."""
+    import storage
+
+    journals = {}
+    by_db: Dict[str, List[int]] = {}
+    for index, stock in enumerate(stocks):
+        if stock.incremental:
+            by_db.setdefault(stock.db_url, []).append(index)
+    for db_url, indexes in by_db.items():
+        loaded = storage.load_journal([stocks[index].symbol for index in indexes], db_url=db_url)
+        for index in indexes:
+            journals[index] = loaded[stocks[index].symbol]
+    return journals
+
+
+def stream_articles(stocks: Iterable, maxsize: int = 32, workers: int = 8) -> Iterator[Tuple[object, article.Article]]:
+    """(stock, article) for every stock's retrievers, each link once per stock.
+
+    Every (stock, retriever) pair is its own stream, so a slow feed holds up
+    only its own articles. Incremental stocks start with today's journalled
+    articles, already scored, and skip links earlier runs have seen. Once
+    everything has been streamed each stock's articles are set, in arrival
+    order, so later calls don't fetch again.
+    """
+    stocks = list(stocks)
+    journals = _journals(stocks)
+    seen_urls: Dict[int, set] = {
+        index: set(journals[index]['seen']) if index in journals else set() for index in range(len(stocks))
+    }
+    collected: Dict[int, List[article.Article]] = {index: [] for index in range(len(stocks))}
+    # Copies of a story a stock already has are attached to that article instead
+    clusters = {index: dedup.ArticleClusters() for index in range(len(stocks))}
+    for index, journal in journals.items():
+        for a in journal['articles']:
+            item = article.Article(title=a['title'], link=a['link'], chunks=a['chunks'],
+                                   chunk_scores=a['chunk_scores'])
+            clusters[index].add(item)
+            collected[index].append(item)
+            yield stocks[index], item
+
+    streams = [
+        ((index, retrieval), lambda retrieval=retrieval, stock=stock, skip=frozenset(seen_urls[index]):
+            retrieval.iter_checked(stock._ticker_data, skip=skip))
+        for index, stock in enumerate(stocks)
+        for retrieval in stock.retrieval_classes
+    ]
+    for (index, retrieval), (title, link, chunks) in merge_streams(streams, maxsize, workers):
+        if link in seen_urls[index]:
+            continue
+        seen_urls[index].add(link)
+        if not chunks:
+            stocks[index]._checked.append(link)
+            continue
+        item = article.Article(title=title, link=link, chunks=chunks, chunk_scores=retrieval.chunk_scores(chunks))
+        if not clusters[index].add(item):
+            continue
+        collected[index].append(item)
+        yield stocks[index], item
+
+    for index, stock in enumerate(stocks):
+        stock._articles = collected[index]
+
+
+def stream_scored(stocks: Iterable, batch_size: int = article.SENTIMENT_BATCH_SIZE, maxsize: int = 32,
+                  workers: int = 8) -> Iterator[Tuple[object, article.Article]]:
+    """Like stream_articles, but each article comes out with its chunks scored.
+
+    Articles are scored as soon as a batch's worth of chunks has arrived,
+    rather than after every feed has been read.
+    """
+    pending: List[Tuple[object, article.Article]] = []
+    pending_chunks = 0
+    for stock, item in stream_articles(stocks, maxsize, workers):
+        pending.append((stock, item))
+        if item.chunk_scores is None:
+            pending_chunks += len(item.chunks)
+        if pending_chunks >= batch_size:
+            article.score_articles([a for _, a in pending], batch_size)
+            yield from pending
+            pending, pending_chunks = [], 0
+
+    article.score_articles([a for _, a in pending], batch_size)
+    yield from pending
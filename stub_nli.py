@@ -0,0 +1,131 @@
+"""A stand-in NLI model and tokenizer with no dependencies, for offline benchmarks and tests.
+
+Hypotheses are entailed by how many of their label's words the premise
+contains, with a deterministic jitter from the token ids so labels nothing
+mentions still get distinct scores. The tokenizer splits on words and
+punctuation and hashes each token to an id, so ids agree across processes.
+The pipeline answers like the transformers zero-shot pipeline, and exposes
+tokenizer and model the same way for the fused pass.
+"""
+import math
+import re
+import zlib
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Sequence, Union
+
+CLS, SEP, PAD = 1, 2, 0
+VOCAB_SIZE = 50000
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+# Words of the hypothesis templates, which say nothing about the label
+TEMPLATE_WORDS = {'this', 'example', 'text', 'is', 'relevant', 'to', 'an', '.'}
+
+
+def token_id(token: str) -> int:
+    return 3 + zlib.crc32(token.lower().encode('utf-8')) % VOCAB_SIZE
+
+
+_TEMPLATE_IDS = {token_id(word) for word in TEMPLATE_WORDS}
+
+
+def _softmax(values: Sequence[float]) -> List[float]:
+    top = max(values)
+    exps = [math.exp(value - top) for value in values]
+    total = sum(exps)
+    return [value / total for value in exps]
+
+
+class StubTokenizer:
+    """Word and punctuation tokens with BART's pair layout: CLS a SEP SEP b SEP"""
+    model_max_length = 512
+    pad_token_id = PAD
+
+    def __call__(self, texts: Union[str, List[str]], add_special_tokens=True, return_offsets_mapping=False,
+                 **kwargs) -> Dict:
+        single = isinstance(texts, str)
+        encoded = {'input_ids': [], 'offset_mapping': []}
+        for text in [texts] if single else texts:
+            matches = list(_TOKEN.finditer(text))
+            ids = [token_id(match.group()) for match in matches]
+            offsets = [match.span() for match in matches]
+            if add_special_tokens:
+                ids, offsets = [CLS] + ids + [SEP], [(0, 0)] + offsets + [(0, 0)]
+            encoded['input_ids'].append(ids)
+            encoded['offset_mapping'].append(offsets)
+        if not return_offsets_mapping:
+            del encoded['offset_mapping']
+        return {key: value[0] for key, value in encoded.items()} if single else encoded
+
+    def num_special_tokens_to_add(self, pair=False) -> int:
+        return 4 if pair else 2
+
+    def build_inputs_with_special_tokens(self, first: List[int], second: Optional[List[int]] = None) -> List[int]:
+        if second is None:
+            return [CLS] + first + [SEP]
+        return [CLS] + first + [SEP, SEP] + second + [SEP]
+
+    def pad(self, encoded: Dict, return_tensors=None) -> Dict:
+        longest = max(len(ids) for ids in encoded['input_ids'])
+        return {
+            'input_ids': [ids + [PAD] * (longest - len(ids)) for ids in encoded['input_ids']],
+            'attention_mask': [[1] * len(ids) + [0] * (longest - len(ids)) for ids in encoded['input_ids']],
+        }
+
+
+class _Logits(list):
+    def tolist(self):
+        return list(self)
+
+
+class StubModel:
+    """Logits over contradiction, neutral and entailment for each premise/hypothesis pair"""
+    config = SimpleNamespace(label2id={'contradiction': 0, 'neutral': 1, 'entailment': 2})
+
+    @staticmethod
+    def pair_logits(ids: List[int]) -> List[float]:
+        ids = [i for i in ids if i != PAD]
+        separator = ids.index(SEP)
+        premise = set(ids[1:separator])
+        label = [i for i in ids[separator + 2:-1] if i not in _TEMPLATE_IDS]
+        found = sum(1 for i in label if i in premise) / len(label) if label else 0.0
+        jitter = (zlib.crc32(repr(ids).encode('ascii')) % 1000) / 1000 - 0.5
+        return [0.0, 0.5, 6 * found - 3 + jitter]
+
+    def __call__(self, input_ids, attention_mask=None, **kwargs):
+        if attention_mask is None:
+            attention_mask = [[1] * len(ids) for ids in input_ids]
+        return SimpleNamespace(logits=_Logits(
+            self.pair_logits([i for i, keep in zip(ids, mask) if keep]) for ids, mask in zip(input_ids, attention_mask)
+        ))
+
+
+class StubPipeline:
+    """Answers like transformers' zero-shot-classification pipeline"""
+
+    def __init__(self):
+        self.tokenizer = StubTokenizer()
+        self.model = StubModel()
+
+    def _scores(self, text: str, labels: List[str], hypothesis_template: str, multi_label: bool) -> List[float]:
+        premise = self.tokenizer(text, add_special_tokens=False)['input_ids']
+        limit = self.tokenizer.model_max_length - self.tokenizer.num_special_tokens_to_add(pair=True)
+        logits = []
+        for label in labels:
+            hypothesis = self.tokenizer(hypothesis_template.format(label), add_special_tokens=False)['input_ids']
+            pair = self.tokenizer.build_inputs_with_special_tokens(premise[:limit - len(hypothesis)], hypothesis)
+            logits.append(self.model.pair_logits(pair))
+        if multi_label or len(labels) == 1:
+            return [_softmax([row[0], row[2]])[1] for row in logits]
+        return _softmax([row[2] for row in logits])
+
+    def __call__(self, sequences, candidate_labels, hypothesis_template="This example is {}.",
+                 multi_label=False, **kwargs):
+        single = isinstance(sequences, str)
+        outputs = []
+        for text in [sequences] if single else sequences:
+            scores = self._scores(text, list(candidate_labels), hypothesis_template, multi_label)
+            order = sorted(range(len(scores)), key=lambda i: -scores[i])
+            outputs.append({'sequence': text, 'labels': [candidate_labels[i] for i in order],
+                            'scores': [scores[i] for i in order]})
+        return outputs[0] if single else outputs
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import analytics
+import storage
+
+START = date(2024, 1, 1)
+
+
+def history(symbols=10, days=40, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for day in range(days):
+        for column in range(symbols):
+            count = int(rng.poisson(3))
+            # Some symbols have no results some days
+            if rng.random() < 0.9:
+                rows.append((f"S{column}", START + timedelta(days=day), count,
+                             float(rng.uniform(-1, 1)) if count else None))
+    return rows
+
+
+class TestSentimentAnalytics(unittest.TestCase):
+
+    def test_zscores_match_pandas_rolling(self):
+        scores = analytics.SentimentAnalytics.from_rows(history(), window=10, min_periods=4)
+        trailing = scores.average.shift(1).rolling(10, min_periods=4)
+        expected = (scores.average - trailing.mean()) / trailing.std()
+        np.testing.assert_allclose(scores.zscore.to_numpy(), expected.to_numpy(), atol=1e-9)
+
+    def test_append_matches_full_history(self):
+        rows = history()
+        cutoff = START + timedelta(days=25)
+        full = analytics.SentimentAnalytics.from_rows(rows, window=10)
+        incremental = analytics.SentimentAnalytics.from_rows([row for row in rows if row[1] < cutoff], window=10)
+        by_day = {}
+        for symbol, day, count, average in rows:
+            if day >= cutoff:
+                by_day.setdefault(day, {})[symbol] = {'count': count, 'average': average}
+        for day in sorted(by_day):
+            incremental.append(day, by_day[day])
+
+        for name in ('zscore', 'shock', 'rank'):
+            pd.testing.assert_frame_equal(getattr(incremental, name), getattr(full, name), atol=1e-9)
+        with self.assertRaises(ValueError):
+            incremental.append(cutoff, {})
+
+    def test_shock_weighted_by_volume(self):
+        rows = [(symbol, START + timedelta(days=day), 2, 0.1 * (day % 3)) for day in range(10) for symbol in 'AB']
+        scores = analytics.SentimentAnalytics.from_rows(rows, window=10)
+        day = START + timedelta(days=10)
+        # The same jump in sentiment, on four times the usual volume for B
+        scores.append(day, {'A': {'count': 2, 'average': 0.9}, 'B': {'count': 8, 'average': 0.9}})
+        self.assertAlmostEqual(scores.zscore.loc[day, 'A'], scores.zscore.loc[day, 'B'])
+        self.assertAlmostEqual(scores.shock.loc[day, 'B'], 2 * scores.shock.loc[day, 'A'])
+        self.assertEqual(scores.rank.loc[day].tolist(), [0.5, 1.0])
+
+    def test_anomalies_joined_with_price_moves(self):
+        rows = [(symbol, START + timedelta(days=day), 3, 0.05 * (day % 4)) for day in range(15) for symbol in 'ABC']
+        day = START + timedelta(days=15)
+        scores = analytics.SentimentAnalytics.from_rows(rows, window=10)
+        scores.append(day, {'A': {'count': 3, 'average': -0.8}, 'B': {'count': 3, 'average': 0.9},
+                            'C': {'count': 3, 'average': 0.1}},
+                      price_changes={'A': 0.04, 'B': 0.02})
+
+        flagged = scores.anomalies(threshold=3.0, since=day)
+        self.assertEqual(flagged['symbol'].tolist(), ['A', 'B'])
+        self.assertEqual(flagged['price_change'].tolist(), [0.04, 0.02])
+        # A's sentiment fell while the price rose
+        self.assertEqual(flagged['divergent'].tolist(), [True, False])
+
+    def test_load_from_database(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_url = f"sqlite:///{os.path.join(tmp, 'history.db')}"
+            today = date.today()
+            for offset in range(3, 0, -1):
+                day = today - timedelta(days=offset)
+                storage.save_sentiment({'NVDA': {'count': 2, 'average': 0.1 * offset, 'articles': []}}, day,
+                                       db_url=db_url)
+                storage.upsert_ticker_data({'NVDA': {'info': {'currentPrice': 105.0, 'previousClose': 100.0},
+                                                     'news': []}}, day, db_url)
+            scores = analytics.load(db_url=db_url, window=2, min_periods=2)
+            self.assertEqual(scores.symbols, ['NVDA'])
+            self.assertEqual(len(scores.days), 3)
+            self.assertAlmostEqual(scores.price_change.iloc[-1, 0], 0.05)
+
+            storage.save_sentiment({'NVDA': {'count': 2, 'average': 0.5, 'articles': []}}, today, db_url=db_url)
+            scores.update(today, db_url)
+            self.assertEqual(scores.days[-1], today)
+            self.assertAlmostEqual(scores.average.loc[today, 'NVDA'], 0.5)
+            storage.get_engine(db_url).dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
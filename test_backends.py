@@ -0,0 +1,131 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import backends
+import inference_cache
+import models
+
+
+class FakePipeline:
+    """Zero-shot stand-in whose scores depend on the backend that built it"""
+
+    def __init__(self, bias):
+        self.bias = bias
+        self.calls = 0
+
+    def __call__(self, texts, candidate_labels, hypothesis_template, multi_label, batch_size):
+        self.calls += 1
+        return [{'labels': list(candidate_labels), 'scores': [self.bias] * len(candidate_labels)} for _ in texts]
+
+
+class FakeBackend(backends.Backend):
+    name = 'fake'
+    loads = []
+
+    def load(self, task, model, device):
+        self.loads.append((task, model, device))
+        return FakePipeline(0.25)
+
+
+class FakeInt8Backend(FakeBackend):
+    name = 'fake-int8'
+
+    def load(self, task, model, device):
+        return FakePipeline(0.5)
+
+
+class TestBackends(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = inference_cache.InferenceCache(os.path.join(self.tmp.name, 'cache.db'))
+        self.shared_cache = mock.patch.multiple(inference_cache, _cache=self.cache, _enabled=True)
+        self.shared_cache.start()
+        self.backends = mock.patch.dict(backends.BACKENDS, {'fake': FakeBackend, 'fake-int8': FakeInt8Backend})
+        self.backends.start()
+        self.settings = mock.patch.dict(models._settings)
+        self.settings.start()
+        self.environ = mock.patch.dict(os.environ)
+        self.environ.start()
+        FakeBackend.loads = []
+
+    def tearDown(self):
+        models.registry.unload(backend='fake')
+        models.registry.unload(backend='fake-int8')
+        self.environ.stop()
+        self.settings.stop()
+        self.backends.stop()
+        self.shared_cache.stop()
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            models.configure(backend='tensorrt')
+
+    def test_configure_sets_defaults_for_workers(self):
+        models.configure(models.DISTILLED_MODEL, 'fake')
+        self.assertEqual((models.current_model(), models.current_backend()), (models.DISTILLED_MODEL, 'fake'))
+        self.assertEqual(os.environ['SENTIMENT_BACKEND'], 'fake')
+        self.assertEqual(os.environ['SENTIMENT_MODEL'], models.DISTILLED_MODEL)
+
+    def test_classify_loads_through_backend_once(self):
+        models.configure(backend='fake')
+        models.classify(['a'], ['up', 'down'])
+        models.classify(['b'], ['up', 'down'])
+        self.assertEqual(FakeBackend.loads, [(models.ZERO_SHOT, models.DEFAULT_MODEL, -1)])
+        self.assertTrue(models.registry.is_loaded(backend='fake', device=-1))
+
+    def test_results_cached_per_backend(self):
+        first, = models.classify(['NVIDIA beat estimates'], ['up', 'down'], backend='fake')
+        second, = models.classify(['NVIDIA beat estimates'], ['up', 'down'], backend='fake-int8')
+        self.assertEqual(first['scores'], [0.25, 0.25])
+        self.assertEqual(second['scores'], [0.5, 0.5])
+        self.assertEqual(models.registry.unload(backend='fake-int8'), 1)
+
+
+class TestStubBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.shared_cache = mock.patch.multiple(inference_cache, _cache=None, _enabled=False)
+        self.shared_cache.start()
+        self.settings = mock.patch.dict(models._settings, backend='stub')
+        self.settings.start()
+
+    def tearDown(self):
+        models.registry.unload(backend='stub')
+        self.settings.stop()
+        self.shared_cache.stop()
+
+    def test_relevance_follows_the_label_words(self):
+        texts = ['apex harbor corporation (ahc) raised guidance', 'oil prices rose for a third session']
+        results = models.classify(texts, ['AHC', 'Apex Harbor Corporation'],
+                                  hypothesis_template="This text is relevant to {}", multi_label=True)
+        self.assertGreater(max(results[0]['scores']), 0.7)
+        self.assertLess(max(results[1]['scores']), 0.7)
+
+    def test_deterministic_and_fused_agrees(self):
+        import article
+        import fused
+
+        texts = ['apex harbor (ahc) beat estimates and raised its dividend', 'ahc shares fell on the recall']
+        labels = list(article.LABEL_TO_SCORE)
+        first = models.classify(texts, labels)
+        self.assertEqual(models.classify(texts, labels), first)
+        self.assertAlmostEqual(sum(first[0]['scores']), 1.0)
+
+        scores = fused.FusedClassifier("This text is relevant to {}").classify(texts, ['AHC', 'Apex Harbor'])
+        for score, result in zip(scores, first):
+            self.assertAlmostEqual(score, article.weighted_score(result))
+
+    def test_tokenizer_comes_from_the_backend(self):
+        from stub_nli import StubTokenizer
+
+        self.assertIsInstance(models.get_tokenizer(), StubTokenizer)
+        self.assertIs(models.get_tokenizer(), models.get_tokenizer(backend='stub'))
+
+
+if __name__ == '__main__':
+    unittest.main()
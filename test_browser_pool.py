@@ -0,0 +1,93 @@
+import time
+import unittest
+
+from retrieval.browser_pool import BrowserPool
+
+
+class FakeDriver:
+    """Stands in for a Chrome driver, optionally crashing on a given page"""
+
+    created = 0
+
+    def __init__(self, crash_on=None, heap=0):
+        FakeDriver.created += 1
+        self.crash_on = crash_on
+        self.heap = heap
+        self.url = None
+        self.quit_called = False
+
+    def get(self, url):
+        time.sleep(0.05)
+        if url == self.crash_on:
+            self.crash_on = None
+            raise RuntimeError("chrome not reachable")
+        self.url = url
+
+    @property
+    def page_source(self):
+        return f"<html>{self.url}</html>"
+
+    def execute_script(self, script):
+        return self.heap
+
+    def quit(self):
+        self.quit_called = True
+
+
+class TestBrowserPool(unittest.TestCase):
+
+    def setUp(self):
+        FakeDriver.created = 0
+
+    def test_recycles_after_max_pages(self):
+        pool = BrowserPool(size=1, max_pages=2, requests_per_second=0, driver_factory=FakeDriver)
+        for i in range(5):
+            self.assertEqual(pool.fetch(f"http://a.com/{i}"), f"<html>http://a.com/{i}</html>")
+        self.assertEqual(pool.stats.recycles, 2)
+        self.assertEqual(FakeDriver.created, 3)
+
+    def test_crashed_driver_is_restarted(self):
+        # Only the first driver crashes, its replacement works
+        pool = BrowserPool(size=1, requests_per_second=0,
+                           driver_factory=lambda: FakeDriver(crash_on=None if FakeDriver.created else "http://a.com/bad"))
+        self.assertEqual(pool.fetch("http://a.com/bad"), "<html>http://a.com/bad</html>")
+        self.assertEqual(pool.stats.restarts, 1)
+        self.assertEqual(pool.stats.failures, 0)
+
+    def test_failed_recycle_drops_the_worker(self):
+        def factory():
+            # The second driver, the first one's replacement, fails to start
+            if FakeDriver.created == 1:
+                FakeDriver.created += 1
+                raise RuntimeError("chromedriver failed to start")
+            return FakeDriver()
+
+        pool = BrowserPool(size=1, max_pages=1, requests_per_second=0, driver_factory=factory)
+        # The page that loaded is still returned
+        self.assertEqual(pool.fetch("http://a.com/1"), "<html>http://a.com/1</html>")
+        self.assertEqual(pool._workers, [])
+        # and the pool doesn't hang, but starts a new browser
+        self.assertEqual(pool.fetch_many(["http://a.com/2", "http://a.com/3"]),
+                         ["<html>http://a.com/2</html>", "<html>http://a.com/3</html>"])
+        self.assertEqual(len(pool._workers), 1)
+
+    def test_parallel_dispatch_and_domain_timings(self):
+        pool = BrowserPool(size=4, requests_per_second=0, driver_factory=FakeDriver)
+        urls = [f"http://{host}/{i}" for i in range(4) for host in ("a.com", "b.com")]
+        start = time.perf_counter()
+        pages = pool.fetch_many(urls)
+        # Eight 50ms pages over four browsers
+        self.assertLess(time.perf_counter() - start, 0.3)
+        self.assertEqual(pages, [f"<html>{url}</html>" for url in urls])
+        self.assertLessEqual(FakeDriver.created, 4)
+        self.assertEqual(pool.stats.by_domain()['a.com']['pages'], 4)
+
+    def test_after_load_hook(self):
+        seen = []
+        pool = BrowserPool(size=1, requests_per_second=0, driver_factory=FakeDriver)
+        pool.fetch("http://a.com/", after_load=lambda driver: seen.append(driver.url))
+        self.assertEqual(seen, ["http://a.com/"])
+
+
+if __name__ == '__main__':
+    unittest.main()
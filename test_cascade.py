@@ -0,0 +1,69 @@
+import os
+import unittest
+from unittest import mock
+
+import article
+import cascade
+
+
+class TestLexiconScorer(unittest.TestCase):
+
+    def setUp(self):
+        self.scorer = cascade.LexiconScorer()
+
+    def test_clear_cut_text(self):
+        self.assertGreater(self.scorer.score("NVIDIA beat estimates as revenue surged to a record and analysts upgraded the stock"), 0.5)
+        self.assertLess(self.scorer.score("Shares plunged after Boeing missed estimates and warned of further losses"), -0.5)
+
+    def test_neutral_and_mixed_text_stays_near_zero(self):
+        self.assertEqual(self.scorer.score("The company will report results on Tuesday."), 0)
+        self.assertAlmostEqual(self.scorer.score("Strong sales were offset by weak margins"), 0)
+
+    def test_negation_flips(self):
+        self.assertLess(self.scorer.score("Apple did not beat estimates and growth wasn't strong"), 0)
+
+
+class TestCascadeScorer(unittest.TestCase):
+
+    def test_only_uncertain_chunks_escalate(self):
+        texts = [
+            "NVIDIA beat estimates as revenue surged to a record and analysts upgraded the stock",
+            "The company will report results on Tuesday.",
+            "",
+            "Shares plunged after Boeing missed estimates and warned of further losses",
+        ]
+        scorer = cascade.CascadeScorer(band=(-0.35, 0.35))
+        with mock.patch('article.zero_shot_scores', return_value=[0.1]) as zero_shot:
+            scores = scorer.score_texts(texts, 4)
+
+        zero_shot.assert_called_once_with([texts[1]], 4)
+        self.assertGreater(scores[0], 0.35)
+        self.assertEqual(scores[1:3], [0.1, 0.0])
+        self.assertLess(scores[3], -0.35)
+        self.assertEqual((scorer.stats.chunks, scorer.stats.escalated), (3, 1))
+        self.assertAlmostEqual(scorer.stats.escalation_rate, 1 / 3)
+
+    def test_stages_are_averaged(self):
+        fixed = mock.Mock(score_many=lambda texts: [1.0] * len(texts))
+        scorer = cascade.CascadeScorer([cascade.LexiconScorer(), fixed], band=(-0.1, 0.1))
+        self.assertEqual(scorer.first_stage(["The company will report on Tuesday."]), [0.5])
+
+    def test_configure_routes_article_scoring(self):
+        with mock.patch.dict(os.environ), mock.patch('article._scorer', None):
+            cascade.configure(band=(-0.2, 0.2))
+            self.assertIsInstance(article.get_scorer(), cascade.CascadeScorer)
+            # A spawned worker rebuilds the same cascade
+            article.set_scorer(None)
+            self.assertEqual(cascade.configure_from_env().band, (-0.2, 0.2))
+            with mock.patch('article.zero_shot_scores', return_value=[]) as zero_shot:
+                scores = article.score_texts(["Revenue surged and margins improved to a record"])
+            zero_shot.assert_called_once_with([], article.SENTIMENT_BATCH_SIZE)
+            self.assertGreater(scores[0], 0)
+
+            cascade.configure(enabled=False)
+            self.assertIsNone(article.get_scorer())
+            self.assertNotIn('SENTIMENT_CASCADE', os.environ)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import re
+import unittest
+
+from retrieval.article_retrieval import ArticleRetrieval
+from retrieval.article_store import ArticleStore
+from retrieval.chunking import ChunkStats, TokenChunker
+
+
+class WhitespaceTokenizer:
+    """Stands in for a fast tokenizer: one token per word, with offsets"""
+    model_max_length = 40
+
+    def __init__(self):
+        self.calls = 0
+
+    def num_special_tokens_to_add(self, pair=False):
+        return 4 if pair else 2
+
+    def __call__(self, texts, add_special_tokens=True, return_offsets_mapping=False):
+        self.calls += 1
+        offsets = [[(m.start(), m.end()) for m in re.finditer(r'\S+', text)] for text in texts]
+        return {'input_ids': [list(range(len(spans))) for spans in offsets], 'offset_mapping': offsets}
+
+
+def split(text):
+    return re.split(r'(?<=\.)\s+', text.strip())
+
+
+def sentence(n, word='word'):
+    return ' '.join([word] * (n - 1) + [word + '.'])
+
+
+class TestTokenChunker(unittest.TestCase):
+
+    def setUp(self):
+        self.tokenizer = WhitespaceTokenizer()
+
+    def test_budget_leaves_room_for_hypothesis(self):
+        chunker = TokenChunker(self.tokenizer, split, ['This example is very negative.'], reserve=2)
+        # 40 - 4 special - 5 hypothesis - 2 reserve
+        self.assertEqual(chunker.budget, 29)
+
+    def test_packs_up_to_budget_in_one_call(self):
+        chunker = TokenChunker(self.tokenizer, split, max_tokens=24)
+        self.assertEqual(chunker.budget, 20)
+        texts = [' '.join(sentence(6) for _ in range(7)), sentence(3), '']
+        self.tokenizer.calls = 0
+        stats = ChunkStats()
+        chunks = chunker.chunk_many(texts, stats)
+
+        self.assertEqual(self.tokenizer.calls, 1)
+        self.assertEqual([len(chunk.split()) for chunk in chunks[0]], [18, 18, 6])
+        self.assertEqual(' '.join(chunks[0]), texts[0])
+        self.assertEqual(chunks[1:], [[sentence(3)], []])
+        self.assertEqual((stats.articles, stats.chunks, stats.tokens), (2, 4, 45))
+        self.assertAlmostEqual(stats.utilization, 45 / 80)
+
+    def test_long_sentence_cut_on_token_boundaries(self):
+        chunker = TokenChunker(self.tokenizer, split, max_tokens=14)
+        long_sentence = ' '.join(f"w{i}" for i in range(25)) + '.'
+        chunks = chunker.chunk_many([long_sentence])[0]
+        self.assertEqual([len(chunk.split()) for chunk in chunks], [10, 10, 5])
+        self.assertEqual(' '.join(chunks), long_sentence)
+
+    def test_overlap_repeats_last_sentences(self):
+        chunker = TokenChunker(self.tokenizer, split, overlap=6, max_tokens=24)
+        text = ' '.join(sentence(6, word) for word in 'abcde')
+        chunks = chunker.chunk_many([text])[0]
+        self.assertEqual(chunks, [
+            ' '.join(sentence(6, word) for word in 'abc'),
+            ' '.join(sentence(6, word) for word in 'cde'),
+        ])
+
+
+class TestArticleRetrievalChunking(unittest.TestCase):
+
+    def test_window_of_pages_chunked_together(self):
+        tokenizer = WhitespaceTokenizer()
+        retrieval = ArticleRetrieval()
+        retrieval.article_store = ArticleStore()
+        retrieval._chunker = TokenChunker(tokenizer, split, max_tokens=24)
+        for i in range(3):
+            retrieval.article_store.put_html(f"https://x/{i}", f"<p>{sentence(6, f'page{i}')}</p>")
+
+        retrieval.process_pages([f"https://x/{i}" for i in range(4)])
+
+        self.assertEqual(tokenizer.calls, 1)
+        self.assertEqual(retrieval.article_store.peek('https://x/2').chunks, [sentence(6, 'page2')])
+        self.assertIsNone(retrieval.article_store.peek('https://x/3'))
+        self.assertEqual(retrieval.chunk_stats.chunks, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
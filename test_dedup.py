@@ -0,0 +1,120 @@
+import os
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+import dedup
+import storage
+from article import Article
+from retrieval.article_retrieval import ArticleRetrieval
+from retrieval.article_store import ArticleStore
+from retrieval.extraction import Extraction
+from retrieval.page_cache import PageCache
+
+STORY = ("Nvidia reported record quarterly revenue of 26 billion dollars on Wednesday, well ahead of "
+         "analyst forecasts, as demand for its data center chips kept climbing. Shares rose seven percent "
+         "in after-hours trading. The company also announced a ten-for-one stock split and raised its "
+         "dividend, saying supply of its newest accelerators would improve through the rest of the year.")
+# The same wire story as another outlet runs it
+COPY = "By Staff Writer. " + STORY + " Reporting by A. Smith."
+OTHER = ("Apple unveiled a new line of laptops on Tuesday with longer battery life and faster graphics, "
+         "pitching them at students and creative professionals ahead of the back-to-school season.")
+INFO = {'symbol': 'NVDA', 'shortName': 'NVIDIA'}
+
+
+class TestNearDuplicateIndex(unittest.TestCase):
+
+    def test_copies_map_to_the_first_page(self):
+        index = dedup.NearDuplicateIndex()
+        self.assertIsNone(index.add('https://wire.example/nvda', STORY))
+        self.assertEqual(index.add('https://other.example/nvda-copy?utm=feed', COPY), 'https://wire.example/nvda')
+        self.assertIsNone(index.add('https://other.example/apple', OTHER))
+        # Too short to fingerprint
+        self.assertIsNone(index.add('https://other.example/brief', 'Nvidia up'))
+
+        self.assertEqual(index.representative('https://other.example/nvda-copy'), 'https://wire.example/nvda')
+        self.assertEqual(index.representative('https://other.example/apple'), 'https://other.example/apple')
+        self.assertEqual((index.stats.pages, index.stats.clusters, index.stats.copies), (4, 1, 1))
+
+    def test_stories_are_remembered_across_days(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        db_url = f"sqlite:///{os.path.join(tmp.name, 'dedup.db')}"
+        self.addCleanup(dedup.configure, enabled=False, db_url=None)
+
+        yesterday = dedup.configure(db_url=db_url)
+        yesterday.add('https://wire.example/nvda', STORY, day=date.today() - timedelta(days=1))
+        dedup.save(db_url)
+
+        today = dedup.configure(db_url=db_url)
+        self.assertEqual(today.add('https://other.example/nvda-copy', COPY), 'https://wire.example/nvda')
+        self.assertEqual(today.stats.earlier, 1)
+
+        # Stories older than the window are forgotten
+        dedup.configure(days=0, db_url=db_url)
+        dedup.save(db_url)
+        self.assertEqual(storage.load_fingerprints(date.today() - timedelta(days=30), db_url=db_url), [])
+
+
+class TestCopiesInRetrieval(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ArticleStore(PageCache(path=None))
+        self.store.near_duplicates = dedup.NearDuplicateIndex()
+        self.retrieval = ArticleRetrieval()
+        self.retrieval.article_store = self.store
+
+    def test_copy_checked_through_its_original(self):
+        self.store.put_page('https://wire.example/nvda', Extraction.from_text(STORY), ['original chunk'])
+        self.store.put_page('https://other.example/nvda-copy', Extraction.from_text(COPY), ['copy chunk'])
+        copy = self.store.peek('https://other.example/nvda-copy')
+        self.assertEqual(copy.duplicate_of, 'https://wire.example/nvda')
+
+        self.assertIs(self.retrieval._original(copy, INFO), self.store.peek('https://wire.example/nvda'))
+        self.assertEqual(self.store.near_duplicates.stats.chunks_skipped, 1)
+
+    def test_copy_about_another_company_checked_on_its_own(self):
+        self.store.put_page('https://wire.example/nvda', Extraction.from_text(STORY), ['original chunk'])
+        templated = STORY.replace('Nvidia', 'Broadcom')
+        self.store.put_page('https://other.example/avgo', Extraction.from_text(templated), ['avgo chunk'])
+        page = self.store.peek('https://other.example/avgo')
+        self.assertIsNotNone(page.duplicate_of)
+        self.assertIs(self.retrieval._original(page, {'symbol': 'AVGO', 'shortName': 'Broadcom'}), page)
+
+    def test_copy_of_an_earlier_story_is_not_counted_again(self):
+        self.store.near_duplicates.load([{'link': 'https://wire.example/nvda', 'date': date.today() - timedelta(days=1),
+                                          'signature': self.store.near_duplicates.signature(STORY).tobytes()}])
+        self.store.put_page('https://other.example/nvda-copy', Extraction.from_text(COPY), ['copy chunk'])
+        self.assertIsNone(self.retrieval._original(self.store.peek('https://other.example/nvda-copy'), INFO))
+
+
+class TestCollapse(unittest.TestCase):
+
+    def test_copies_attached_to_the_first_article(self):
+        index = dedup.NearDuplicateIndex()
+        index.add('https://wire.example/nvda', STORY)
+        index.add('https://other.example/nvda-copy', COPY)
+        index.add('https://other.example/apple', OTHER)
+        articles = [Article('copy', 'https://other.example/nvda-copy', ['a']),
+                    Article('apple', 'https://other.example/apple', ['b']),
+                    Article('original', 'https://wire.example/nvda', ['a'])]
+
+        kept = dedup.collapse(articles, index)
+        self.assertEqual([a.title for a in kept], ['copy', 'apple'])
+        self.assertEqual(kept[0].duplicates, ['https://wire.example/nvda'])
+
+    def test_duplicates_journalled_as_seen(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_url = f"sqlite:///{os.path.join(tmp, 'journal.db')}"
+            storage.save_sentiment({'NVDA': {'count': 1, 'average': 0.5, 'articles': [
+                {'link': 'https://wire.example/nvda', 'title': 't', 'chunks': ['a'], 'chunk_scores': [0.5],
+                 'duplicates': ['https://other.example/nvda-copy']}
+            ]}}, db_url=db_url)
+            journal = storage.load_journal(['NVDA'], db_url=db_url)['NVDA']
+            self.assertEqual(journal['seen'], {'https://wire.example/nvda', 'https://other.example/nvda-copy'})
+            self.assertEqual(len(journal['articles']), 1)
+            storage.get_engine(db_url).dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
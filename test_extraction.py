@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+
+from retrieval.article_retrieval import ArticleRetrieval, split_sentences
+from retrieval.article_store import ArticleStore
+from retrieval.extraction import Extraction, extract
+from retrieval.page_cache import PageCache
+
+BODY = [
+    "Nvidia reported record quarterly revenue of $26 billion, well ahead of forecasts.",
+    "Shares rose 7% in after-hours trading as data center demand kept climbing",
+    "The company also announced a ten-for-one stock split effective next month.",
+]
+
+PAGE = f"""<html><head><title>Nvidia beats estimates | Example News</title>
+<meta property="article:published_time" content="2024-05-22T20:05:00Z"></head>
+<body><header><p>Sign in to read the latest market news and analysis from our desk</p></header>
+<nav><p>Markets Tech Economy Personal Finance Opinion Video Podcasts</p></nav>
+<div id="cookie-consent"><p>We use cookies to improve your experience on our site and to show ads.</p></div>
+<div class="layout"><article><h1>Nvidia beats estimates</h1>
+<p>{BODY[0]}</p><div class="share-tools"><p>Share this article on social media with your friends</p></div>
+<p>{BODY[1]}</p><p>{BODY[2]}</p></article>
+<aside><p>Related: what to watch for in Apple earnings this week and next</p></aside></div>
+<footer><p>Copyright 2024 Example News. All rights reserved. Quotes delayed 15 minutes.</p></footer>
+</body></html>"""
+
+
+class TestExtract(unittest.TestCase):
+
+    def test_keeps_only_the_article_body(self):
+        extraction = extract(PAGE)
+        self.assertEqual(extraction.paragraph_texts, BODY)
+        self.assertEqual(extraction.text, '\n'.join(BODY))
+        self.assertEqual(extraction.title, 'Nvidia beats estimates')
+        self.assertEqual(extraction.published, '2024-05-22T20:05:00Z')
+
+    def test_densest_container_without_article_tag(self):
+        page = PAGE.replace('<article>', '<div>').replace('</article>', '</div>')
+        page = page.replace('<meta property="article:published_time" content="2024-05-22T20:05:00Z">', '')
+        page = page.replace('</h1>', '</h1><time datetime="2024-05-22">May 22</time>')
+        extraction = extract(page)
+        self.assertEqual(extraction.paragraph_texts, BODY)
+        self.assertEqual(extraction.published, '2024-05-22')
+
+    def test_published_from_json_ld(self):
+        page = ('<html><head><script type="application/ld+json">{"@type": "NewsArticle", '
+                '"datePublished": "2024-05-23T09:00:00Z"}</script></head>'
+                f'<body><p>{BODY[0]}</p></body></html>')
+        self.assertEqual(extract(page).published, '2024-05-23T09:00:00Z')
+
+    def test_odd_input(self):
+        self.assertEqual(extract(''), Extraction())
+        self.assertEqual(extract('<!-- nothing here -->'), Extraction())
+        declared = '<?xml version="1.0" encoding="utf-8"?>' + PAGE
+        self.assertEqual(extract(declared).paragraph_texts, BODY)
+
+    def test_json_round_trip(self):
+        extraction = extract(PAGE)
+        self.assertEqual(Extraction.from_json(extraction.to_json()), extraction)
+
+
+class TestExtractionReuse(unittest.TestCase):
+
+    def test_sentences_stay_within_paragraphs(self):
+        retrieval = ArticleRetrieval()
+        text = retrieval._preprocess_text(extract(PAGE).text)
+        # The second paragraph has no full stop to end it
+        self.assertEqual(split_sentences(text)[1:3], [BODY[1].lower(), BODY[2].lower()])
+
+    def test_short_pages_are_not_articles(self):
+        retrieval = ArticleRetrieval()
+        self.assertFalse(retrieval._is_article_page(PAGE))
+        self.assertFalse(retrieval._is_article_page(extract(PAGE)))
+
+    def test_store_caches_the_extraction(self):
+        retrieval = ArticleRetrieval()
+
+        def process(html):
+            extraction = retrieval._extract(html)
+            return extraction, [extraction.text]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cache.db')
+            store = ArticleStore(PageCache(path), store_text=True)
+            page = store.get_page('https://x/a', lambda url: PAGE, process, retrieval._process_text)
+            self.assertEqual(page.extraction.title, 'Nvidia beats estimates')
+            store.page_cache.close()
+
+            # Next run: the extraction comes from disk, nothing is fetched or parsed
+            rerun = ArticleStore(PageCache(path), store_text=True)
+            page = rerun.get_page('https://x/a', self.fail, self.fail, lambda text: (text, [text]))
+            self.assertEqual(page.extraction, extract(PAGE))
+            self.assertEqual(page.chunks, ['\n'.join(BODY)])
+            rerun.page_cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import gzip
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from retrieval.fetcher import AsyncFetcher, TokenBucket, looks_blocked
+
+ARTICLE = "<html><body>" + "<p>NVIDIA shares rose after earnings.</p>" * 20 + "</body></html>"
+JS_SHELL = "<html><body><div id='root'></div>" + "<script src='app.js'></script>" * 4 + "</body></html>"
+CAPTCHA = "<html><body><h1>Are you a robot?</h1><p>Please complete the captcha.</p></body></html>"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves a handful of canned pages standing in for news sites"""
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/article':
+            self._send(200, ARTICLE.encode(), {'Content-Type': 'text/html'})
+        elif self.path == '/gzip':
+            self._send(200, gzip.compress(ARTICLE.encode()), {'Content-Type': 'text/html', 'Content-Encoding': 'gzip'})
+        elif self.path == '/moved':
+            self._send(301, b'', {'Location': '/article'})
+        elif self.path == '/js':
+            self._send(200, JS_SHELL.encode(), {'Content-Type': 'text/html'})
+        elif self.path == '/captcha':
+            self._send(403, CAPTCHA.encode(), {'Content-Type': 'text/html'})
+        elif self.path == '/slow':
+            time.sleep(1)
+            try:
+                self._send(200, ARTICLE.encode())
+            except BrokenPipeError:
+                pass
+        else:
+            self._send(404, b'not found')
+
+
+class TestAsyncFetcher(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        cls.base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.fetcher = AsyncFetcher(requests_per_second=0, timeout=0.5)
+
+    def tearDown(self):
+        self.fetcher.close()
+
+    def test_plain_gzip_and_redirect(self):
+        plain, zipped, moved = self.fetcher.fetch_many(
+            [f"{self.base}/article", f"{self.base}/gzip", f"{self.base}/moved"]
+        )
+        for result in (plain, zipped, moved):
+            self.assertTrue(result.ok, result)
+            self.assertEqual(result.text, ARTICLE)
+        self.assertTrue(moved.final_url.endswith('/article'))
+
+    def test_blocked_pages_need_browser(self):
+        js, captcha = self.fetcher.fetch_many([f"{self.base}/js", f"{self.base}/captcha"])
+        self.assertTrue(js.blocked)
+        self.assertTrue(captcha.blocked)
+        self.assertEqual(self.fetcher.blocked_urls, {f"{self.base}/js", f"{self.base}/captcha"})
+
+    def test_missing_page_is_not_blocked(self):
+        result = self.fetcher.fetch(f"{self.base}/nope")
+        self.assertEqual(result.status, 404)
+        self.assertFalse(result.ok)
+        self.assertFalse(result.blocked)
+
+    def test_timeout(self):
+        result = self.fetcher.fetch(f"{self.base}/slow")
+        self.assertIsNotNone(result.error)
+        self.assertFalse(result.ok)
+
+    def test_per_host_rate_limit(self):
+        fetcher = AsyncFetcher(requests_per_second=20, burst=1)
+        try:
+            start = time.perf_counter()
+            fetcher.fetch_many([f"{self.base}/article"] * 5)
+            # One request goes straight away, the other four wait 1/20s each
+            self.assertGreaterEqual(time.perf_counter() - start, 0.19)
+        finally:
+            fetcher.close()
+
+
+class TestHelpers(unittest.TestCase):
+
+    def test_looks_blocked(self):
+        self.assertFalse(looks_blocked(200, ARTICLE))
+        self.assertTrue(looks_blocked(200, JS_SHELL))
+        self.assertTrue(looks_blocked(200, CAPTCHA))
+        self.assertTrue(looks_blocked(429, ARTICLE))
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, delta=0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
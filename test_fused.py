@@ -0,0 +1,173 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import article
+import fused
+import inference_cache
+import models
+from retrieval.article_retrieval import RELEVANCE_TEMPLATE, ArticleRetrieval
+
+CLS, SEP, PAD = 1, 2, 0
+
+
+class FakeTokenizer:
+    """Whitespace tokenizer with BART's pair layout, counting the texts it is given"""
+    model_max_length = 64
+
+    def __init__(self):
+        self.vocab = {}
+        self.texts_tokenized = []
+
+    def __call__(self, texts, add_special_tokens=True):
+        self.texts_tokenized.extend(texts)
+        return {'input_ids': [[self.vocab.setdefault(word, len(self.vocab) + 3) for word in text.lower().split()]
+                              for text in texts]}
+
+    def num_special_tokens_to_add(self, pair=False):
+        return 4 if pair else 2
+
+    def build_inputs_with_special_tokens(self, first, second):
+        return [CLS] + first + [SEP, SEP] + second + [SEP]
+
+    def pad(self, encoded, return_tensors=None):
+        longest = max(len(ids) for ids in encoded['input_ids'])
+        return {
+            'input_ids': [ids + [PAD] * (longest - len(ids)) for ids in encoded['input_ids']],
+            'attention_mask': [[1] * len(ids) + [0] * (longest - len(ids)) for ids in encoded['input_ids']],
+        }
+
+
+class Logits(list):
+    def tolist(self):
+        return list(self)
+
+
+class FakeNLIModel:
+    """Entails a hypothesis that shares a word with the premise, otherwise depends on the ids"""
+    config = SimpleNamespace(label2id={'contradiction': 0, 'neutral': 1, 'entailment': 2})
+
+    def __init__(self):
+        self.batches = 0
+
+    @staticmethod
+    def pair_logits(ids):
+        ids = [i for i in ids if i != PAD]
+        separator = ids.index(SEP)
+        premise, hypothesis = set(ids[1:separator]), set(ids[separator + 2:-1])
+        entailment = 4.0 if premise & hypothesis - {CLS, SEP} else (sum(ids) % 7) / 3 - 1
+        return [(sum(ids) % 5) / 4, 0.1, entailment]
+
+    def __call__(self, input_ids, attention_mask):
+        self.batches += 1
+        return SimpleNamespace(logits=Logits(
+            self.pair_logits([i for i, mask in zip(ids, masks) if mask]) for ids, masks in zip(input_ids, attention_mask)
+        ))
+
+
+def reference(pipeline, chunk, labels, threshold=0.7):
+    """What running relevance then sentiment through the zero-shot pipeline would give"""
+    tokenizer, model = pipeline.tokenizer, pipeline.model
+
+    def logits(hypothesis):
+        premise = [tokenizer.vocab.setdefault(w, len(tokenizer.vocab) + 3) for w in chunk.lower().split()]
+        second = [tokenizer.vocab.setdefault(w, len(tokenizer.vocab) + 3) for w in hypothesis.lower().split()]
+        return model.pair_logits(tokenizer.build_inputs_with_special_tokens(premise, second))
+
+    relevance = [fused._softmax([logits(RELEVANCE_TEMPLATE.format(label))[i] for i in (0, 2)])[1] for label in labels]
+    if max(relevance) <= threshold:
+        return None
+    sentiment_labels = list(article.LABEL_TO_SCORE)
+    scores = fused._softmax([logits(models.DEFAULT_TEMPLATE.format(label))[2] for label in sentiment_labels])
+    return article.weighted_score({'labels': sentiment_labels, 'scores': scores})
+
+
+CHUNKS = [
+    "nvda shares rose after strong results",
+    "the weather was mild across the region today",
+    "nvidia corporation guided revenue higher again",
+    "analysts expect a quiet session for markets",
+]
+LABELS = ['nvda', 'nvidia']
+
+
+class TestFusedClassifier(unittest.TestCase):
+
+    def setUp(self):
+        self.pipeline = SimpleNamespace(tokenizer=FakeTokenizer(), model=FakeNLIModel())
+        self.get_pipeline = mock.patch.object(models, 'get_pipeline', return_value=self.pipeline)
+        self.get_pipeline.start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = inference_cache.InferenceCache(os.path.join(self.tmp.name, 'cache.db'))
+        self.shared_cache = mock.patch.multiple(inference_cache, _cache=self.cache, _enabled=True)
+        self.shared_cache.start()
+
+    def tearDown(self):
+        self.shared_cache.stop()
+        self.get_pipeline.stop()
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def test_matches_separate_relevance_and_sentiment(self):
+        for mode in fused.MODES:
+            self.cache.clear()
+            scores = fused.FusedClassifier(RELEVANCE_TEMPLATE, mode=mode, batch_pairs=5).classify(CHUNKS, LABELS)
+            expected = [reference(self.pipeline, chunk, LABELS) for chunk in CHUNKS]
+            self.assertEqual([score is None for score in scores], [score is None for score in expected], mode)
+            self.assertEqual([score is None for score in scores], [False, True, False, True])
+            for score, want in zip(scores, expected):
+                if want is not None:
+                    self.assertAlmostEqual(score, want, places=9)
+
+    def test_premises_tokenized_once(self):
+        classifier = fused.FusedClassifier(RELEVANCE_TEMPLATE, batch_pairs=64)
+        classifier.classify(CHUNKS, LABELS)
+        for chunk in CHUNKS:
+            self.assertEqual(self.pipeline.tokenizer.texts_tokenized.count(chunk), 1)
+        # 4 chunks x (2 relevance + 5 sentiment) pairs fit one batch
+        self.assertEqual(classifier.stats.relevance_pairs + classifier.stats.sentiment_pairs, 28)
+        self.assertEqual(self.pipeline.model.batches, 1)
+
+    def test_short_circuit_skips_irrelevant_sentiment(self):
+        classifier = fused.FusedClassifier(RELEVANCE_TEMPLATE, mode='short-circuit')
+        classifier.classify(CHUNKS, LABELS)
+        self.assertEqual(classifier.stats.sentiment_pairs, 10)
+        self.assertEqual(classifier.stats.pairs_skipped, 10)
+
+    def test_results_shared_with_classify_through_the_cache(self):
+        first = fused.FusedClassifier(RELEVANCE_TEMPLATE).classify(CHUNKS, LABELS)
+        batches = self.pipeline.model.batches
+        self.assertEqual(fused.FusedClassifier(RELEVANCE_TEMPLATE).classify(CHUNKS, LABELS), first)
+        self.assertEqual(self.pipeline.model.batches, batches)
+
+        # The plain path finds the fused results under its own keys
+        results = models.classify([CHUNKS[0]], list(article.LABEL_TO_SCORE))
+        self.assertAlmostEqual(article.weighted_score(results[0]), first[0])
+
+    def test_retrieval_emits_scored_articles(self):
+        retrieval = ArticleRetrieval()
+        retrieval.fused_mode = 'fused'
+        retrieval.lexical_prefilter = False
+        info = {'symbol': 'NVDA', 'shortName': 'NVIDIA'}
+        relevant = retrieval.select_relevant_chunks(CHUNKS, info)
+        self.assertEqual(relevant, [CHUNKS[0], CHUNKS[2]])
+        self.assertEqual(retrieval.chunk_scores(relevant), fused.FusedClassifier(RELEVANCE_TEMPLATE).classify(
+            relevant, ['NVDA', 'NVIDIA']))
+        self.assertIsNone(retrieval.chunk_scores([CHUNKS[1]]))
+
+        # Only the most recently used scores are kept
+        retrieval.fused_score_entries = 1
+        retrieval.select_relevant_chunks(CHUNKS, info)
+        self.assertEqual(list(retrieval._fused_scores), [CHUNKS[2]])
+        self.assertIsNone(retrieval.chunk_scores(relevant))
+        self.assertIsNotNone(retrieval.chunk_scores([CHUNKS[2]]))
+
+        # A cascade scorer keeps sentiment out of the relevance pass
+        with mock.patch.object(article, '_scorer', object()):
+            self.assertIsNone(retrieval.fused_classifier)
+
+
+if __name__ == '__main__':
+    unittest.main()
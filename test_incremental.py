@@ -0,0 +1,139 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import stocks
+import storage
+from retrieval.rss_article_retrieval import RSSArticleRetrieval
+
+
+def feed(links):
+    items = ''.join(
+        f"<item><title>{link}</title><link>{link}</link><pubDate>{formatdate(time.time())}</pubDate></item>"
+        for link in links
+    )
+    return f"<?xml version='1.0'?><rss version='2.0'><channel><title>t</title>{items}</channel></rss>".encode()
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """A feed that honours If-None-Match"""
+    etag = '"v1"'
+    body = feed(['https://news.example/a', 'https://news.example/b'])
+    statuses = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == self.etag:
+            self.statuses.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.statuses.append(200)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+
+class FakeRetrieval:
+    """Checks each link it is given, every link relevant except 'quiet' ones"""
+
+    def __init__(self, links):
+        self.links = links
+        self.checked = []
+
+    def iter_checked(self, data, prefetch_window=None, skip=()):
+        for link in self.links:
+            if link not in skip:
+                self.checked.append(link)
+                yield link, link, [] if 'quiet' in link else [f"{link} chunk"]
+
+    def chunk_scores(self, chunks):
+        return None
+
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_url = f"sqlite:///{os.path.join(self.tmp.name, 'cache.db')}"
+
+    def tearDown(self):
+        stocks.configure_retrievers(stocks.DEFAULT_RETRIEVERS)
+        storage.get_engine(self.db_url).dispose()
+        self.tmp.cleanup()
+
+    def test_unchanged_feed_is_not_downloaded_again(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/feed"
+        try:
+            with mock.patch('builtins.print'):
+                first = RSSArticleRetrieval(url, db_url=self.db_url).candidates({})
+                # A new process on the next run, the feed comes from the stored state
+                second = RSSArticleRetrieval(url, db_url=self.db_url).candidates({})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(FeedHandler.statuses[-2:], [200, 304])
+        self.assertEqual([link for _, link in first], ['https://news.example/a', 'https://news.example/b'])
+        self.assertEqual(second, first)
+
+    def test_feed_polled_once_from_many_threads(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FeedHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/feed"
+        polls = len(FeedHandler.statuses)
+        try:
+            retrieval = RSSArticleRetrieval(url, db_url=None)
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                listed = list(executor.map(retrieval.candidates, [{}] * 16))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(len(FeedHandler.statuses) - polls, 1)
+        self.assertTrue(all(candidates == listed[0] for candidates in listed))
+
+    def test_rerun_only_scores_new_links(self):
+        retrieval = FakeRetrieval(['https://x/a', 'https://x/quiet', 'https://x/b'])
+        stocks.configure_retrievers([retrieval])
+        data = {'info': {'symbol': 'NVDA'}, 'news': []}
+        scored = []
+
+        def fake_score_texts(texts, batch_size):
+            scored.extend(texts)
+            return [0.5 if 'a' in text.split('/')[-1] else -0.5 for text in texts]
+
+        with mock.patch('article.score_texts', side_effect=fake_score_texts), mock.patch('builtins.print'):
+            stock = stocks.Stock('NVDA', _ticker_data=data, db_url=self.db_url, incremental=True)
+            stocks.score_stocks([stock])
+            stocks.write_sentiment([stock], self.db_url)
+
+            retrieval.links.append('https://x/ca')
+            retrieval.checked.clear()
+            scored.clear()
+            rerun = stocks.Stock('NVDA', _ticker_data=data, db_url=self.db_url, incremental=True)
+            stocks.score_stocks([rerun])
+            stocks.write_sentiment([rerun], self.db_url)
+
+        self.assertEqual(retrieval.checked, ['https://x/ca'])
+        self.assertEqual(scored, ['https://x/ca chunk'])
+        self.assertEqual(rerun.sentiment_count, 3)
+        self.assertEqual(rerun.average_sentiment, round((0.5 - 0.5 + 0.5) / 3, 3))
+        self.assertEqual(storage.sentiment_history('NVDA', db_url=self.db_url)[-1]['count'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import time
+import unittest
+
+from inference_cache import InferenceCache
+
+
+class TestInferenceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'cache.db')
+        self.cache = InferenceCache(self.path, memory_entries=2)
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def key(self, text, labels=("positive", "negative")):
+        return InferenceCache.key("model", "task", "This example is {}.", list(labels), False, text)
+
+    def test_key_normalizes_whitespace(self):
+        self.assertEqual(self.key("NVIDIA  beat\nestimates "), self.key("NVIDIA beat estimates"))
+        self.assertNotEqual(self.key("NVIDIA beat estimates"), self.key("NVIDIA beat estimates", ("up", "down")))
+
+    def test_hits_and_misses(self):
+        result = {'labels': ['positive', 'negative'], 'scores': [0.9, 0.1]}
+        self.assertEqual(self.cache.get_many([self.key("a")]), [None])
+        self.cache.put_many({self.key("a"): result})
+        self.assertEqual(self.cache.get_many([self.key("a"), self.key("b")]), [result, None])
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['memory_hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_survives_reopen(self):
+        result = {'labels': ['positive'], 'scores': [1.0]}
+        self.cache.put_many({self.key("a"): result})
+        self.cache.close()
+
+        self.cache = InferenceCache(self.path)
+        self.assertEqual(self.cache.get_many([self.key("a")]), [result])
+        self.assertEqual(self.cache.stats()['disk_hits'], 1)
+
+    def test_evicts_old_and_excess_entries(self):
+        self.cache.max_entries = 2
+        for text in ["a", "b", "c"]:
+            self.cache.put_many({self.key(text): {'labels': [], 'scores': []}})
+            time.sleep(0.01)
+        self.cache.evict()
+        self.cache._memory.clear()
+        self.assertEqual(self.cache.get_many([self.key("a")]), [None])
+        self.assertIsNotNone(self.cache.get_many([self.key("c")])[0])
+
+        self.cache.max_age = 0.001
+        time.sleep(0.01)
+        self.cache.evict()
+        self.cache._memory.clear()
+        self.assertEqual(self.cache.get_many([self.key("c")]), [None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import ingest
+
+
+class TestIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_url = f"sqlite:///{os.path.join(self.tmp.name, 'cache.db')}"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_only_misses_are_fetched(self):
+        ingest.bulk_upsert({'AAPL': {'info': {'symbol': 'AAPL'}, 'news': []}}, self.db_url)
+
+        def fake_fetch(symbol, throttle, info=None):
+            return {'info': {'symbol': symbol}, 'news': [{'title': 'fresh'}]}
+
+        with mock.patch('ingest.fetch_ticker_data', side_effect=fake_fetch) as fetch:
+            data = ingest.ingest(['NVDA', 'AAPL', 'MSFT'], self.db_url, workers=2)
+
+        self.assertEqual(sorted(call.args[0] for call in fetch.call_args_list), ['MSFT', 'NVDA'])
+        self.assertEqual(list(data), ['NVDA', 'AAPL', 'MSFT'])
+        self.assertEqual(data['AAPL']['news'], [])
+        self.assertEqual(set(ingest.load_cached(['NVDA', 'AAPL', 'MSFT'], self.db_url)), {'NVDA', 'AAPL', 'MSFT'})
+
+    def test_refresh_news_reuses_info(self):
+        ingest.bulk_upsert({'AAPL': {'info': {'symbol': 'AAPL', 'cached': True}, 'news': []}}, self.db_url)
+
+        def fake_fetch(symbol, throttle, info=None):
+            return {'info': info if info is not None else {'symbol': symbol}, 'news': [{'title': 'fresh'}]}
+
+        with mock.patch('ingest.fetch_ticker_data', side_effect=fake_fetch):
+            data = ingest.ingest(['AAPL'], self.db_url, refresh_news=True)
+
+        self.assertTrue(data['AAPL']['info']['cached'])
+        self.assertEqual(ingest.load_cached(['AAPL'], self.db_url)['AAPL']['news'], [{'title': 'fresh'}])
+
+    def test_throttle_backs_off_and_recovers(self):
+        throttle = ingest.AdaptiveThrottle(initial_backoff=1.0, backoff=2.0, recovery=0.5)
+        throttle.rate_limited()
+        throttle.rate_limited()
+        self.assertEqual(throttle.delay, 2.0)
+        throttle.success()
+        self.assertEqual(throttle.delay, 1.0)
+        self.assertTrue(ingest.is_rate_limited(Exception("429 Client Error: Too Many Requests")))
+        self.assertFalse(ingest.is_rate_limited(KeyError('symbol')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.enabled = mock.patch.object(metrics, '_enabled', True)
+        self.enabled.start()
+        metrics.get_metrics().reset()
+
+    def tearDown(self):
+        self.enabled.stop()
+        metrics.get_metrics().reset()
+
+    def test_disabled_records_nothing(self):
+        with mock.patch.object(metrics, '_enabled', False):
+            metrics.inc('pages_fetched_total', domain='example.com')
+            metrics.observe('fetch_seconds', 0.2)
+            with metrics.timer('chunk_seconds'):
+                pass
+            self.assertIsNone(metrics.drain())
+        self.assertEqual(metrics.get_metrics().snapshot(), {'counters': [], 'histograms': []})
+
+    def test_counters_and_histograms_by_label(self):
+        metrics.inc('pages_fetched_total', domain='a.com', outcome='ok')
+        metrics.inc('pages_fetched_total', domain='a.com', outcome='ok')
+        metrics.inc('pages_fetched_total', domain='b.com', outcome='error')
+        for value in (0.002, 0.02, 0.2, 0.3):
+            metrics.observe('fetch_seconds', value, domain='a.com')
+        metrics.observe('fetch_seconds', 4.0, domain='b.com')
+
+        summary = metrics.get_metrics().summary()
+        pages = summary['counters']['pages_fetched_total']
+        self.assertEqual(pages['total'], 3)
+        self.assertEqual(pages['by_label']['domain'], {'a.com': 2, 'b.com': 1})
+        self.assertEqual(pages['by_label']['outcome'], {'ok': 2, 'error': 1})
+
+        fetch = summary['histograms']['fetch_seconds']
+        self.assertEqual(fetch['count'], 5)
+        self.assertAlmostEqual(fetch['sum'], 4.522)
+        self.assertTrue(0.01 <= fetch['p50'] <= 0.25)
+        self.assertTrue(2.5 <= fetch['p95'] <= 5.0)
+        # The slowest domain comes first
+        self.assertEqual(list(fetch['slowest']['domain']), ['b.com', 'a.com'])
+
+    def test_prometheus_text(self):
+        metrics.inc('errors_total', stage='fetch')
+        metrics.observe('fetch_seconds', 0.03, domain='a.com')
+        text = metrics.get_metrics().prometheus_text()
+        self.assertIn('# TYPE errors_total counter\nerrors_total{stage="fetch"} 1\n', text)
+        self.assertIn('# TYPE fetch_seconds histogram', text)
+        self.assertIn('fetch_seconds_bucket{domain="a.com",le="0.025"} 0', text)
+        self.assertIn('fetch_seconds_bucket{domain="a.com",le="0.05"} 1', text)
+        self.assertIn('fetch_seconds_bucket{domain="a.com",le="+Inf"} 1', text)
+        self.assertIn('fetch_seconds_sum{domain="a.com"} 0.03', text)
+        self.assertIn('fetch_seconds_count{domain="a.com"} 1', text)
+
+    def test_timer_counts_errors(self):
+        with self.assertRaises(ValueError):
+            with metrics.timer('relevance_seconds', source='YahooFinance'):
+                raise ValueError()
+        counters = dict(metrics.get_metrics().snapshot()['counters'])
+        self.assertEqual(counters[('errors_total', (('source', 'YahooFinance'), ('stage', 'relevance')))], 1)
+        self.assertEqual(metrics.get_metrics().summary()['histograms']['relevance_seconds']['count'], 1)
+
+    def test_relevance_errors_counted_once(self):
+        from retrieval.article_retrieval import ArticleRetrieval
+
+        retrieval = ArticleRetrieval()
+        with mock.patch.object(retrieval, '_select', side_effect=RuntimeError('model failed')):
+            self.assertEqual(retrieval.select_relevant_chunks(['NVIDIA rose'], {'symbol': 'NVDA'}), [])
+        errors = {labels: value for (name, labels), value in metrics.get_metrics().snapshot()['counters']
+                  if name == 'errors_total'}
+        self.assertEqual(errors, {(('source', retrieval.source), ('stage', 'relevance')): 1})
+
+    def test_drain_and_merge(self):
+        metrics.inc('chunks_total', 3)
+        metrics.observe('chunk_seconds', 0.01)
+        snapshot = metrics.drain()
+        self.assertEqual(metrics.get_metrics().snapshot(), {'counters': [], 'histograms': []})
+
+        # As the parent does with each worker's snapshot
+        metrics.inc('chunks_total', 2)
+        metrics.merge(snapshot)
+        metrics.merge(snapshot)
+        summary = metrics.get_metrics().summary()
+        self.assertEqual(summary['counters']['chunks_total']['total'], 8)
+        self.assertEqual(summary['histograms']['chunk_seconds']['count'], 2)
+
+    def test_write_outputs(self):
+        metrics.inc('chunks_total', 2)
+        with tempfile.TemporaryDirectory() as tmp:
+            metrics.write_summary(os.path.join(tmp, 'run.json'))
+            metrics.write_prometheus(os.path.join(tmp, 'run.prom'))
+            with open(os.path.join(tmp, 'run.json')) as f:
+                self.assertEqual(json.load(f)['counters']['chunks_total']['total'], 2)
+            with open(os.path.join(tmp, 'run.prom')) as f:
+                self.assertIn('chunks_total 2', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from retrieval.article_store import ArticleStore
+from retrieval.page_cache import PageCache
+
+PAGE = "<html><body>" + "<p>NVIDIA shares rose after earnings.</p>" * 200 + "</body></html>"
+
+
+class TestPageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'pages.db')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_memory_ceiling(self):
+        size = sys.getsizeof(PAGE)
+        cache = PageCache(path=None, memory_bytes=size * 3)
+        for i in range(10):
+            cache.put(f"https://x/{i}", PAGE)
+
+        self.assertLessEqual(cache.memory_size, size * 3)
+        self.assertEqual(cache.stats.evictions, 7)
+        self.assertIsNone(cache.get('https://x/0'))
+        self.assertEqual(cache.get('https://x/9'), PAGE)
+
+    def test_disk_tier_survives_restart_compressed(self):
+        cache = PageCache(self.path, memory_bytes=1)
+        cache.put('https://x/a', PAGE)
+        self.assertGreater(cache.stats.bytes_saved, len(PAGE) // 2)
+        cache.close()
+
+        reopened = PageCache(self.path)
+        self.assertEqual(reopened.get('https://x/a'), PAGE)
+        self.assertEqual(reopened.get('https://x/a'), PAGE)
+        self.assertEqual((reopened.stats.disk_hits, reopened.stats.memory_hits), (1, 1))
+        self.assertEqual(reopened.cached(['https://x/a', 'https://x/b']), {'https://x/a'})
+        reopened.close()
+
+    def test_domain_ttls(self):
+        cache = PageCache(self.path, default_ttl=60, domain_ttls={'google.com': 0.05})
+        self.assertEqual(cache.ttl('https://www.google.com/search?q=NVDA'), 0.05)
+        self.assertEqual(cache.ttl('https://news.example/a'), 60)
+
+        cache.put('https://www.google.com/search?q=NVDA', PAGE)
+        cache.put('https://news.example/a', PAGE)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('https://www.google.com/search?q=NVDA'))
+        self.assertEqual(cache.get('https://news.example/a'), PAGE)
+        cache.close()
+
+    def test_disk_eviction_by_size(self):
+        cache = PageCache(self.path, memory_bytes=1, disk_bytes=1, evict_every=1)
+        cache.put('https://x/a', PAGE)
+        cache.put('https://x/b', PAGE + ' ')
+        self.assertIsNone(cache.get('https://x/a'))
+        self.assertGreater(cache.stats.disk_evictions, 0)
+        cache.close()
+
+    def test_store_keeps_text_instead_of_html(self):
+        fetched = []
+
+        def fetch(url):
+            fetched.append(url)
+            return PAGE
+
+        def process(html):
+            return 'nvidia shares rose', ['nvidia shares rose']
+
+        def process_text(text):
+            return text, [text]
+
+        cache = PageCache(self.path)
+        store = ArticleStore(cache, store_text=True)
+        page = store.get_page('https://x/a', fetch, process, process_text)
+        self.assertEqual(page.chunks, ['nvidia shares rose'])
+        self.assertIsNone(cache.get('https://x/a'))
+        cache.close()
+
+        # Next run: text comes from disk, nothing is fetched
+        rerun = ArticleStore(PageCache(self.path), store_text=True)
+        self.assertEqual(rerun.missing(['https://x/a', 'https://x/b']), ['https://x/b'])
+        page = rerun.get_page('https://x/a', fetch, process, process_text)
+        self.assertEqual(page.chunks, ['nvidia shares rose'])
+        self.assertEqual(fetched, ['https://x/a'])
+        rerun.page_cache.close()
+
+    def test_store_evicts_processed_pages(self):
+        processed = []
+
+        def process(html):
+            processed.append(html)
+            return html, [html]
+
+        size = sys.getsizeof(PAGE) * 2
+        store = ArticleStore(PageCache(path=None), memory_bytes=size * 3)
+        for i in range(5):
+            store.get_page(f"https://x/{i}", lambda url: PAGE, process)
+        self.assertLessEqual(store.memory_size, size * 3)
+        self.assertEqual(store.stats.evictions, 2)
+        self.assertTrue(store.peek('https://x/0').evicted)
+        self.assertIsNone(store.peek('https://x/0').chunks)
+        self.assertEqual(store.peek('https://x/4').chunks, [PAGE])
+
+        # An evicted page is processed again from the cached HTML, without fetching
+        page = store.get_page('https://x/0', self.fail, process)
+        self.assertEqual((page.chunks, page.evicted), ([PAGE], False))
+        self.assertEqual((len(processed), store.stats.fetches), (6, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
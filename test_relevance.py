@@ -0,0 +1,50 @@
+import unittest
+
+from retrieval.relevance import LexicalMatcher, RelevanceStats, core_name
+from test_articles_data import TEST_ARTICLES
+
+NVDA_INFO = {'symbol': 'NVDA', 'shortName': 'NVIDIA Corporation', 'longName': 'NVIDIA Corporation'}
+AAPL_INFO = {'symbol': 'AAPL', 'shortName': 'Apple Inc.', 'longName': 'Apple Inc.'}
+
+
+class TestLexicalPrefilter(unittest.TestCase):
+
+    def test_core_name(self):
+        self.assertEqual(core_name('NVIDIA Corporation'), 'NVIDIA')
+        self.assertEqual(core_name('Apple Inc.'), 'Apple')
+        self.assertEqual(core_name('JPMorgan Chase & Co.'), 'JPMorgan Chase')
+
+    def test_test_articles_split_by_company(self):
+        # The retrieval path lowercases text before matching
+        for info, own, other in [(NVDA_INFO, 'NVDA', 'AAPL'), (AAPL_INFO, 'AAPL', 'NVDA')]:
+            matcher = LexicalMatcher(info)
+            for title, url, content in TEST_ARTICLES[own]:
+                self.assertTrue(matcher.matches(content.lower()), url)
+            for title, url, content in TEST_ARTICLES[other]:
+                self.assertFalse(matcher.matches(content.lower()), url)
+
+    def test_ambiguous_symbol_needs_cashtag_or_name(self):
+        matcher = LexicalMatcher({'symbol': 'ON', 'shortName': 'ON Semiconductor Corporation'})
+        self.assertFalse(matcher.matches("shares moved on the news"))
+        self.assertTrue(matcher.matches("traders piled into $ON after hours"))
+        self.assertTrue(matcher.matches("nasdaq: on rallied"))
+        self.assertTrue(matcher.matches("on semiconductor raised guidance"))
+
+    def test_symbol_word_boundaries_and_case(self):
+        matcher = LexicalMatcher({'symbol': 'NVDA', 'shortName': 'NVIDIA Corporation'}, case_sensitive_symbols=True)
+        self.assertTrue(matcher.matches("NVDA closed higher"))
+        self.assertFalse(matcher.matches("nvda closed higher"))
+        self.assertFalse(matcher.matches("NVDAX is a fund"))
+
+    def test_aliases(self):
+        matcher = LexicalMatcher({'symbol': 'XYZ', 'shortName': 'Block, Inc.'}, aliases=['Square', 'Cash App'])
+        self.assertTrue(matcher.matches("cash app users grew"))
+
+    def test_stats(self):
+        stats = RelevanceStats(chunks=10, lexical_rejects=7, candidates=3, relevant=2, model_calls=1)
+        self.assertAlmostEqual(stats.reject_rate, 0.7)
+        self.assertEqual(stats.model_calls_saved, 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import inference_cache
+import models
+import stocks
+import storage
+from retrieval import article_store
+from retrieval.article_retrieval import ArticleRetrieval
+from retrieval.article_store import ArticleStore
+from retrieval.page_cache import PageCache
+from runner import StageSizes, StagedRunner
+from test_articles_data import TEST_ARTICLES
+
+INFOS = {
+    'NVDA': {'symbol': 'NVDA', 'shortName': 'NVIDIA Corporation'},
+    'AAPL': {'symbol': 'AAPL', 'shortName': 'Apple Inc.'},
+}
+
+
+def page(title, content):
+    paragraphs = ''.join(f"<p>{line}</p>" for line in content.split('\n') if line.strip())
+    return f"<html><head><title>{title}</title></head><body><article>{paragraphs}</article></body></html>"
+
+
+PAGES = {url: page(title, content) for articles in TEST_ARTICLES.values() for title, url, content in articles}
+PAGES['https://test.com/weather'] = page("Weather", "Rain is expected across the region later this week. " * 20)
+
+
+class FakeRetrieval(ArticleRetrieval):
+    """Each stock's fixture articles plus every other stock's and a page about neither, served from memory"""
+
+    # Links that turn up later in the day
+    later = []
+
+    def candidates(self, data):
+        symbol = data['info']['symbol']
+        own = [(title, url) for title, url, _ in TEST_ARTICLES[symbol]]
+        others = [(title, url) for other, articles in TEST_ARTICLES.items() if other != symbol
+                  for title, url, _ in articles]
+        # The same page again with URL arguments is one article
+        return own + others + [('Weather', 'https://test.com/weather'), (own[0][0], own[0][1] + '?utm=feed')] + \
+            self.later
+
+    def prefetch(self, links):
+        for link in self.article_store.missing(links):
+            self.article_store.put_html(link, self._fetch_page(link))
+
+    def _fetch_page(self, url):
+        return PAGES[url.split('?')[0]]
+
+
+class TestStagedRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        # Model workers are spawned, so they need the stub backend from the environment, and no
+        # inference cache so each run's workers score for themselves
+        self.environ = mock.patch.dict(os.environ, {'SENTIMENT_BACKEND': 'stub', 'INFERENCE_CACHE': ''})
+        self.environ.start()
+        self.shared_cache = mock.patch.multiple(inference_cache, _cache=None, _enabled=False)
+        self.shared_cache.start()
+        self.settings = mock.patch.dict(models._settings, backend='stub')
+        self.settings.start()
+        self.runs = 0
+
+    def tearDown(self):
+        self.settings.stop()
+        self.shared_cache.stop()
+        self.environ.stop()
+        models.registry.unload(backend='stub')
+        stocks.configure_retrievers(stocks.DEFAULT_RETRIEVERS)
+        FakeRetrieval.later = []
+        self.tmp.cleanup()
+
+    def fresh_run(self):
+        """A database with today's ticker data, and a run store and retriever that have seen nothing."""
+        self.runs += 1
+        db_url = f"sqlite:///{os.path.join(self.tmp.name, f'run{self.runs}.db')}"
+        storage.upsert_ticker_data({symbol: {'info': info, 'news': []} for symbol, info in INFOS.items()},
+                                   db_url=db_url)
+        store = mock.patch.object(article_store, '_store', ArticleStore(PageCache(path=None)))
+        store.start()
+        self.addCleanup(store.stop)
+        self.addCleanup(storage.get_engine(db_url).dispose)
+        stocks.configure_retrievers([FakeRetrieval()])
+        return db_url
+
+    def stored(self, db_url):
+        """What a run wrote: each symbol's count and average, and its articles with their chunk scores."""
+        journal = storage.load_journal(list(INFOS), db_url=db_url)
+        return {
+            symbol: (storage.sentiment_history(symbol, db_url=db_url)[-1],
+                     sorted((a['link'], a['title'], a['chunks'], a['chunk_scores']) for a in journal[symbol]['articles']))
+            for symbol in INFOS
+        }
+
+    def serial(self, db_url=None, incremental=False):
+        db_url = db_url or self.fresh_run()
+        run = {symbol: stocks.Stock(symbol, db_url=db_url, incremental=incremental) for symbol in INFOS}
+        stocks.score_stocks(run.values())
+        stocks.write_sentiment(run.values(), db_url)
+        return self.stored(db_url)
+
+    def staged(self, sizes, db_url=None, incremental=False):
+        db_url = db_url or self.fresh_run()
+        StagedRunner(sizes, db_url=db_url, incremental=incremental).run(list(INFOS))
+        return self.stored(db_url)
+
+    def test_matches_serial_path(self):
+        expected = self.serial()
+        # Something relevant was found, and the URL with arguments wasn't counted again
+        for symbol, (sentiment, articles) in expected.items():
+            self.assertGreater(sentiment['count'], 0, symbol)
+            self.assertEqual(len({link for link, *_ in articles}), len(articles), symbol)
+
+        self.assertEqual(self.staged(StageSizes(ingest=0, fetch=0, extract=0, relevance=0, sentiment=0)), expected)
+        self.assertEqual(self.staged(StageSizes(ingest=1, fetch=2, extract=1, relevance=1, sentiment=2,
+                                                torch_threads=1)), expected)
+
+    def test_incremental_rerun_matches_serial_path(self):
+        inline = StageSizes(ingest=0, fetch=0, extract=0, relevance=0, sentiment=0)
+        first_serial = self.serial(incremental=True)
+        serial_db = f"sqlite:///{os.path.join(self.tmp.name, f'run{self.runs}.db')}"
+        first_staged = self.staged(inline, incremental=True)
+        staged_db = f"sqlite:///{os.path.join(self.tmp.name, f'run{self.runs}.db')}"
+        self.assertEqual(first_staged, first_serial)
+
+        # Later that day, a new page mentioning NVIDIA and a page about neither
+        PAGES['https://test.com/nvidia-later'] = page("NVIDIA later", TEST_ARTICLES['NVDA'][0][2])
+        PAGES['https://test.com/later-weather'] = PAGES['https://test.com/weather']
+        self.addCleanup(PAGES.pop, 'https://test.com/nvidia-later')
+        self.addCleanup(PAGES.pop, 'https://test.com/later-weather')
+        FakeRetrieval.later = [('NVIDIA later', 'https://test.com/nvidia-later'),
+                               ('Weather later', 'https://test.com/later-weather')]
+
+        stocks.configure_retrievers([FakeRetrieval()])
+        expected = self.serial(serial_db, incremental=True)
+        self.assertIn('https://test.com/nvidia-later', [link for link, *_ in expected['NVDA'][1]])
+        store = ArticleStore(PageCache(path=None))
+        with mock.patch.object(article_store, '_store', store):
+            stocks.configure_retrievers([FakeRetrieval()])
+            self.assertEqual(self.staged(inline, staged_db, incremental=True), expected)
+        # Only the new links were fetched
+        later = {link for _, link in FakeRetrieval.later}
+        self.assertEqual(set(store.missing(list(PAGES))), set(PAGES) - later)
+        self.assertEqual(storage.load_journal(['NVDA'], db_url=staged_db)['NVDA']['seen'],
+                         storage.load_journal(['NVDA'], db_url=serial_db)['NVDA']['seen'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,18 @@
+import unittest
+
+from benchmarks.startup import measure
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_import_stocks_is_side_effect_free(self):
+        result = measure('stocks')
+        self.assertEqual(result['heavy'], [], "Importing stocks pulled in heavy modules")
+
+    def test_import_main_is_side_effect_free(self):
+        result = measure('main')
+        self.assertEqual(result['heavy'], [], "Importing main pulled in heavy modules")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+from datetime import date
+
+from sqlalchemy import text
+
+import storage
+
+
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_url = f"sqlite:///{os.path.join(self.tmp.name, 'cache.db')}"
+
+    def tearDown(self):
+        storage.get_engine(self.db_url).dispose()
+        self.tmp.cleanup()
+
+    def test_wal_mode(self):
+        with storage.get_engine(self.db_url).connect() as connection:
+            self.assertEqual(connection.execute(text('PRAGMA journal_mode')).scalar(), 'wal')
+
+    def test_ticker_data_round_trip(self):
+        day = date(2024, 11, 20)
+        news = [{'uuid': 'a', 'title': 'First', 'link': 'https://x/a', 'providerPublishTime': 1},
+                {'uuid': 'b', 'title': 'Second', 'link': 'https://x/b', 'providerPublishTime': 2}]
+        storage.upsert_ticker_data({'NVDA': {'info': {'symbol': 'NVDA'}, 'news': news}}, day, self.db_url)
+        # Refreshed news replaces the old list
+        storage.upsert_ticker_data({'NVDA': {'info': {'symbol': 'NVDA'}, 'news': news[1:]}}, day, self.db_url)
+
+        loaded = storage.load_ticker_data(['NVDA', 'AAPL'], day, self.db_url)
+        self.assertEqual(list(loaded), ['NVDA'])
+        self.assertEqual(loaded['NVDA']['info'], {'symbol': 'NVDA'})
+        self.assertEqual(loaded['NVDA']['news'], news[1:])
+
+        # Including when the feed is now empty
+        storage.upsert_ticker_data({'NVDA': {'info': {'symbol': 'NVDA'}, 'news': []}}, day, self.db_url)
+        self.assertEqual(storage.load_ticker_data(['NVDA'], day, self.db_url)['NVDA']['news'], [])
+
+    def test_sentiment_and_history(self):
+        for day, average in [(date(2024, 1, 1), 0.1), (date(2024, 1, 2), -0.2), (date(2024, 1, 3), 0.3)]:
+            storage.save_sentiment({
+                'NVDA': {'count': 1, 'average': average, 'articles': [
+                    {'link': 'https://x/a', 'title': 'A', 'chunks': ['one', 'two'], 'chunk_scores': [0.5, -0.3]}
+                ]},
+                'AAPL': {'count': 0, 'average': 0, 'articles': []},
+            }, day, self.db_url)
+
+        history = storage.sentiment_history('NVDA', date(2024, 1, 2), date(2024, 1, 3), self.db_url)
+        self.assertEqual([(row['date'], row['average']) for row in history],
+                         [(date(2024, 1, 2), -0.2), (date(2024, 1, 3), 0.3)])
+
+        with storage.get_session(self.db_url) as session:
+            self.assertEqual(session.query(storage.ChunkScore).count(), 6)
+            record = session.query(storage.ArticleRecord).first()
+            self.assertAlmostEqual(record.sentiment, 0.1)
+
+    def test_same_day_rewrite_replaces_articles(self):
+        day = date(2024, 1, 1)
+        first = {'link': 'https://x/u1', 'title': 'U1', 'chunks': ['a', 'b', 'c'], 'chunk_scores': [0.1, 0.2, 0.3]}
+        second = {'link': 'https://x/u2', 'title': 'U2', 'chunks': ['d'], 'chunk_scores': [0.4]}
+        storage.save_sentiment({'NVDA': {'count': 2, 'average': 0.25, 'articles': [first, second]}}, day, self.db_url)
+        rescored = {'link': 'https://x/u1', 'title': 'U1', 'chunks': ['a'], 'chunk_scores': [0.1]}
+        storage.save_sentiment({'NVDA': {'count': 1, 'average': 0.1, 'articles': [rescored]}}, day, self.db_url)
+
+        journal = storage.load_journal(['NVDA'], day, self.db_url)['NVDA']
+        self.assertEqual(journal['articles'], [rescored])
+        # Links checked earlier that day stay seen
+        self.assertEqual(journal['seen'], {'https://x/u1', 'https://x/u2'})
+
+    def test_migrate_legacy_cache(self):
+        day = date(2024, 11, 20)
+        with storage.get_session(self.db_url) as session:
+            session.add(storage.TickerCache(symbol='NVDA', date=day, data={
+                'info': {'symbol': 'NVDA'}, 'news': [], 'sentiment': {'count': 2, 'average': 0.25}
+            }))
+            session.commit()
+
+        self.assertEqual(storage.migrate_legacy_cache(self.db_url), 1)
+        self.assertIn('NVDA', storage.load_ticker_data(['NVDA'], day, self.db_url))
+        self.assertEqual(storage.sentiment_history('NVDA', db_url=self.db_url)[0]['average'], 0.25)
+
+
+if __name__ == '__main__':
+    unittest.main()
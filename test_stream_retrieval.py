@@ -0,0 +1,203 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import models
+import storage
+from retrieval import tagger
+from retrieval.article_store import ArticleStore
+from retrieval.page_cache import PageCache
+from retrieval.reddit_article_retrieval import RedditArticleRetrieval
+from retrieval.twitter_article_retrieval import TwitterArticleRetrieval
+
+NVDA_INFO = {'symbol': 'NVDA', 'shortName': 'NVIDIA Corporation'}
+AAPL_INFO = {'symbol': 'AAPL', 'shortName': 'Apple Inc.'}
+
+
+class StandIn:
+    """Newest-first reddit listings and twitter recent search, paged the way the real APIs page"""
+
+    def __init__(self):
+        self.posts = []
+        self.tweets = []
+        self.requests = []
+
+    def add_post(self, text, selftext='Long read below.'):
+        number = len(self.posts) + 1
+        self.posts.insert(0, {'kind': 't3', 'data': {
+            'name': f"t3_{number}", 'title': text, 'selftext': selftext,
+            'permalink': f"/r/stocks/comments/{number}/post/", 'created_utc': time.time() - 60 + number,
+        }})
+
+    def add_tweet(self, text):
+        self.tweets.insert(0, {'id': str(1000 + len(self.tweets)), 'text': text,
+                               'created_at': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())})
+
+    def listing(self, params):
+        limit = int(params.get('limit', 25))
+        posts = self.posts
+        if 'before' in params:
+            # The page of posts just newer than the cursor
+            names = [post['data']['name'] for post in posts]
+            newer = posts[:names.index(params['before'])]
+            posts = newer[-limit:]
+        return {'data': {'children': posts[:limit]}}
+
+    def search(self, params):
+        limit = int(params.get('max_results', 10))
+        tweets = [t for t in self.tweets if int(t['id']) > int(params.get('since_id', 0))]
+        offset = int(params.get('next_token', 0))
+        page = tweets[offset:offset + limit]
+        meta = {'result_count': len(page)}
+        if offset + limit < len(tweets):
+            meta['next_token'] = str(offset + limit)
+        return {'data': page, 'meta': meta} if page else {'meta': meta}
+
+    def __enter__(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                stand_in.requests.append((url.path, params, dict(self.headers)))
+                if url.path.endswith('/new.json'):
+                    body = stand_in.listing(params)
+                elif url.path == '/2/tweets/search/recent':
+                    if self.headers.get('Authorization') != 'Bearer token':
+                        self.send_error(401)
+                        return
+                    body = stand_in.search(params)
+                else:
+                    self.send_error(404)
+                    return
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_url = f"sqlite:///{os.path.join(self.tmp.name, 'streams.db')}"
+        self.api = StandIn().__enter__()
+        # Chunked with the stub tokenizer, needing no model
+        self.settings = mock.patch.dict(models._settings, backend='stub')
+        self.settings.start()
+
+    def tearDown(self):
+        self.settings.stop()
+        models.registry.unload(backend='stub')
+        self.api.__exit__()
+        storage.get_engine(self.db_url).dispose()
+        self.tmp.cleanup()
+
+    def retrieval(self, cls, *args, **kwargs):
+        retrieval = cls(*args, base_url=self.api.base_url, requests_per_second=0, db_url=self.db_url, **kwargs)
+        retrieval.article_store = ArticleStore(PageCache(path=None))
+        return retrieval
+
+
+class TestRedditStream(StreamTestCase):
+
+    def test_only_new_posts_fetched(self):
+        for i in range(3):
+            self.api.add_post(f"$NVDA thoughts {i}")
+        reddit = self.retrieval(RedditArticleRetrieval, ['stocks'])
+        reddit.page_size = 2
+        self.assertEqual(len(reddit.poll()), 2)
+        self.assertNotIn('before', self.api.requests[-1][1])
+
+        for i in range(3):
+            self.api.add_post(f"Apple update {i}")
+        self.api.requests.clear()
+        new = reddit.poll(force=True)
+        self.assertEqual(sorted(post.title for post in new), ['Apple update 0', 'Apple update 1', 'Apple update 2'])
+        self.assertEqual([params['before'] for _, params, _ in self.api.requests], ['t3_3', 't3_5'])
+        self.assertEqual(reddit.poll(force=True), [])
+
+    def test_polled_once_for_every_stock(self):
+        self.api.add_post("Bought more $NVDA today")
+        self.api.add_post("Apple earnings thread")
+        self.api.add_post("Link post", selftext='')
+        reddit = self.retrieval(RedditArticleRetrieval, ['stocks', 'investing'])
+        self.assertEqual([title for title, _ in reddit.candidates({'info': NVDA_INFO})], ['Bought more $NVDA today'])
+        self.assertEqual([title for title, _ in reddit.candidates({'info': AAPL_INFO})], ['Apple earnings thread'])
+        self.assertEqual(len(self.api.requests), 2)
+        # Posts are pages already, with nothing to fetch
+        link = reddit.candidates({'info': NVDA_INFO})[0][1]
+        self.assertEqual(reddit.article_store.missing([link]), [])
+
+    def test_routed_by_tagger_to_articles(self):
+        self.api.add_post("NVIDIA and $AAPL both moved")
+        self.api.add_post("Nothing about either")
+        tagger.configure([NVDA_INFO, AAPL_INFO])
+        try:
+            reddit = self.retrieval(RedditArticleRetrieval, ['stocks'])
+            articles = reddit.fetch_data({'info': NVDA_INFO})
+            self.assertEqual([a.title for a in articles], ['NVIDIA and $AAPL both moved'])
+            self.assertEqual(articles[0].link, 'https://www.reddit.com/r/stocks/comments/1/post/')
+            self.assertEqual(len(reddit.fetch_data({'info': AAPL_INFO})), 1)
+        finally:
+            tagger.configure(None)
+
+    def test_cursor_and_posts_kept_between_runs(self):
+        self.api.add_post("$NVDA thoughts")
+        self.retrieval(RedditArticleRetrieval, ['stocks']).poll()
+
+        self.api.requests.clear()
+        reddit = self.retrieval(RedditArticleRetrieval, ['stocks'])
+        self.assertEqual(reddit.poll(), [])
+        self.assertEqual(self.api.requests[0][1]['before'], 't3_1')
+        self.assertEqual(len(reddit.candidates({'info': NVDA_INFO})), 1)
+
+
+class TestTwitterStream(StreamTestCase):
+
+    def test_since_id_and_next_token(self):
+        for i in range(3):
+            self.api.add_tweet(f"$NVDA {i}")
+        twitter = self.retrieval(TwitterArticleRetrieval, ['has:cashtags'], bearer_token='token')
+        twitter.page_size = 2
+        self.assertEqual(len(twitter.poll()), 2)
+
+        for i in range(3):
+            self.api.add_tweet(f"$AAPL {i}")
+        self.api.requests.clear()
+        new = twitter.poll(force=True)
+        self.assertEqual(sorted(post.text for post in new), ['$AAPL 0', '$AAPL 1', '$AAPL 2'])
+        self.assertEqual([params.get('since_id') for _, params, _ in self.api.requests], ['1002', '1002'])
+        self.assertEqual(self.api.requests[1][1]['next_token'], '2')
+        self.assertEqual([title for title, _ in twitter.candidates({'info': AAPL_INFO})],
+                         ['$AAPL 2', '$AAPL 1', '$AAPL 0'])
+
+    def test_needs_a_token(self):
+        with mock.patch.dict(os.environ, {'TWITTER_BEARER_TOKEN': ''}):
+            with self.assertRaises(ValueError):
+                TwitterArticleRetrieval(base_url=self.api.base_url, db_url=None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import streaming
+
+
+class FakeRetrieval:
+    def __init__(self, links, delay=0.0, fail_after=None):
+        self.links = links
+        self.delay = delay
+        self.fail_after = fail_after
+        self.produced = 0
+
+    def iter_checked(self, data, skip=()):
+        for i, link in enumerate(self.links):
+            if self.fail_after is not None and i == self.fail_after:
+                raise RuntimeError('feed went away')
+            if link in skip:
+                continue
+            time.sleep(self.delay)
+            self.produced += 1
+            yield link, link, [f"{data['info']['symbol']} {link}"] if not link.startswith('irrelevant') else []
+
+    def chunk_scores(self, chunks):
+        return None
+
+
+def fake_stock(symbol, retrievers):
+    return SimpleNamespace(symbol=symbol, retrieval_classes=retrievers, _ticker_data={'info': {'symbol': symbol}},
+                           _articles=None, _checked=[], incremental=False, db_url=None)
+
+
+class TestStreaming(unittest.TestCase):
+
+    def test_slow_feed_does_not_block_fast_one(self):
+        slow = FakeRetrieval(['slow-1'], delay=0.5)
+        fast = FakeRetrieval([f"fast-{i}" for i in range(5)])
+        start = time.perf_counter()
+        first = None
+        order = []
+        for _, item in streaming.stream_articles([fake_stock('NVDA', [slow, fast])]):
+            first = first or time.perf_counter() - start
+            order.append(item.link)
+
+        self.assertLess(first, 0.4)
+        self.assertEqual(order[-1], 'slow-1')
+
+    def test_dedup_per_stock_and_articles_kept(self):
+        a = FakeRetrieval(['x', 'y', 'irrelevant'])
+        b = FakeRetrieval(['y', 'z'])
+        nvda, aapl = fake_stock('NVDA', [a, b]), fake_stock('AAPL', [a])
+        pairs = list(streaming.stream_articles([nvda, aapl]))
+
+        self.assertEqual(sorted(item.link for stock, item in pairs if stock is nvda), ['x', 'y', 'z'])
+        self.assertEqual(sorted(item.link for stock, item in pairs if stock is aapl), ['x', 'y'])
+        self.assertEqual(sorted(item.link for item in nvda._articles), ['x', 'y', 'z'])
+        self.assertEqual(nvda._checked, ['irrelevant'])
+
+    def test_bounded_queue_holds_producers_back(self):
+        retrieval = FakeRetrieval([str(i) for i in range(50)])
+        stream = streaming.stream_articles([fake_stock('NVDA', [retrieval])], maxsize=4)
+        next(stream)
+        time.sleep(0.2)
+        # One taken, up to maxsize queued and one blocked on put
+        self.assertLessEqual(retrieval.produced, 1 + 4 + 1)
+        stream.close()
+
+    def test_stopping_early_stops_producers(self):
+        retrieval = FakeRetrieval([str(i) for i in range(1000)])
+        stream = streaming.merge_streams([('feed', lambda: retrieval.iter_checked({'info': {'symbol': 'X'}}))],
+                                         maxsize=2)
+        next(stream)
+        stream.close()
+        produced = retrieval.produced
+        time.sleep(0.2)
+        self.assertEqual(retrieval.produced, produced)
+
+    def test_failing_feed_ends_only_its_stream(self):
+        broken = FakeRetrieval(['a', 'b'], fail_after=1)
+        healthy = FakeRetrieval(['c', 'd'])
+        with mock.patch('builtins.print'):
+            links = sorted(item.link for _, item in
+                           streaming.stream_articles([fake_stock('NVDA', [broken, healthy])]))
+        self.assertEqual(links, ['a', 'c', 'd'])
+
+    def test_scored_in_batches_as_they_arrive(self):
+        retrieval = FakeRetrieval([str(i) for i in range(5)])
+        calls = []
+
+        def fake_score_texts(texts, batch_size):
+            calls.append(len(texts))
+            return [0.5] * len(texts)
+
+        with mock.patch('article.score_texts', side_effect=fake_score_texts):
+            scored = list(streaming.stream_scored([fake_stock('NVDA', [retrieval])], batch_size=2))
+
+        self.assertEqual(len(scored), 5)
+        self.assertTrue(all(item.chunk_scores == [0.5] for _, item in scored))
+        self.assertEqual(calls, [2, 2, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
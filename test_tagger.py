@@ -0,0 +1,140 @@
+import unittest
+
+from retrieval import tagger
+from retrieval.article_retrieval import ArticleRetrieval
+from retrieval.article_store import ArticleStore
+from retrieval.extraction import Extraction
+from retrieval.page_cache import PageCache
+from retrieval.relevance import LexicalMatcher
+from retrieval.tagger import TickerTagger, _Automaton
+from test_articles_data import TEST_ARTICLES
+
+UNIVERSE = [
+    {'symbol': 'NVDA', 'shortName': 'NVIDIA Corporation', 'longName': 'NVIDIA Corporation'},
+    {'symbol': 'AAPL', 'shortName': 'Apple Inc.', 'longName': 'Apple Inc.'},
+    {'symbol': 'BRK.B', 'shortName': 'Berkshire Hathaway Inc.'},
+    {'symbol': 'ON', 'shortName': 'ON Semiconductor Corporation'},
+    {'symbol': 'IT', 'shortName': 'Gartner, Inc.'},
+    {'symbol': 'A', 'shortName': 'Agilent Technologies, Inc.'},
+    {'symbol': 'ALL', 'shortName': 'The Allstate Corporation'},
+]
+
+
+class TestAutomaton(unittest.TestCase):
+
+    def test_overlapping_patterns(self):
+        automaton = _Automaton()
+        for pattern in ('he', 'she', 'his', 'hers'):
+            automaton.add(pattern, pattern)
+        automaton.build()
+        self.assertEqual(sorted(automaton.iter('ushers')), [(3, 'he'), (3, 'she'), (5, 'hers')])
+
+
+class TestTickerTagger(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tagger = TickerTagger(UNIVERSE)
+
+    def test_counts_and_positions(self):
+        text = "Nvidia and $AAPL rose. NVIDIA Corporation said NVDA demand held."
+        tags = self.tagger.tag(text)
+        self.assertEqual(set(tags), {'NVDA', 'AAPL'})
+        self.assertEqual(tags['NVDA'].count, 3)
+        self.assertEqual([text[start:end] for start, end in tags['NVDA'].positions],
+                         ['Nvidia', 'NVIDIA Corporation', 'NVDA'])
+        self.assertEqual(tags['AAPL'].positions, [(11, 16)])
+        self.assertFalse(tags['NVDA'].ambiguous)
+
+    def test_word_boundaries(self):
+        self.assertEqual(self.tagger.tag("NVDAX and pineapple"), {})
+        self.assertIn('BRK.B', self.tagger.tag("Berkshire Hathaway bought more"))
+
+    def test_ambiguous_symbols(self):
+        self.assertEqual(self.tagger.tag("it was all on the news, a rally"), {})
+        tags = self.tagger.tag("Shares of ON and IT fell")
+        self.assertEqual(set(tags), {'ON', 'IT'})
+        self.assertTrue(tags['ON'].ambiguous)
+        # A cashtag, exchange prefix or name is enough on its own
+        for text in ("$ON rallied", "nasdaq: on rallied", "ON Semiconductor raised guidance"):
+            self.assertFalse(self.tagger.tag(text)['ON'].ambiguous, text)
+        # Single letters never count bare
+        self.assertNotIn('A', self.tagger.tag("A strong quarter"))
+        self.assertIn('A', self.tagger.tag("NYSE:A rose"))
+
+    def test_everyday_words_are_not_companies(self):
+        tagger = TickerTagger(UNIVERSE + [
+            {'symbol': 'UPS', 'shortName': 'United Parcel Service, Inc.'},
+            {'symbol': 'ICE', 'shortName': 'Intercontinental Exchange Inc.'},
+            {'symbol': 'MET', 'shortName': 'MetLife, Inc.'},
+            {'symbol': 'ED', 'shortName': 'Consolidated Edison, Inc.'},
+            {'symbol': 'IP', 'shortName': 'International Paper Company'},
+            {'symbol': 'MS', 'shortName': 'Morgan Stanley'},
+            {'symbol': 'DE', 'shortName': 'Deere & Company'},
+            {'symbol': 'TGT', 'shortName': 'Target Corporation'},
+            {'symbol': 'NWSA', 'shortName': 'News Corporation'},
+            {'symbol': 'MTCH', 'shortName': 'Match Group, Inc.'},
+            {'symbol': 'XYZ', 'shortName': 'Block, Inc.'},
+            {'symbol': 'FOXA', 'shortName': 'Fox Corporation'},
+        ])
+        for text in ("Markets had their ups and downs", "Sales of ice cream met expectations",
+                     "Demand is strong, said Ed", "Ms. Lopez de Silva", "Analysts raised the price target",
+                     "It was all over the news", "A close match", "A block trade", "On fox business"):
+            self.assertEqual(tagger.tag(text), {}, text)
+        # In capitals they're mentions, but some still need the model
+        self.assertFalse(tagger.tag("UPS delivered")['UPS'].ambiguous)
+        self.assertTrue(tagger.tag("IP risk")['IP'].ambiguous)
+        self.assertTrue(tagger.tag("Target raised guidance")['TGT'].ambiguous)
+        self.assertFalse(tagger.tag("$TGT and Target Corporation")['TGT'].ambiguous)
+
+        # Lowercased chunks only count what the page had in capitals
+        tags = tagger.tag_page("UPS beat. Target missed. The news was mixed.",
+                               ['ups beat.', 'target missed.', 'the news was mixed.'])
+        self.assertEqual(tags.chunks, [{'UPS'}, set(), set()])
+        self.assertEqual(tags.mentioned, [{'UPS'}, {'TGT'}, set()])
+
+    def test_agrees_with_lexical_matcher(self):
+        for info in UNIVERSE[:2]:
+            matcher = LexicalMatcher(info)
+            for articles in TEST_ARTICLES.values():
+                for _, url, content in articles:
+                    # The tagger reads symbols and ordinary-word names from the original case
+                    self.assertEqual(info['symbol'] in self.tagger.tag(content), matcher.matches(content.lower()), url)
+
+
+class TestTaggedRelevance(unittest.TestCase):
+
+    def setUp(self):
+        tagger.configure(UNIVERSE)
+        self.store = ArticleStore(PageCache(path=None))
+        self.retrieval = ArticleRetrieval()
+        self.retrieval.article_store = self.store
+
+    def tearDown(self):
+        tagger.configure(None)
+
+    def page(self, text, chunks):
+        self.store.put_page('https://news.example/story', Extraction.from_text(text), chunks)
+        return self.store.peek('https://news.example/story')
+
+    def test_lookup_without_the_model(self):
+        page = self.page("Nvidia beat estimates.\nApple Inc. was flat.", ['nvidia beat estimates.', 'apple inc. was flat.'])
+        self.assertEqual(self.retrieval.tagged_chunks(page, UNIVERSE[0]), ['nvidia beat estimates.'])
+        self.assertEqual(self.retrieval.tagged_chunks(page, UNIVERSE[1]), ['apple inc. was flat.'])
+        self.assertEqual(self.retrieval.tagged_chunks(page, UNIVERSE[2]), [])
+        self.assertEqual(self.retrieval.relevance_stats.tagged, 2)
+        self.assertEqual(self.retrieval.relevance_stats.model_calls, 0)
+
+    def test_ambiguous_symbol_left_to_the_model(self):
+        page = self.page("Shares of ON jumped.\nMarkets were calm.", ['shares of on jumped.', 'markets were calm.'])
+        self.assertIsNone(self.retrieval.tagged_chunks(page, UNIVERSE[3]))
+        self.assertEqual(self.retrieval.ambiguous_chunks(page, UNIVERSE[3]), ['shares of on jumped.'])
+        self.assertIsNone(self.retrieval.ambiguous_chunks(page, UNIVERSE[0]))
+
+    def test_unknown_symbol_left_to_the_model(self):
+        page = self.page("Broadcom rose.", ['broadcom rose.'])
+        self.assertIsNone(self.retrieval.tagged_chunks(page, {'symbol': 'AVGO', 'shortName': 'Broadcom Inc.'}))
+
+
+if __name__ == '__main__':
+    unittest.main()